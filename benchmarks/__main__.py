@@ -0,0 +1,61 @@
+""" Runs the benchmarks without asv: python -m benchmarks [name_filter]
+
+Prints the best time (of each benchmark's repeats) or the tracked value. As asv does,
+setup_cache and the benchmarks of each class run in a temporary directory (where the
+synthetic scans are written), deleted afterwards.
+"""
+import inspect
+import itertools
+import os
+import sys
+import tempfile
+import timeit
+from . import benchmarks
+
+
+def main(name_filter=''):
+    for class_name, cls in inspect.getmembers(benchmarks, inspect.isclass):
+        if cls.__module__ != benchmarks.__name__ or class_name.startswith('_'):
+            continue
+        methods = [name for name in dir(cls) if name.startswith(('time_', 'track_')) and
+                   name_filter in '{}.{}'.format(class_name, name)]
+        if not methods:
+            continue
+
+        # Parameter combinations
+        params = getattr(cls, 'params', [])
+        if params and not isinstance(params[0], (list, tuple)):
+            params = [params]
+        combinations = list(itertools.product(*params)) if params else [()]
+
+        cwd = os.getcwd()
+        cache_dir = tempfile.TemporaryDirectory(prefix='scanreader_benchmarks_')
+        os.chdir(cache_dir.name)
+        try:
+            cache = cls().setup_cache() if hasattr(cls, 'setup_cache') else None
+            for method_name, combination in itertools.product(methods, combinations):
+                instance = cls()
+                args = ([cache] if cache is not None else []) + list(combination)
+                if hasattr(instance, 'setup'):
+                    instance.setup(*args)
+                method = getattr(instance, method_name)
+                label = '{}.{}{}'.format(class_name, method_name, list(combination) if
+                                         combination else '')
+                if method_name.startswith('track_'):
+                    unit = getattr(method, 'unit', '')
+                    print('{:60} {:10.2f} {}'.format(label, method(*args), unit))
+                else:
+                    times = timeit.repeat(lambda: method(*args),
+                                          number=getattr(cls, 'number', 1),
+                                          repeat=getattr(cls, 'repeat', 5))
+                    best = min(times) / getattr(cls, 'number', 1)
+                    print('{:60} {:10.2f} ms'.format(label, best * 1000))
+                if hasattr(instance, 'teardown'):
+                    instance.teardown(*args)
+        finally:
+            os.chdir(cwd)
+            cache_dir.cleanup() # synthetic scans
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
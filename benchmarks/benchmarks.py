@@ -0,0 +1,378 @@
+""" Benchmarks for the open, index, read and export paths (airspeed velocity style).
+
+Scans are written with scanreader.testing.write_synthetic_scan once per benchmark class
+(setup_cache), in the current directory: asv runs setup_cache in a cache directory that it
+deletes afterwards (python -m benchmarks does the same). Run with `asv run` (see
+asv.conf.json) or, without asv, with `python -m benchmarks` from the repository root.
+"""
+import os
+import shutil
+import tempfile
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+import numpy as np
+import scanreader
+from scanreader import testing, demux
+
+# name: keyword arguments for write_synthetic_scan
+_ROIS = [dict(height=128, width=128, y=-4, x=0, height_in_degrees=8, width_in_degrees=8),
+         dict(height=128, width=128, y=4, x=0, height_in_degrees=8, width_in_degrees=8)]
+SCANS = {'5.1': dict(version='5.1', num_channels=2, depths=[0, 10, 20], frames=200,
+                     files=2, height=256, width=256),
+         '2016b': dict(version='2016b', num_channels=1, depths=[0, 10], frames=300,
+                       height=256, width=256),
+         '2018b_multiroi': dict(version='2018b', num_channels=1, depths=[0, 10, 20],
+                                frames=200, files=3, rois=_ROIS),
+         '5.1_stack': dict(version='5.1', num_channels=2, depths=list(range(0, 50, 5)),
+                           frames=20, height=256, width=256, slow_stack=True)}
+
+
+def write_scans(names=SCANS):
+    """ Writes the synthetic scans to the current (asv cache) directory.
+
+    Returns:
+        A dictionary mapping scan names to lists of filenames.
+    """
+    dirname = path.abspath('scans')
+    os.makedirs(dirname, exist_ok=True)
+    return {name: testing.write_synthetic_scan(path.join(dirname, name + '.tif'),
+                                               **SCANS[name]) for name in names}
+
+
+class OpenScan:
+    """ Time to open a scan and compute its metadata."""
+    params = list(SCANS)
+    param_names = ['scan']
+    number = 1
+    repeat = 10
+
+    def setup_cache(self):
+        return write_scans()
+
+    def time_read_scan(self, filenames, name):
+        scanreader.read_scan(filenames[name])
+
+    def time_num_frames(self, filenames, name):
+        # includes counting pages in each file (first access)
+        scanreader.read_scan(filenames[name]).num_frames
+
+
+class FrameAccess:
+    """ Reading a few frames of a field (sequential chunks or random frames)."""
+    params = ['5.1', '2018b_multiroi']
+    param_names = ['scan']
+
+    def setup_cache(self):
+        return write_scans(self.params)
+
+    def setup(self, filenames, name):
+        self.scan = scanreader.read_scan(filenames[name])
+        self.scan.num_frames # index pages
+        self.random_frames = list(np.random.RandomState(0).randint(self.scan.num_frames,
+                                                                    size=50))
+
+    def time_single_frame(self, filenames, name):
+        self.scan[0, :, :, 0, self.scan.num_frames // 2]
+
+    def time_sequential_frames(self, filenames, name):
+        for start in range(0, 100, 10):
+            self.scan[0, :, :, 0, start: start + 10]
+
+    def time_random_frames(self, filenames, name):
+        self.scan[0, :, :, 0, self.random_frames]
+
+    def time_strided_frames(self, filenames, name):
+        self.scan[0, :, :, 0, ::10]
+
+    def time_reversed_frames(self, filenames, name):
+        self.scan[0, :, :, 0, 99::-1]
+
+
+class SparseReads:
+    """ Strided frame reads with and without joining nearby pages in one request."""
+    params = [[-1, 2 ** 20, 2 ** 24], [2, 10]]
+    param_names = ['max_read_gap', 'step']
+    number = 1
+    repeat = 5
+
+    def setup_cache(self):
+        return write_scans(['5.1'])
+
+    def setup(self, filenames, max_read_gap, step):
+        self.scan = scanreader.read_scan(filenames['5.1'])
+        self.scan.num_frames # index pages
+        self.scan.max_read_gap = max_read_gap
+
+    def time_strided_frames(self, filenames, max_read_gap, step):
+        self.scan[0, :, :, 0, ::step]
+
+
+class WindowExtraction:
+    """ Reading overlapping windows of frames (one call per window or read_windows)."""
+    params = ['5.1', '2018b_multiroi']
+    param_names = ['scan']
+
+    def setup_cache(self):
+        return write_scans(self.params)
+
+    def setup(self, filenames, name):
+        self.scan = scanreader.read_scan(filenames[name])
+        self.scan.num_frames # index pages
+        self.starts = np.sort(np.random.RandomState(0).randint(self.scan.num_frames - 20,
+                                                               size=50))
+
+    def time_window_loop(self, filenames, name):
+        np.stack([self.scan[0, :, :, 0, start: start + 20] for start in self.starts])
+
+    def time_read_windows(self, filenames, name):
+        self.scan.read_windows(0, 0, self.starts, 20)
+
+
+class ManyKeys:
+    """ Many small reads (viewer-like): a loop of scan[key] calls or scan.read_many."""
+    params = ['5.1', '2018b_multiroi']
+    param_names = ['scan']
+
+    def setup_cache(self):
+        return write_scans(self.params)
+
+    def setup(self, filenames, name):
+        self.scan = scanreader.read_scan(filenames[name])
+        self.scan.num_frames # index pages
+        rng = np.random.RandomState(0)
+        self.keys = []
+        for _ in range(200):
+            field, frame = rng.randint(self.scan.num_fields), rng.randint(self.scan.num_frames)
+            self.keys.append((field, slice(None), slice(None), 0, slice(frame, frame + 3)))
+
+    def time_getitem_loop(self, filenames, name):
+        [self.scan[key] for key in self.keys]
+
+    def time_read_many(self, filenames, name):
+        self.scan.read_many(self.keys)
+
+    def track_read_many_speedup(self, filenames, name):
+        """ Time of the loop / time of read_many (read_many should be > 1x faster)."""
+        start = time.perf_counter()
+        [self.scan[key] for key in self.keys]
+        loop_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        self.scan.read_many(self.keys)
+        return loop_seconds / (time.perf_counter() - start)
+    track_read_many_speedup.unit = 'x'
+
+
+class FieldCacheReads:
+    """ Reading a field from the tiff files or from a (warm) field cache on local disk."""
+    params = ['5.1', '2018b_multiroi']
+    param_names = ['scan']
+
+    def setup_cache(self):
+        return write_scans(self.params)
+
+    def setup(self, filenames, name):
+        from scanreader import cache
+        self.scan = scanreader.read_scan(filenames[name])
+        self.scan.num_frames # index pages
+        self.cache_dir = tempfile.mkdtemp(prefix='scanreader_field_cache_')
+        self.cached_scan = scanreader.read_scan(filenames[name])
+        self.cached_scan.field_cache = cache.FieldCache(self.cache_dir)
+        self.cached_scan[0, :, :, 0] # fill the cache
+
+    def teardown(self, filenames, name):
+        shutil.rmtree(self.cache_dir)
+
+    def time_from_tiffs(self, filenames, name):
+        self.scan[0, :, :, 0]
+
+    def time_from_field_cache(self, filenames, name):
+        self.cached_scan[0, :, :, 0]
+
+
+class SharedPageCacheReads:
+    """ Reading a field from the tiff files or from a (warm) page cache in shared memory."""
+    params = ['5.1', '2018b_multiroi']
+    param_names = ['scan']
+
+    def setup_cache(self):
+        return write_scans(self.params)
+
+    def setup(self, filenames, name):
+        from scanreader import cache
+        self.scan = scanreader.read_scan(filenames[name])
+        self.scan.num_frames # index pages
+        self.page_cache = cache.SharedPageCache('scanreader_benchmark_{}'.format(os.getpid()),
+                                                max_bytes=2 ** 28)
+        self.cached_scan = scanreader.read_scan(filenames[name])
+        self.cached_scan.page_cache = self.page_cache
+        self.cached_scan[0, :, :, 0] # fill the cache
+
+    def teardown(self, filenames, name):
+        self.page_cache.unlink()
+        self.page_cache.close()
+
+    def time_from_tiffs(self, filenames, name):
+        self.scan[0, :, :, 0]
+
+    def time_from_shared_cache(self, filenames, name):
+        self.cached_scan[0, :, :, 0]
+
+
+class FieldExtraction:
+    """ Reading every field of the scan (one at a time or in a single pass)."""
+    params = ['5.1', '2018b_multiroi']
+    param_names = ['scan']
+    number = 1
+    repeat = 5
+
+    def setup_cache(self):
+        return write_scans(self.params)
+
+    def setup(self, filenames, name):
+        self.scan = scanreader.read_scan(filenames[name])
+        self.scan.num_frames
+
+    def time_iterate_fields(self, filenames, name):
+        for field in self.scan:
+            pass
+
+    def time_extract_fields(self, filenames, name):
+        demux.extract_fields(self.scan)
+
+    def track_extract_speedup(self, filenames, name):
+        """ Time iterating fields / time of extract_fields, best of 3 runs each
+        (extract_fields should be no slower: >= 1x)."""
+        def best_seconds(function):
+            seconds = []
+            for _ in range(3):
+                start = time.perf_counter()
+                function()
+                seconds.append(time.perf_counter() - start)
+            return min(seconds)
+        iterate_seconds = best_seconds(lambda: [field for field in self.scan])
+        return iterate_seconds / best_seconds(lambda: demux.extract_fields(self.scan))
+    track_extract_speedup.unit = 'x'
+
+
+class MultiROIJoin:
+    """ Joining contiguous fields of multiROI scans."""
+    number = 1
+    repeat = 10
+
+    def setup_cache(self):
+        return write_scans(['2018b_multiroi'])
+
+    def time_read_scan_join_contiguous(self, filenames):
+        scanreader.read_scan(filenames['2018b_multiroi'], join_contiguous=True)
+
+    def time_read_joined_field(self, filenames):
+        scan = scanreader.read_scan(filenames['2018b_multiroi'], join_contiguous=True)
+        scan[0, :, :, :, :100]
+
+
+class ConcurrentReads:
+    """ Many threads reading random frames from the same scan object.
+
+    Threads run in parallel only while reading (os.preadv) and copying pages; parsing keys
+    and planning reads hold the GIL. With pages in the OS cache and few cores, more
+    threads do not read faster; they help when reads wait on the disk (or NFS).
+    """
+    params = [1, 2, 4, 8]
+    param_names = ['threads']
+    number = 1
+    repeat = 3
+
+    def setup_cache(self):
+        return write_scans(['5.1'])
+
+    def setup(self, filenames, num_threads):
+        self.scan = scanreader.read_scan(filenames['5.1'])
+        self.scan.num_frames # index pages
+        rng = np.random.RandomState(0)
+        self.keys = [(rng.randint(self.scan.num_fields), slice(None), slice(None),
+                      rng.randint(self.scan.num_channels),
+                      list(rng.randint(self.scan.num_frames, size=10))) for _ in range(200)]
+
+    def _read_all(self, num_threads):
+        with ThreadPoolExecutor(num_threads) as executor:
+            return sum(item.nbytes for item in executor.map(self.scan.__getitem__,
+                                                            self.keys))
+
+    def time_random_reads(self, filenames, num_threads):
+        self._read_all(num_threads)
+
+    def track_read_throughput(self, filenames, num_threads):
+        """ MB of pixel data returned per second."""
+        start = time.perf_counter()
+        num_bytes = self._read_all(num_threads)
+        return num_bytes / 2 ** 20 / (time.perf_counter() - start)
+    track_read_throughput.unit = 'MB/s'
+
+
+class AsyncClients:
+    """ Many coroutines requesting frames at once: scan.aread (batched) or scan[key] in the
+    default executor."""
+    params = [10, 100]
+    param_names = ['clients']
+    number = 1
+    repeat = 5
+
+    def setup_cache(self):
+        return write_scans(['5.1'])
+
+    def setup(self, filenames, num_clients):
+        self.scan = scanreader.read_scan(filenames['5.1'])
+        self.scan.num_frames # index pages
+        rng = np.random.RandomState(0)
+        self.keys = [[(rng.randint(self.scan.num_fields), slice(None), slice(None), 0,
+                       rng.randint(20)) for _ in range(10)] for _ in range(num_clients)]
+
+    def _serve(self, read):
+        async def client(keys):
+            return [await read(key) for key in keys]
+        async def main():
+            return await asyncio.gather(*[client(keys) for keys in self.keys])
+        asyncio.run(main())
+
+    def time_aread(self, filenames, num_clients):
+        self._serve(self.scan.aread)
+
+    def time_run_in_executor(self, filenames, num_clients):
+        async def read(key):
+            return await asyncio.get_running_loop().run_in_executor(None,
+                                                                    self.scan.__getitem__, key)
+        self._serve(read)
+
+
+class Export:
+    """ Exporting a scan to flat binary files."""
+    params = ['5.1', '2018b_multiroi']
+    param_names = ['scan']
+    number = 1
+    repeat = 3
+
+    def setup_cache(self):
+        return write_scans(self.params)
+
+    def setup(self, filenames, name):
+        self.scan = scanreader.read_scan(filenames[name])
+        self.dirname = tempfile.mkdtemp(prefix='scanreader_export_')
+
+    def teardown(self, filenames, name):
+        shutil.rmtree(self.dirname, ignore_errors=True)
+
+    def time_export_binary(self, filenames, name):
+        self.scan.export_binary(self.dirname)
+
+    def track_export_throughput(self, filenames, name):
+        """ MB of pixel data exported per second."""
+        start = time.perf_counter()
+        self.scan.export_binary(self.dirname)
+        seconds = time.perf_counter() - start
+        num_pixels = sum(field.height * field.width for field in self.scan.fields)
+        num_bytes = (num_pixels * self.scan.num_channels * self.scan.num_frames *
+                     np.dtype(self.scan.dtype).itemsize)
+        return num_bytes / 2 ** 20 / seconds
+    track_export_throughput.unit = 'MB/s'
@@ -1 +1,3 @@
-from .core import read_scan
\ No newline at end of file
+from .core import read_scan, read_remote_scan
+from .profiling import profile
+from .binary import open_binary
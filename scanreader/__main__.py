@@ -0,0 +1,30 @@
+""" Command line interface: python -m scanreader (or scanreader) <command>
+
+Commands:
+    serve: Runs a scan server for local clients (see server.py).
+"""
+import argparse
+from . import server
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='scanreader', description='ScanImage scan '
+                                     'reader.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve_parser = commands.add_parser('serve', help='serve scans to local processes '
+                                       'over a Unix socket')
+    serve_parser.add_argument('--socket', default=server.DEFAULT_SOCKET,
+                              help='path of the Unix socket (default: %(default)s)')
+    serve_parser.add_argument('--cache-size', type=int, default=1024,
+                              help='page cache size in MB (default: %(default)s)')
+    serve_parser.add_argument('--no-prefetch', action='store_true',
+                              help='do not prefetch the frames following each read')
+    args = parser.parse_args(args)
+
+    if args.command == 'serve':
+        print('Serving scans on {}'.format(args.socket))
+        server.serve(args.socket, args.cache_size * 2 ** 20, not args.no_prefetch)
+
+
+if __name__ == '__main__':
+    main()
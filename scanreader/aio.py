@@ -0,0 +1,214 @@
+""" asyncio reads.
+
+scan[key] blocks, so calling it from a coroutine stalls the event loop for the whole read.
+await scan.aread(key) instead hands the read to a bounded thread pool (MAX_WORKERS
+threads shared by all scans) and waits without blocking the loop. Requests are coalesced:
+requests for a scan made (from the same event loop) while earlier batches are being read
+wait and are read together with a single scan.read_many call, so pages needed by several
+clients are read once; a key that is already being read waits for that read.
+
+Cancelling a request that has not started yet drops it from its batch; reads already
+running in a thread finish but their results are discarded. scan.aiter_chunks(key) reads
+scan[key] in chunks of frames, prefetching the next chunk while the current one is used.
+
+Example:
+    async def handle_request(scan, field, frame):
+        return await scan.aread((field, slice(None), slice(None), 0, frame))
+
+    async for chunk in scan.aiter_chunks((0, slice(None), slice(None), 0)):
+        ...
+"""
+import asyncio
+import threading
+import weakref
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_WORKERS = 4 # threads reading for coroutines (shared by all scans)
+_CHUNK_BYTES = 2 ** 26 # aim for ~64 MB per chunk in aiter_chunks
+_MAX_IN_FLIGHT = 2 # batches read at a time per scan and event loop
+
+_executor = None
+_lock = threading.Lock()
+_batchers = weakref.WeakKeyDictionary() # scan: {event loop: _Batcher}
+
+
+def get_executor():
+    """ Thread pool used for reads (created when first needed)."""
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(MAX_WORKERS,
+                                               thread_name_prefix='scanreader-aio')
+    return _executor
+
+
+async def aread(scan, key):
+    """ Reads scan[key] in a worker thread, batched with concurrent requests.
+
+    Args:
+        scan: A Scan object (subclass of BaseScan).
+        key: Tuple of indices or single index. As in scan[key].
+
+    Returns:
+        Same as scan[key].
+    """
+    loop = asyncio.get_running_loop()
+    with _lock:
+        loop_batchers = _batchers.setdefault(scan, weakref.WeakKeyDictionary())
+        if loop not in loop_batchers:
+            loop_batchers[loop] = _Batcher(scan, loop)
+        batcher = loop_batchers[loop]
+    return await batcher.submit(key)
+
+
+async def aiter_chunks(scan, key=slice(None), chunk_size=None):
+    """ Reads scan[key] in chunks of consecutive frames (the next chunk is read while the
+    current one is used).
+
+    Args:
+        scan: A Scan object (subclass of BaseScan).
+        key: Tuple of indices or single index. As in scan[key].
+        chunk_size: Integer. Number of frames per chunk. Defaults to as many frames as fit
+            in ~64 MB.
+
+    Yields:
+        Arrays as scan[key] with (up to) chunk_size frames each. A single item if frames
+            were indexed with an integer.
+    """
+    loop = asyncio.get_running_loop()
+    full_key, *index_lists = await loop.run_in_executor(get_executor(), scan._parse_key,
+                                                        key)
+    field_list, y_lists, x_lists, channel_list, frame_list = index_lists
+    if np.issubdtype(type(full_key[4]), np.signedinteger) or len(frame_list) == 0:
+        yield await aread(scan, full_key)
+        return
+    if chunk_size is None:
+        frame_bytes = (len(field_list) * len(y_lists[0]) * len(x_lists[0]) *
+                       len(channel_list) * np.dtype(scan.dtype).itemsize)
+        chunk_size = _CHUNK_BYTES // max(1, frame_bytes)
+    chunk_size = max(1, chunk_size)
+
+    chunk_keys = [full_key[:4] + (frame_list[start: start + chunk_size], ) for start in
+                  range(0, len(frame_list), chunk_size)]
+    next_chunk = asyncio.ensure_future(aread(scan, chunk_keys[0]))
+    try:
+        for next_key in chunk_keys[1:] + [None]:
+            chunk = await next_chunk
+            if next_key is not None: # prefetch
+                next_chunk = asyncio.ensure_future(aread(scan, next_key))
+            yield chunk
+    finally:
+        next_chunk.cancel() # if the consumer stopped early
+
+
+class _Request():
+    """ A key and the futures of everyone waiting for it."""
+    def __init__(self, key):
+        self.key = key
+        self.futures = []
+
+
+class _Batcher():
+    """ Collects the requests for a scan made from one event loop and reads them in
+    batches. At most _MAX_IN_FLIGHT batches are read at a time: requests arriving
+    meanwhile wait and form the next batch, and requests for a key already being read
+    wait for that read."""
+    def __init__(self, scan, loop):
+        self.scan = weakref.ref(scan) # batchers are stored per scan, do not keep it alive
+        self.loop = loop
+        self.pending = {} # hashable key: _Request (waiting for a batch)
+        self.running = {} # hashable key: _Request (being read)
+        self.num_in_flight = 0
+        self.is_scheduled = False
+
+    def submit(self, key):
+        future = self.loop.create_future()
+        try:
+            hashable_key = _hashable(key)
+        except TypeError: # not hashable (invalid key): read on its own, raise from there
+            hashable_key = object()
+        if hashable_key in self.running:
+            self.running[hashable_key].futures.append(future)
+            return future
+        if hashable_key not in self.pending:
+            self.pending[hashable_key] = _Request(key)
+        self.pending[hashable_key].futures.append(future)
+        self._schedule()
+        return future
+
+    def _schedule(self):
+        if self.pending and not self.is_scheduled and self.num_in_flight < _MAX_IN_FLIGHT:
+            self.loop.call_soon(self._flush) # after the requests made in this iteration
+            self.is_scheduled = True
+
+    def _flush(self):
+        self.is_scheduled = False
+        pending, self.pending = self.pending, {}
+        pending = {hashable_key: request for hashable_key, request in pending.items() if
+                   not all(future.cancelled() for future in request.futures)} # wanted
+        if not pending:
+            return
+        self.running.update(pending)
+        self.num_in_flight += 1
+        read = self.loop.run_in_executor(get_executor(), _read_batch, self.scan(),
+                                         [request.key for request in pending.values()])
+        read.add_done_callback(lambda read: self._deliver(pending, read))
+
+    def _deliver(self, batch, read):
+        """ Sets the result of every future waiting on a batch (in the event loop)."""
+        self.num_in_flight -= 1
+        for hashable_key in batch:
+            del self.running[hashable_key]
+        if read.cancelled():
+            results = [None] * len(batch)
+        elif read.exception() is not None:
+            results = [read.exception()] * len(batch)
+        else:
+            results = read.result()
+
+        for request, result in zip(batch.values(), results):
+            futures = [future for future in request.futures if not future.done()]
+            for i, future in enumerate(futures):
+                if read.cancelled():
+                    future.cancel()
+                elif isinstance(result, BaseException):
+                    future.set_exception(result)
+                else: # one array per requester
+                    future.set_result(result if i == 0 else result.copy())
+        self._schedule() # next batch
+
+
+def _read_batch(scan, keys):
+    """ Reads keys with one read_many call (in a worker thread).
+
+    Returns:
+        A list with the item (or the exception raised) for each key.
+    """
+    results = [None] * len(keys)
+    valid_positions = []
+    for i, key in enumerate(keys): # an invalid key only fails its own request
+        try:
+            scan._parse_key(key)
+            valid_positions.append(i)
+        except Exception as error:
+            results[i] = error
+    if valid_positions:
+        items = scan.read_many([keys[i] for i in valid_positions])
+        for i, item in zip(valid_positions, items):
+            results[i] = item
+    return results
+
+
+def _hashable(key):
+    """ Hashable version of a key (used to find identical requests)."""
+    if isinstance(key, tuple):
+        return tuple(_hashable(index) for index in key)
+    if isinstance(key, slice):
+        return ('slice', key.start, key.stop, key.step)
+    if isinstance(key, (list, np.ndarray)):
+        return ('list', ) + tuple(_hashable(index) for index in key)
+    if np.issubdtype(type(key), np.signedinteger):
+        return ('int', int(key)) # not equal to floats or booleans (invalid indices)
+    return key
@@ -0,0 +1,220 @@
+""" Flat binary export of scans and a memory-mapped reader for the exported files.
+
+Each exported field/channel is a C-ordered frames x height x width array in its own file
+(the layout Suite2p uses for data.bin). A JSON sidecar next to them stores the shape of
+each field, the dtype and the scan metadata so the files can be reopened without the
+original tiffs.
+
+Example:
+    scan = scanreader.read_scan('my_scan_*.tif')
+    scan.export_binary('/scratch/my_scan', fields=[0, 1], channels=[0])
+    binary_scan = scanreader.open_binary('/scratch/my_scan')
+    field = binary_scan[0, :, :, 0, :1000] # same indexing as scan objects
+"""
+import json
+import os
+from os import path
+import numpy as np
+from . import utils
+from . import demux
+from . import views
+from . import reductions
+from .exceptions import FieldDimensionMismatch, PathnameError
+
+SIDECAR_FILENAME = 'scan.json'
+_FORMAT_VERSION = 1
+
+
+def export_binary(scan, dirname, fields=None, channels=None, chunk_size=None):
+    """ Writes scan fields to flat binary files (one per field and channel).
+
+    Pages are read once, in disk order, even if they hold more than one of the requested
+    fields (multiROI scans). See demux.demultiplex().
+
+    Args:
+        scan: A Scan object (subclass of BaseScan).
+        dirname: String. Directory where files will be written (created if needed).
+        fields: Integer or list of integers. Fields to export. Defaults to all fields.
+        channels: Integer or list of integers. Channels to export. Defaults to all.
+        chunk_size: Integer. Number of frames read at a time. Defaults to as many frames
+            as fit in ~16 MB.
+
+    Returns:
+        A string. Filename of the JSON sidecar.
+    """
+    field_list = utils.listify_selection(0, fields, scan.num_fields)
+    channel_list = utils.listify_selection(3, channels, scan.num_channels)
+    all_fields = scan.fields
+    scan_fields = [all_fields[field_id] for field_id in field_list]
+    num_frames = scan.num_frames
+
+    # Write one file per field and channel (in a single pass over the scan)
+    os.makedirs(dirname, exist_ok=True)
+    filenames = [['field{}_channel{}.bin'.format(field_id, channel) for channel in
+                  channel_list] for field_id in field_list]
+    sinks = {(field_id, channel): demux.BinarySink(path.join(dirname, filename)) for
+             field_id, field_filenames in zip(field_list, filenames) for
+             channel, filename in zip(channel_list, field_filenames)}
+    demux.demultiplex(scan, sinks, chunk_size)
+
+    # Write sidecar
+    sidecar = {
+        'format_version': _FORMAT_VERSION,
+        'dtype': np.dtype(scan.dtype).str,
+        'num_frames': num_frames,
+        'channels': channel_list,
+        'fields': [{'scan_field': field_id, 'height': field.height, 'width': field.width,
+                    'depth': field.depth, 'files': field_filenames} for
+                   field_id, field, field_filenames in zip(field_list, scan_fields,
+                                                           filenames)],
+        'metadata': {'version': scan.version, 'fps': scan.fps,
+                     'is_slow_stack': scan.is_slow_stack,
+                     'is_multiROI': scan.is_multiROI,
+                     'is_bidirectional': scan.is_bidirectional,
+                     'seconds_per_line': scan.seconds_per_line,
+                     'spatial_fill_fraction': scan.spatial_fill_fraction,
+                     'temporal_fill_fraction': scan.temporal_fill_fraction,
+                     'raster_phase': scan.raster_phase},
+        'header': scan.header,
+    }
+    sidecar_filename = path.join(dirname, SIDECAR_FILENAME)
+    with open(sidecar_filename, 'w') as f:
+        json.dump(sidecar, f, indent=2)
+
+    return sidecar_filename
+
+
+def open_binary(dirname):
+    """ Opens a scan exported with export_binary().
+
+    Args:
+        dirname: String. Directory with the binary files and the JSON sidecar.
+
+    Returns:
+        A BinaryScan object. Indexable and iterable as scans returned by read_scan().
+    """
+    if not path.isfile(path.join(dirname, SIDECAR_FILENAME)):
+        error_msg = 'Could not find {} in {}'.format(SIDECAR_FILENAME, dirname)
+        raise PathnameError(error_msg)
+
+    return BinaryScan(dirname)
+
+
+class BinaryScan():
+    """ Scan exported to flat binary files. Data is memory-mapped, not read into memory.
+
+    Binary scans are indexed as scans returned by read_scan(): scan[field, y, x, channel,
+    frame] works as long as the fields' spatial dimensions (y, x) match and
+    'for field in scan:' iterates over all fields (4-d arrays: [y, x, channels, frames]).
+
+    Attributes:
+        dirname: String. Directory with the binary files.
+        dtype: Data type of the stored arrays.
+        header: String. ScanImage header of the original scan.
+        metadata: Dictionary. Some useful properties of the original scan (version,
+            fps, etc.)
+    """
+    def __init__(self, dirname):
+        self.dirname = dirname
+        with open(path.join(dirname, SIDECAR_FILENAME)) as f:
+            self._sidecar = json.load(f)
+        self.dtype = np.dtype(self._sidecar['dtype'])
+        self.header = self._sidecar['header']
+        self.metadata = self._sidecar['metadata']
+        self._memmaps = [[self._open_memmap(filename, field['height'], field['width'])
+                          for filename in field['files']] for field in
+                         self._sidecar['fields']]
+
+    def _open_memmap(self, filename, height, width):
+        shape = (self.num_frames, height, width)
+        if self.num_frames == 0: # numpy cannot map empty files
+            return np.empty(shape, dtype=self.dtype)
+        return np.memmap(path.join(self.dirname, filename), dtype=self.dtype, mode='r',
+                         shape=shape)
+
+    @property
+    def version(self):
+        return self.metadata['version']
+
+    @property
+    def fps(self):
+        return self.metadata['fps']
+
+    @property
+    def num_fields(self):
+        return len(self._sidecar['fields'])
+
+    @property
+    def num_channels(self):
+        return len(self._sidecar['channels'])
+
+    @property
+    def num_frames(self):
+        return self._sidecar['num_frames']
+
+    @property
+    def field_heights(self):
+        return [field['height'] for field in self._sidecar['fields']]
+
+    @property
+    def field_widths(self):
+        return [field['width'] for field in self._sidecar['fields']]
+
+    @property
+    def field_depths(self):
+        return [field['depth'] for field in self._sidecar['fields']]
+
+    @property
+    def shape(self):
+        if len(set(self.field_heights)) > 1 or len(set(self.field_widths)) > 1:
+            raise FieldDimensionMismatch('Image dimensions for all fields do not match')
+        return (self.num_fields, self.field_heights[0], self.field_widths[0],
+                self.num_channels, self.num_frames)
+
+    @property
+    def view(self):
+        """ Lazy view of the scan: scan.view[key] composes indices without reading (see
+        views.ScanView)."""
+        return views.ScanView(self)
+
+    def __array__(self, dtype=None, copy=None):
+        item = self[:]
+        return item if dtype is None else item.astype(dtype, copy=False)
+
+    def __array_function__(self, func, types, args, kwargs):
+        """ Reductions (np.mean, np.max, ...) stream over frames; see reductions.py."""
+        return reductions.array_function(self, self.view, func, args, kwargs)
+
+    def __len__(self):
+        return self.num_fields
+
+    def __iter__(self):
+        return (self[i] for i in range(self.num_fields))
+
+    def __getitem__(self, key):
+        # Check the key as scans do (see utils.parse_key)
+        full_key, field_list, y_lists, x_lists, channel_list, frame_list = utils.parse_key(
+            key, self.num_fields, self.field_heights, self.field_widths, self.num_channels,
+            self.num_frames)
+
+        # Edge case when slice index gives 0 elements or index is empty list
+        if [] in [field_list, *y_lists, *x_lists, channel_list, frame_list]:
+            return np.empty(0)
+
+        # Slices are applied to the memmaps directly (only required data is read)
+        as_index = lambda index, index_list: index if isinstance(index, slice) else index_list
+        item = np.empty([len(field_list), len(y_lists[0]), len(x_lists[0]),
+                        len(channel_list), len(frame_list)], dtype=self.dtype)
+        for i, (field_id, y_list, x_list) in enumerate(zip(field_list, y_lists, x_lists)):
+            for j, channel in enumerate(channel_list):
+                frames = self._memmaps[field_id][channel][as_index(full_key[4], frame_list)]
+                frames = frames[:, as_index(full_key[1], y_list)]
+                frames = frames[:, :, as_index(full_key[2], x_list)]
+                item[i, :, :, j, :] = np.moveaxis(frames, 0, -1)
+
+        # If original index was an integer, delete that axis (as in numpy indexing)
+        squeeze_dims = [i for i, index in enumerate(full_key) if np.issubdtype(type(index),
+                                                                               np.signedinteger)]
+        item = np.squeeze(item, axis=tuple(squeeze_dims))
+
+        return item
@@ -0,0 +1,558 @@
+""" Caches in front of the tiff files.
+
+Page cache: a scan with a page cache (scan.page_cache) looks pages up in it before reading
+them from the tiff files and stores the pages it reads. Pages are keyed by the identity of
+their file (path, device, inode, size and modification time; see pageio.FileLayout) and
+their index in it, so one cache can be shared by any number of scans (even of the same
+files) and pages of a modified file are never returned. A PageCache lives in the memory
+of one process; a SharedPageCache holds pages in shared memory for every process on the
+machine, so pages read by one worker are not read (or held in memory) again by the others.
+New scans use default_page_cache.
+
+Field cache: a scan with a field cache (scan.field_cache) reads fields from a local
+directory (e.g., an SSD in front of network storage) in blocks of consecutive frames of
+one field and channel, as returned by scan[...] (assembled from subfields and raster
+corrected). Blocks missing from the directory are read from the tiff files (whole blocks,
+all rows and columns) and written there; the least recently used blocks are deleted when
+the directory exceeds its size limit. Blocks are keyed by the identity of the scan files,
+the field geometry, dtype, raster phase and frame remapping, so several processes (and
+scans) can share a directory and stale blocks are never used.
+
+Example:
+    page_cache = cache.PageCache(max_bytes=4 * 2 ** 30)
+    scan.page_cache = page_cache
+    other_scan.page_cache = page_cache
+
+    cache.default_page_cache = cache.SharedPageCache(max_bytes=16 * 2 ** 30) # every worker
+    scan = scanreader.read_scan(filenames) # uses it
+
+    scan.field_cache = cache.FieldCache('/scratch/scanreader_cache', max_bytes=200 * 2 ** 30)
+    field = scan[0, :, :, 0] # read from the tiffs (and stored)
+    field = scan[0, :, :, 0] # read from /scratch
+"""
+import collections
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import numpy as np
+from multiprocessing import shared_memory
+from . import profiling
+from . import utils
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
+default_page_cache = None # page cache of new scans (e.g., a SharedPageCache)
+
+# Layout of SharedPageCache slabs: header (int64 values), index, slots
+_HEADER = ['magic', 'num_slots', 'slot_bytes', 'hand', 'hits', 'misses']
+_MAGIC = int.from_bytes(b'scanrdr2', 'little')
+_PROBES = 8 # buckets a key can be in (see SharedPageCache)
+
+
+class PageCache():
+    """ Least-recently-used cache of pages in memory (thread-safe).
+
+    Attributes:
+        max_bytes: Integer. Maximum size of the cached pages; least recently used pages
+            are evicted to make room for new ones.
+        nbytes: Integer. Size of the pages in the cache.
+        hits: Integer. Pages found in the cache.
+        misses: Integer. Pages looked up but not found.
+    """
+    def __init__(self, max_bytes=2 ** 30):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._pages = collections.OrderedDict() # (file identity, page): page array
+        self._lock = threading.Lock()
+
+    def get(self, file_identity, page_ids):
+        """ Looks pages up.
+
+        Args:
+            file_identity: Tuple. Identity of the file (pageio.FileLayout.identity).
+            page_ids: List of integers. Pages to look up (indices in the file).
+
+        Returns:
+            A list with the page (a height x width array) or None for each page.
+        """
+        pages = []
+        with self._lock:
+            for page_id in page_ids:
+                page = self._pages.get((file_identity, page_id))
+                if page is not None:
+                    self._pages.move_to_end((file_identity, page_id))
+                pages.append(page)
+            num_hits = sum(page is not None for page in pages)
+            self.hits += num_hits
+            self.misses += len(pages) - num_hits
+        return pages
+
+    def put(self, file_identity, page_ids, pages):
+        """ Stores (copies of) pages, evicting the least recently used ones if needed.
+
+        Args:
+            file_identity: Tuple. Identity of the file (pageio.FileLayout.identity).
+            page_ids: List of integers. Indices of the pages in the file.
+            pages: Array or list of arrays. One height x width page per page id.
+        """
+        with self._lock:
+            for page_id, page in zip(page_ids, pages):
+                if page.nbytes > self.max_bytes:
+                    continue
+                key = (file_identity, page_id)
+                if key in self._pages:
+                    self._pages.move_to_end(key)
+                    continue
+                self._pages[key] = np.array(page) # own copy
+                self.nbytes += page.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._pages.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self._pages)
+
+
+class FieldCache():
+    """ Disk cache of blocks of frames of each field and channel (thread and process
+    safe).
+
+    Attributes:
+        directory: String. Where blocks are stored (created if needed).
+        max_bytes: Integer. Maximum size of the stored blocks; least recently used blocks
+            are deleted to make room for new ones.
+        block_bytes: Integer. Approximate size of each block (blocks have as many frames
+            as fit).
+        hits: Integer. Blocks read from the directory.
+        misses: Integer. Blocks read from the tiff files.
+    """
+    def __init__(self, directory, max_bytes=50 * 2 ** 30, block_bytes=2 ** 26):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.block_bytes = block_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock() # evictions of this process
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def nbytes(self):
+        """ Size of the blocks in the directory (stored by any process)."""
+        return sum(size for _, size, _ in self._list_blocks())
+
+    def read_item(self, scan, full_key, field_list, y_lists, x_lists, channel_list,
+                  frame_list):
+        """ Reads the data defined by the lists of indices (as returned by _parse_key)
+        from cached blocks. Same as scan._read_item.
+
+        Returns:
+            A 5-D array (num_fields, num_ys, num_xs, num_channels, num_frames).
+        """
+        # Filled frame by frame (as blocks are stored), returned as a transposed view
+        item = np.empty([len(frame_list), len(field_list), len(channel_list), len(y_lists[0]),
+                         len(x_lists[0])], dtype=scan.dtype)
+        frames = np.asarray(frame_list, dtype=np.int64)
+        for i, (field_id, y_list, x_list) in enumerate(zip(field_list, y_lists, x_lists)):
+            field = scan.fields[field_id]
+            block_frames = max(1, self.block_bytes // (field.height * field.width *
+                                                       np.dtype(scan.dtype).itemsize))
+            block_ids = frames // block_frames
+            for j, channel in enumerate(channel_list):
+                for block_id in np.unique(block_ids):
+                    positions = np.flatnonzero(block_ids == block_id)
+                    block, is_hit = self._block(scan, field_id, channel, int(block_id),
+                                                block_frames)
+                    if is_hit:
+                        profiling.count(cache_hits=len(positions))
+                    with profiling.stage('copy'):
+                        data = block[utils.as_index(frames[positions] - block_id * block_frames)]
+                        data = data[:, utils.as_index(y_list)][:, :, utils.as_index(x_list)]
+                        item[utils.as_index(positions), i, j] = data
+                    del block, data
+
+        with profiling.stage('reshape'):
+            item = item.transpose([1, 3, 4, 2, 0])
+
+        return item
+
+    def _block(self, scan, field_id, channel, block_id, block_frames):
+        """ Block of frames (frames x height x width) from the directory (memory-mapped)
+        or read from the scan (and stored).
+
+        Returns:
+            The block and whether it was found in the directory.
+        """
+        filename = self._block_name(scan, field_id, channel, block_id, block_frames)
+        path = os.path.join(self.directory, filename)
+        try:
+            with profiling.stage('read'):
+                block = np.load(path, mmap_mode='r')
+        except (FileNotFoundError, ValueError): # missing (or being replaced)
+            pass
+        else:
+            try:
+                os.utime(path) # most recently used (evictions go by modification time)
+            except FileNotFoundError: # evicted meanwhile (the memory map stays valid)
+                pass
+            with self._lock:
+                self.hits += 1
+            return block, True
+
+        # Read from the tiff files
+        start = block_id * block_frames
+        key = (field_id, slice(None), slice(None), channel,
+               slice(start, min(start + block_frames, scan.num_frames)))
+        block = scan._read_item(*scan._parse_key(key))[0, :, :, 0].transpose([2, 0, 1])
+        block = np.ascontiguousarray(block)
+
+        # Store it (written to a temporary file and renamed: readers never see a partial
+        # block)
+        temp_path = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+        with open(temp_path, 'wb') as temp_file:
+            np.save(temp_file, block)
+        os.replace(temp_path, path)
+        with self._lock:
+            self.misses += 1
+            self._evict(keep=filename)
+
+        return block, False
+
+    def _list_blocks(self):
+        """ Blocks in the directory (stored by any process), least recently used first.
+
+        Returns:
+            A list of (filename, size in bytes, modification time) tuples.
+        """
+        blocks = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.npy'):
+                try:
+                    entry_stat = entry.stat()
+                except FileNotFoundError: # evicted by another process
+                    continue
+                blocks.append((entry.name, entry_stat.st_size, entry_stat.st_mtime))
+        return sorted(blocks, key=lambda block: block[2])
+
+    def _evict(self, max_bytes=None, keep=None):
+        """ Deletes least recently used blocks (listing the directory, so blocks stored by
+        other processes count) until the directory fits in max_bytes.
+
+        Args:
+            max_bytes: Integer. Defaults to self.max_bytes.
+            keep: String. Filename of a block not to delete (the one just stored).
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        blocks = self._list_blocks()
+        total_bytes = sum(size for _, size, _ in blocks)
+        for filename, size, _ in blocks:
+            if total_bytes <= max_bytes:
+                break
+            if filename == keep:
+                continue
+            try:
+                os.remove(os.path.join(self.directory, filename))
+            except FileNotFoundError: # already evicted by another process
+                pass
+            total_bytes -= size
+
+    def _block_name(self, scan, field_id, channel, block_id, block_frames):
+        """ Filename of a block: hash of everything that determines its content."""
+        field = scan.fields[field_id]
+        geometry = [field.slice_id, field.height, field.width] + [
+            [s.start, s.stop] for slices in [field.yslices, field.xslices,
+                                             field.output_yslices, field.output_xslices]
+            for s in slices]
+        page_map = scan._page_map
+        description = json.dumps([[list(layout.identity) for layout in scan.file_layouts],
+                                  np.dtype(scan.dtype).str, scan.raster_phase,
+                                  None if page_map is None else
+                                  hashlib.sha1(page_map.tobytes()).hexdigest(),
+                                  geometry, channel, block_id, block_frames])
+        return hashlib.sha1(description.encode()).hexdigest() + '.npy'
+
+    def clear(self):
+        """ Deletes every block."""
+        with self._lock:
+            self._evict(max_bytes=-1)
+
+    def __len__(self):
+        return len(self._list_blocks())
+
+
+class SharedPageCache():
+    """ Page cache in shared memory, shared by every process on the machine that opens it
+    with the same name (thread and process safe). Same interface as PageCache.
+
+    Pages are stored in a fixed-size slab (multiprocessing.shared_memory) divided in
+    slots of slot_bytes; pages larger than a slot are not cached. Next to the slots, an
+    open-addressing hash table (twice as many buckets as slots) maps a 64-bit hash of
+    each key (file identity and page) to its slot: a key with hash h is in one of the
+    _PROBES buckets that follow bucket h % num_buckets. Lookups take no lock: they probe
+    those buckets and copy the page out of its slot, and a version number per slot (odd
+    while the slot is written, see _read) tells them if it changed meanwhile (a seqlock).
+    Insertions take a short lock (a file lock across processes, plus a thread lock) and
+    slots are evicted with the CLOCK algorithm (an approximation of least-recently-used
+    where a hit only sets a flag).
+
+    The slab outlives the processes that use it (so short-lived workers keep finding
+    pages); call unlink() to free it. Processes opening an existing slab use its size,
+    not max_bytes and slot_bytes.
+
+    Attributes:
+        name: String. Name of the shared memory slab.
+        num_slots: Integer. Number of pages that fit in the slab.
+        slot_bytes: Integer. Size of each slot (largest page that can be cached).
+        hits: Integer. Pages found in the cache (by all processes; updated without locks,
+            so concurrent lookups may be missed).
+        misses: Integer. Pages looked up but not found (by all processes; as hits).
+    """
+    def __init__(self, name='scanreader_page_cache', max_bytes=2 ** 30, slot_bytes=2 ** 19):
+        if fcntl is None:
+            raise NotImplementedError('shared page caches need fcntl (not on Windows)')
+        self.name = name
+        self._thread_lock = threading.Lock()
+        self._lock_file = open(os.path.join(tempfile.gettempdir(), name + '.lock'), 'a+b')
+
+        # Create (or open) and lay out the slab
+        with self._locked():
+            try:
+                num_slots = max(1, max_bytes // slot_bytes)
+                self._shm = shared_memory.SharedMemory(name, create=True, size=(
+                    _data_offset(num_slots) + num_slots * slot_bytes))
+                _untrack(self._shm)
+                header = np.ndarray(len(_HEADER), np.int64, buffer=self._shm.buf)
+                header[[_HEADER.index('num_slots'), _HEADER.index('slot_bytes')]] = [
+                    num_slots, slot_bytes]
+                header[_HEADER.index('magic')] = _MAGIC # initialized
+            except FileExistsError:
+                self._shm = shared_memory.SharedMemory(name)
+                _untrack(self._shm)
+                header = np.ndarray(len(_HEADER), np.int64, buffer=self._shm.buf)
+                if header[_HEADER.index('magic')] != _MAGIC:
+                    raise ValueError('shared memory {} is not a page cache'.format(name))
+        self._header = header
+        self.num_slots = int(header[_HEADER.index('num_slots')])
+        self.slot_bytes = int(header[_HEADER.index('slot_bytes')])
+
+        # Index: key hash, version, shape, dtype and CLOCK reference bit of each slot and
+        # key hash and slot of each bucket
+        offset = len(_HEADER) * 8
+        self._num_buckets = 2 * self.num_slots
+        fields = [('keys', self.num_slots, np.uint64, ()),
+                  ('versions', self.num_slots, np.uint64, ()),
+                  ('shapes', self.num_slots, np.int64, (2, )),
+                  ('dtypes', self.num_slots, 'S4', ()),
+                  ('referenced', self.num_slots, np.uint8, ()),
+                  ('bucket_keys', self._num_buckets, np.uint64, ()),
+                  ('bucket_slots', self._num_buckets, np.int64, ())]
+        for field, length, dtype, shape in fields:
+            array = np.ndarray((length, *shape), dtype, buffer=self._shm.buf, offset=offset)
+            setattr(self, '_' + field, array)
+            offset += array.nbytes
+        self._slots = np.ndarray((self.num_slots, self.slot_bytes), np.uint8,
+                                 buffer=self._shm.buf, offset=_data_offset(self.num_slots))
+
+    @property
+    def hits(self):
+        return int(self._header[_HEADER.index('hits')])
+
+    @property
+    def misses(self):
+        return int(self._header[_HEADER.index('misses')])
+
+    @property
+    def nbytes(self):
+        """ Size of the cached pages."""
+        with self._locked():
+            is_used = self._keys != 0
+            return int(np.sum(np.prod(self._shapes[is_used], axis=1) *
+                              [np.dtype(dtype.decode()).itemsize for dtype in
+                               self._dtypes[is_used]]))
+
+    def get(self, file_identity, page_ids):
+        """ Looks pages up (without locks). See PageCache.get."""
+        hashes = _hash_keys(file_identity, page_ids)
+        pages = [None] * len(page_ids)
+        for i, slot_id in enumerate(self._find(hashes)):
+            if slot_id >= 0:
+                pages[i] = self._read(slot_id, hashes[i])
+        num_hits = sum(page is not None for page in pages)
+        self._header[_HEADER.index('hits')] += num_hits
+        self._header[_HEADER.index('misses')] += len(page_ids) - num_hits
+        return pages
+
+    def put(self, file_identity, page_ids, pages):
+        """ Stores pages, evicting others if needed. See PageCache.put."""
+        hashes = _hash_keys(file_identity, page_ids)
+        with self._locked():
+            for key_hash, page in zip(hashes, pages):
+                slot_id = self._find(key_hash[None])[0] # also finds pages stored in this call
+                if slot_id >= 0:
+                    self._referenced[slot_id] = 1
+                    continue
+                if page.nbytes > self.slot_bytes:
+                    continue
+                slot_id = self._evict()
+                self._versions[slot_id] += 1 # odd: being written
+                self._keys[slot_id] = key_hash
+                self._slots[slot_id, :page.nbytes] = np.ascontiguousarray(page).view(
+                    np.uint8).ravel()
+                self._shapes[slot_id] = page.shape
+                self._dtypes[slot_id] = page.dtype.str.encode()
+                self._referenced[slot_id] = 0 # not used yet: first to go if never read
+                self._versions[slot_id] += 1
+
+                # Point a free bucket to it (freeing the first one if all are used)
+                probes = self._probes(key_hash[None])[0]
+                empty = np.flatnonzero(self._bucket_keys[probes] == 0)
+                bucket = probes[empty[0]] if len(empty) > 0 else probes[0]
+                if len(empty) == 0:
+                    self._free(self._bucket_slots[bucket])
+                self._bucket_slots[bucket] = slot_id
+                self._bucket_keys[bucket] = key_hash
+
+    def _probes(self, hashes):
+        """ Buckets each key hash can be in (num_hashes x _PROBES array)."""
+        return (hashes[:, None] % np.uint64(self._num_buckets) +
+                np.arange(_PROBES, dtype=np.uint64)).astype(np.int64) % self._num_buckets
+
+    def _find(self, hashes):
+        """ Slot of each key hash (-1 if not cached). Slots may change right after (see
+        _read)."""
+        probes = self._probes(hashes)
+        matches = self._bucket_keys[probes] == hashes[:, None]
+        buckets = probes[np.arange(len(hashes)), matches.argmax(axis=1)]
+        return np.where(matches.any(axis=1), self._bucket_slots[buckets], -1)
+
+    def _read(self, slot_id, key_hash):
+        """ Copy of the page in a slot; None if the slot was written (or no longer holds
+        key_hash) while copying it."""
+        version = int(self._versions[slot_id])
+        if version % 2 == 1 or self._keys[slot_id] != key_hash:
+            return None
+        try:
+            page = self._page(slot_id).copy()
+        except (ValueError, TypeError): # metadata being rewritten
+            return None
+        if int(self._versions[slot_id]) != version:
+            return None
+        self._referenced[slot_id] = 1
+        return page
+
+    def _evict(self):
+        """ Frees a slot (CLOCK: the hand skips, and clears, slots referenced since it
+        last passed). Call with the lock held.
+
+        Returns:
+            The index of the slot.
+        """
+        hand_index = _HEADER.index('hand')
+        hand = int(self._header[hand_index])
+        while self._keys[hand] != 0 and self._referenced[hand]:
+            self._referenced[hand] = 0
+            hand = (hand + 1) % self.num_slots
+        self._free(hand)
+        self._header[hand_index] = (hand + 1) % self.num_slots
+        return hand
+
+    def _free(self, slot_id):
+        """ Empties a slot and the bucket pointing to it. Call with the lock held."""
+        key_hash = self._keys[slot_id]
+        if key_hash == 0:
+            return
+        probes = self._probes(key_hash[None])[0]
+        self._bucket_keys[probes[(self._bucket_keys[probes] == key_hash) &
+                                 (self._bucket_slots[probes] == slot_id)]] = 0
+        self._versions[slot_id] += 1
+        self._keys[slot_id] = 0
+        self._versions[slot_id] += 1
+
+    def _page(self, slot_id):
+        dtype = np.dtype(self._dtypes[slot_id].decode())
+        shape = tuple(self._shapes[slot_id])
+        num_bytes = int(np.prod(shape)) * dtype.itemsize
+        return self._slots[slot_id, :num_bytes].view(dtype).reshape(shape)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with self._thread_lock:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def clear(self):
+        with self._locked():
+            self._versions[:] += 1
+            self._bucket_keys[:] = 0
+            self._keys[:] = 0
+            self._referenced[:] = 0
+            self._versions[:] += 1
+
+    def __len__(self):
+        return int(np.count_nonzero(self._keys))
+
+    def close(self):
+        """ Detaches this process from the slab (other processes keep using it)."""
+        for attribute in ['_header', '_keys', '_versions', '_shapes', '_dtypes',
+                          '_referenced', '_bucket_keys', '_bucket_slots', '_slots']:
+            setattr(self, attribute, None) # release views of the buffer
+        self._shm.close()
+        self._lock_file.close()
+
+    def unlink(self):
+        """ Deletes the slab (it is freed once every process has closed it)."""
+        _untrack(self._shm, register=True) # unlink() unregisters it
+        self._shm.unlink()
+        try:
+            os.remove(self._lock_file.name)
+        except FileNotFoundError:
+            pass
+
+
+def _data_offset(num_slots):
+    """ Where slots start in a SharedPageCache slab (after the header and index, aligned
+    to memory pages)."""
+    index_bytes = len(_HEADER) * 8 + num_slots * (8 + 8 + 16 + 4 + 1 + 2 * (8 + 8))
+    return -(-index_bytes // 4096) * 4096
+
+
+def _hash_keys(file_identity, page_ids):
+    """ Nonzero 64-bit hash of each (file identity, page) key (0 marks empty slots)."""
+    file_hash = hashlib.blake2b(repr(file_identity).encode(), digest_size=8)
+    hashes = np.empty(len(page_ids), dtype=np.uint64)
+    for i, page_id in enumerate(page_ids):
+        page_hash = file_hash.copy()
+        page_hash.update(int(page_id).to_bytes(8, 'little'))
+        hashes[i] = int.from_bytes(page_hash.digest(), 'little') | 1
+    return hashes
+
+
+def _untrack(shm, register=False):
+    """ Stops the resource tracker from deleting a slab when this process exits (it is
+    shared by all processes; see SharedPageCache.unlink). Python < 3.13 registers every
+    shared memory block opened, 3.13 only those created."""
+    if os.name != 'posix': # only POSIX shared memory is tracked
+        return
+    from multiprocessing import resource_tracker
+    name = '/' + shm.name # registered with the slash SharedMemory adds (and shm.name drops)
+    try:
+        if register:
+            resource_tracker.register(name, 'shared_memory')
+        else:
+            resource_tracker.unregister(name, 'shared_memory')
+    except OSError: # tracker not running (e.g., interpreter shutting down)
+        pass
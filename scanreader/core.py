@@ -20,7 +20,7 @@ _scans = {'5.1': scans.Scan5Point1, '5.2': scans.Scan5Point2, '5.3': scans.Scan5
           '2017a': scans.Scan2017a, '2017b': scans.Scan2017b, '2018a': scans.Scan2018a,
           '2018b': scans.Scan2018b}
 
-def read_scan(pathnames, dtype=np.int16, join_contiguous=False):
+def read_scan(pathnames, dtype=np.int16, join_contiguous=False, raster_correction=None):
     """ Reads a ScanImage scan.
 
     Args:
@@ -29,6 +29,10 @@ def read_scan(pathnames, dtype=np.int16, join_contiguous=False):
         join_contiguous: Boolean. For multiROI scans (2016b and beyond) it will join
             contiguous scanfields in the same depth. No effect in non-multiROI scans. See
             help of ScanMultiROI._join_contiguous_fields for details.
+        raster_correction: None, 'auto' or float. Raster phase (radians) used to correct
+            odd rows of bidirectional scans as they are read. If 'auto', it is estimated
+            from a sample of frames (see BaseScan.estimate_raster_phase). If None, pages
+            are returned as recorded.
 
     Returns:
         A Scan object (subclass of BaseScan) with metadata and data. See Readme for details.
@@ -57,8 +61,31 @@ def read_scan(pathnames, dtype=np.int16, join_contiguous=False):
     # Read metadata and data (lazy operation)
     scan.read_data(filenames, dtype=dtype)
 
+    # Set raster correction (applied when pages are read)
+    if isinstance(raster_correction, str):
+        if raster_correction != 'auto':
+            error_msg = "raster_correction should be None, 'auto' or a float, received {}"
+            raise ValueError(error_msg.format(raster_correction))
+        scan.raster_phase = scan.estimate_raster_phase()
+    elif raster_correction is not None:
+        scan.raster_phase = float(raster_correction)
+
     return scan
 
+def read_remote_scan(socket_path, pathnames, dtype=np.int16, join_contiguous=False,
+                     raster_correction=None):
+    """ Opens a scan through a scan server (see server.py and `scanreader serve`).
+
+    Args:
+        socket_path: String. Unix socket the server listens on.
+        pathnames, dtype, join_contiguous, raster_correction: As in read_scan.
+
+    Returns:
+        A server.RemoteScan, indexed as scans.
+    """
+    from .server import RemoteScan
+    return RemoteScan(socket_path, pathnames, dtype, join_contiguous, raster_correction)
+
 def expand_wildcard(wildcard):
     """ Expands a list of pathname patterns to form a sorted list of absolute filenames.
 
@@ -0,0 +1,208 @@
+""" Single-pass demultiplexing of scan pages into per-field, per-channel outputs.
+
+Reading every field with scan[i] reads all pages of that field's slice once per field;
+in multiROI scans, where many fields share a page, the same pages are read many times.
+demultiplex() walks the pages of the scan once, in the order they are stored in disk,
+and scatters each page (or each subfield in it) to the sinks that need it.
+
+A sink is any object with a write(first_frame, data) method, where data is a frames x
+height x width array with consecutive frames starting at first_frame, or any callable
+with that same signature. Sinks with a paste(first_frame, data, yslice, xslice) method
+(e.g., ArraySink) receive instead each subfield as a height x width x frames view of the
+pages read, to be copied at yslice, xslice of the field (no intermediate copy is made).
+Sinks with a close() method are closed once all pages are read.
+
+Example:
+    sinks = {(field_id, 0): demux.BinarySink('field{}.bin'.format(field_id)) for
+             field_id in range(scan.num_fields)}
+    demux.demultiplex(scan, sinks)
+"""
+import numpy as np
+from . import utils
+
+# Aim for ~16 MB of pages per read: small enough to still be in CPU caches when copied
+_CHUNK_BYTES = 2 ** 24
+
+
+class ArraySink():
+    """ Stores data in an array shaped as scan fields: [y, x, frames].
+
+    Attributes:
+        array: A height x width x num_frames array (frames stored first, as the pages
+            they are copied from).
+    """
+    def __init__(self, height, width, num_frames, dtype=np.int16, array=None):
+        if array is None:
+            array = np.empty([num_frames, height, width], dtype=dtype).transpose([1, 2, 0])
+        self.array = array
+
+    def write(self, first_frame, data):
+        self.paste(first_frame, np.moveaxis(data, 0, -1))
+
+    def paste(self, first_frame, data, yslice=slice(None), xslice=slice(None)):
+        """ Copies a height x width x frames array at yslice, xslice of the field."""
+        self.array[yslice, xslice, first_frame: first_frame + data.shape[-1]] = data
+
+
+class BinarySink():
+    """ Appends data to a flat binary file (C-ordered frames x height x width)."""
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(filename, 'wb')
+
+    def write(self, first_frame, data):
+        np.ascontiguousarray(data).tofile(self._file)
+
+    def close(self):
+        self._file.close()
+
+
+class CallbackSink():
+    """ Calls func(first_frame, data) for every chunk of data."""
+    def __init__(self, func):
+        self.func = func
+
+    def write(self, first_frame, data):
+        self.func(first_frame, data)
+
+
+def as_sink(sink):
+    """ Sink with a write method: sink itself or, for callables, a CallbackSink."""
+    return sink if hasattr(sink, 'write') else CallbackSink(sink)
+
+
+def demultiplex(scan, sinks, chunk_size=None, frame_range=None):
+    """ Reads the scan pages once (in disk order) and distributes them among sinks.
+
+    Args:
+        scan: A Scan object (subclass of BaseScan).
+        sinks: Dictionary. Maps (field, channel) tuples to sinks. Each sink receives
+            all frames of its field and channel in order (in chunks).
+        chunk_size: Integer. Number of frames read at a time. Defaults to as many frames
+            as fit in ~16 MB.
+        frame_range: Tuple of integers (start, stop). Consecutive frames to read.
+            Defaults to all frames.
+
+    Returns:
+        The sinks dictionary.
+    """
+    # Check fields and channels
+    for field_id, channel in sinks:
+        utils.check_index_type(0, field_id)
+        utils.check_index_is_in_bounds(0, field_id, scan.num_fields)
+        utils.check_index_type(3, channel)
+        utils.check_index_is_in_bounds(3, channel, scan.num_channels)
+    sinks = {(utils.listify_index(field_id, scan.num_fields)[0],
+              utils.listify_index(channel, scan.num_channels)[0]): as_sink(sink) for
+             (field_id, channel), sink in sinks.items()}
+
+    # Get the pages that need to be read
+    fields = scan.fields
+    slice_list = sorted(set(fields[field_id].slice_id for field_id, _ in sinks))
+    channel_list = sorted(set(channel for _, channel in sinks))
+    first_frame, last_frame = (0, scan.num_frames) if frame_range is None else frame_range
+
+    # Pages of slow stacks are stored slice by slice, read them that way
+    if scan.is_slow_stack:
+        slice_groups = [[slice_id] for slice_id in slice_list]
+    else:
+        slice_groups = [slice_list]
+
+    if chunk_size is None:
+        page_bytes = scan._page_height * scan._page_width * np.dtype(scan.dtype).itemsize
+        pages_per_frame = len(slice_groups[0]) * len(channel_list)
+        chunk_size = _CHUNK_BYTES // (page_bytes * pages_per_frame)
+    chunk_size = max(1, chunk_size)
+
+    try:
+        for slice_group in slice_groups:
+            for start in range(first_frame, last_frame, chunk_size):
+                frame_list = list(range(start, min(start + chunk_size, last_frame)))
+                pages = scan._read_pages(slice_group, channel_list, frame_list)
+                _scatter(pages, slice_group, channel_list, start, fields, sinks)
+    finally:
+        for sink in sinks.values():
+            if hasattr(sink, 'close'):
+                sink.close()
+
+    return sinks
+
+
+def _scatter(pages, slice_list, channel_list, first_frame, fields, sinks):
+    """ Cuts each field out of the read pages and sends it to its sinks.
+
+    Args:
+        pages: A 5-D array (num_slices, page_height, page_width, num_channels,
+            num_frames) as returned by BaseScan._read_pages.
+        slice_list: List of integers. Slices in pages.
+        channel_list: List of integers. Channels in pages.
+        first_frame: Integer. Frame number of the first frame in pages.
+        fields: List of Field objects. All fields in the scan.
+        sinks: Dictionary. Maps (field, channel) tuples to sinks.
+    """
+    for (field_id, channel), sink in sinks.items():
+        field = fields[field_id]
+        if field.slice_id not in slice_list:
+            continue
+        page = pages[slice_list.index(field.slice_id), :, :, channel_list.index(channel)]
+        slices = list(zip(field.yslices, field.xslices, field.output_yslices,
+                          field.output_xslices))
+
+        # Paste each subfield (only one for non-contiguous fields) straight into the sink
+        if hasattr(sink, 'paste'):
+            for yslice, xslice, output_yslice, output_xslice in slices:
+                sink.paste(first_frame, page[yslice, xslice], output_yslice, output_xslice)
+            continue
+
+        # Send a view of the pages if the field is a single subfield, else assemble it
+        if len(slices) == 1:
+            yslice, xslice, _, _ = slices[0]
+            block = np.moveaxis(page[yslice, xslice], -1, 0)
+        else:
+            block = np.empty([page.shape[-1], field.height, field.width], dtype=pages.dtype)
+            for yslice, xslice, output_yslice, output_xslice in slices:
+                block[:, output_yslice, output_xslice] = np.moveaxis(page[yslice, xslice],
+                                                                     -1, 0)
+
+        sink.write(first_frame, block)
+
+
+def extract_fields(scan, fields=None, channels=None, chunk_size=None):
+    """ Reads all frames of the requested fields in a single pass over the scan.
+
+    Equivalent to [scan[field_id, :, :, channels] for field_id in fields] but each page
+    is read only once.
+
+    Args:
+        scan: A Scan object (subclass of BaseScan).
+        fields: Integer or list of integers. Fields to read. Defaults to all fields.
+        channels: Integer or list of integers. Channels to read. Defaults to all.
+        chunk_size: Integer. Number of frames read at a time.
+
+    Returns:
+        A list of 4-d arrays ([y, x, channels, frames]), one per requested field.
+    """
+    field_list = utils.listify_selection(0, fields, scan.num_fields)
+    channel_list = utils.listify_selection(3, channels, scan.num_channels)
+    unique_channels, channel_indices = np.unique(channel_list, return_inverse=True)
+
+    outputs = {}
+    sinks = {}
+    scan_fields = scan.fields
+    for field_id in set(field_list):
+        field = scan_fields[field_id]
+        output = np.empty([len(unique_channels), scan.num_frames, field.height, field.width],
+                          dtype=scan.dtype).transpose([2, 3, 0, 1]) # frames stored first
+        for i, channel in enumerate(unique_channels):
+            sinks[(field_id, int(channel))] = ArraySink(field.height, field.width,
+                                                        scan.num_frames,
+                                                        array=output[:, :, i, :])
+        outputs[field_id] = output
+    demultiplex(scan, sinks, chunk_size)
+
+    # Restore requested channel order (and repeated channels, if any)
+    if not np.array_equal(unique_channels, channel_list):
+        outputs = {field_id: output[:, :, channel_indices] for field_id, output in
+                   outputs.items()}
+
+    return [outputs[field_id] for field_id in field_list]
@@ -12,4 +12,8 @@ class PathnameError(ScanReaderException):
 
 class FieldDimensionMismatch(ScanReaderException):
     """ Exception for trying to slice an array with fields of different dimensions."""
+    pass
+
+class TimestampMismatch(ScanReaderException):
+    """ Exception for timing computed from the header not matching page timestamps."""
     pass
\ No newline at end of file
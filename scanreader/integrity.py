@@ -0,0 +1,127 @@
+""" Detection of dropped, duplicated and misaligned frames in a scan.
+
+Scans assume a perfect layout: every frame (ScanImage's frame, i.e., one slice at one
+timestep) is saved as num_channels consecutive pages, in order. If ScanImage drops a frame
+all following pages shift and are assigned to the wrong slice/timestep. We use the frame
+number stored in each page description (see descriptions.py) to find gaps and to build a
+map from (frame, slice, channel) to the page that actually holds it.
+
+Example:
+    report = scan.check_integrity(remap=True)
+    print(report)
+    field = scan[0] # missing frames are filled with fill_value
+"""
+import numpy as np
+
+
+class IntegrityReport():
+    """ Result of checking the frame numbers of all pages in a scan.
+
+    Frame numbers are as written by ScanImage (one per slice and timestep, shared by all
+    channels).
+
+    Attributes:
+        num_pages: Integer. Number of pages in the scan.
+        num_frames: Integer. Number of (complete) timesteps in the acquisition.
+        missing_frame_numbers: Array. Frame numbers without any page.
+        duplicated_frame_numbers: Array. Frame numbers saved more than once.
+        incomplete_frame_numbers: Array. Frame numbers with fewer pages than channels.
+        unlabeled_pages: Array. Pages without a frame number in their description.
+        out_of_order_pages: Array. Pages with a frame number lower than the previous one.
+        page_map: A num_frames x num_slices x num_channels array. Page (counted across
+            files) holding each frame, slice and channel; -1 if missing.
+    """
+    def __init__(self, num_pages, num_frames, missing_frame_numbers,
+                 duplicated_frame_numbers, incomplete_frame_numbers, unlabeled_pages,
+                 out_of_order_pages, page_map):
+        self.num_pages = num_pages
+        self.num_frames = num_frames
+        self.missing_frame_numbers = missing_frame_numbers
+        self.duplicated_frame_numbers = duplicated_frame_numbers
+        self.incomplete_frame_numbers = incomplete_frame_numbers
+        self.unlabeled_pages = unlabeled_pages
+        self.out_of_order_pages = out_of_order_pages
+        self.page_map = page_map
+
+    @property
+    def is_ok(self):
+        """ Whether the scan layout matches the one assumed when reading."""
+        return not any(len(problems) > 0 for problems in [
+            self.missing_frame_numbers, self.duplicated_frame_numbers,
+            self.incomplete_frame_numbers, self.unlabeled_pages, self.out_of_order_pages])
+
+    @property
+    def num_missing_pages(self):
+        return int(np.sum(self.page_map < 0))
+
+    def __str__(self):
+        problems = [('missing frame numbers', self.missing_frame_numbers),
+                    ('duplicated frame numbers', self.duplicated_frame_numbers),
+                    ('incomplete frame numbers', self.incomplete_frame_numbers),
+                    ('pages without frame number', self.unlabeled_pages),
+                    ('pages out of order', self.out_of_order_pages)]
+        lines = ['{} pages, {} frames: {}'.format(self.num_pages, self.num_frames,
+                                                 'ok' if self.is_ok else 'PROBLEMS FOUND')]
+        for name, values in problems:
+            if len(values) > 0:
+                shown = ', '.join(str(v) for v in values[:10])
+                lines.append('  {} {}: {}{}'.format(len(values), name, shown,
+                                                    ', ...' if len(values) > 10 else ''))
+        return '\n'.join(lines)
+
+
+def check_integrity(scan):
+    """ Checks the frame number of every page in the scan.
+
+    Args:
+        scan: A Scan object (subclass of BaseScan).
+
+    Returns:
+        An IntegrityReport.
+    """
+    frame_numbers = scan.page_descriptions.frame_number
+    num_pages = len(frame_numbers)
+    num_channels = scan.num_channels
+
+    # Frame numbers counted from the first page (0-based)
+    is_labeled = frame_numbers >= 0
+    unlabeled_pages = np.flatnonzero(~is_labeled)
+    labeled_pages = np.flatnonzero(is_labeled)
+    numbers = frame_numbers[labeled_pages]
+    first_number = numbers[0] if len(numbers) > 0 else 0
+    numbers = numbers - first_number
+    out_of_order_pages = labeled_pages[1:][np.diff(numbers) < 0]
+
+    # Pages per frame number
+    order = np.argsort(numbers, kind='stable')
+    unique_numbers, starts, counts = np.unique(numbers[order], return_index=True,
+                                               return_counts=True)
+    max_number = unique_numbers[-1] if len(unique_numbers) > 0 else -1
+    missing_numbers = np.setdiff1d(np.arange(max_number + 1), unique_numbers)
+
+    # Slice and timestep of each frame number
+    if scan.is_slow_stack:
+        frames_per_slice = scan.num_requested_frames // scan._num_averaged_frames
+        num_slices = (max_number + 1) // frames_per_slice
+        num_frames = frames_per_slice
+        slices, frames = np.divmod(unique_numbers, frames_per_slice)
+    else:
+        num_slices = scan.num_scanning_depths
+        num_frames = (max_number + 1) // num_slices # discard last frame if incomplete
+        frames, slices = np.divmod(unique_numbers, num_slices)
+
+    # Map (frame, slice, channel) -> page (first copy of complete frames only)
+    page_map = np.full([num_frames, num_slices, num_channels], -1, dtype=np.int64)
+    is_valid = (counts >= num_channels) & (frames < num_frames) & (slices < num_slices)
+    for channel in range(num_channels):
+        pages = labeled_pages[order[starts[is_valid] + channel]]
+        page_map[frames[is_valid], slices[is_valid], channel] = pages
+
+    return IntegrityReport(num_pages=num_pages, num_frames=num_frames,
+                           missing_frame_numbers=missing_numbers + first_number,
+                           duplicated_frame_numbers=unique_numbers[counts > num_channels]
+                                                    + first_number,
+                           incomplete_frame_numbers=unique_numbers[counts < num_channels]
+                                                    + first_number,
+                           unlabeled_pages=unlabeled_pages,
+                           out_of_order_pages=out_of_order_pages, page_map=page_map)
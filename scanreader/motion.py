@@ -0,0 +1,170 @@
+""" Rigid motion correction of scan fields (FFT phase correlation).
+
+Shifts are estimated for chunks of frames at a time (batched FFTs) while pages are
+streamed from disk (see demux.py), so the field is read only once; corrected frames can
+be written to a sink in that same pass.
+
+Example:
+    template = motion.create_template(scan, field=0)
+    sink = demux.BinarySink('field0_corrected.bin')
+    shifts = motion.correct_motion(scan, field=0, template=template, sink=sink)
+"""
+import numpy as np
+from . import utils
+from . import demux
+
+
+def compute_shifts(frames, template, max_shift=None):
+    """ Estimates the rigid shift of each frame with respect to the template.
+
+    Args:
+        frames: Array (num_frames x height x width).
+        template: Array (height x width).
+        max_shift: Integer or tuple of integers (y, x). Largest shift (in pixels) to
+            consider. Defaults to half the field size.
+
+    Returns:
+        A num_frames x 2 array. Shift (y, x) that aligns each frame to the template (see
+            apply_shifts); subpixel, estimated with a parabolic fit around the peak.
+    """
+    frames = np.asarray(frames, dtype=np.float32)
+    height, width = frames.shape[-2:]
+    max_y, max_x = (height // 2, width // 2) if max_shift is None else (
+        np.broadcast_to(max_shift, 2))
+
+    # Normalized cross-power spectrum (batched over frames)
+    template_fft = np.fft.rfft2(template - np.mean(template))
+    frames_fft = np.fft.rfft2(frames - frames.mean(axis=(-2, -1), keepdims=True))
+    cross_power = template_fft * np.conj(frames_fft)
+    cross_power /= np.abs(cross_power) + 1e-8
+    correlations = np.fft.irfft2(cross_power, s=(height, width))
+
+    # Ignore shifts larger than max_shift
+    ys = np.fft.fftfreq(height, 1 / height)
+    xs = np.fft.fftfreq(width, 1 / width)
+    is_invalid = (np.abs(ys)[:, None] > max_y) | (np.abs(xs)[None, :] > max_x)
+    correlations[:, is_invalid] = -np.inf
+
+    # Find peaks
+    peaks = np.argmax(correlations.reshape(len(frames), -1), axis=-1)
+    peak_ys, peak_xs = np.unravel_index(peaks, (height, width))
+    frame_ids = np.arange(len(frames))
+
+    # Refine with a parabola through the peak and its neighbours (circular)
+    def subpixel(previous, center, next_):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            offset = (previous - next_) / (2 * (previous - 2 * center + next_))
+        return np.where(np.isfinite(offset), np.clip(offset, -0.5, 0.5), 0)
+    center = correlations[frame_ids, peak_ys, peak_xs]
+    y_offset = subpixel(correlations[frame_ids, (peak_ys - 1) % height, peak_xs], center,
+                        correlations[frame_ids, (peak_ys + 1) % height, peak_xs])
+    x_offset = subpixel(correlations[frame_ids, peak_ys, (peak_xs - 1) % width], center,
+                        correlations[frame_ids, peak_ys, (peak_xs + 1) % width])
+
+    return np.stack([ys[peak_ys] + y_offset, xs[peak_xs] + x_offset], axis=-1)
+
+
+def apply_shifts(frames, shifts):
+    """ Shifts each frame (circularly, with subpixel precision) in the Fourier domain.
+
+    Args:
+        frames: Array (num_frames x height x width).
+        shifts: Array (num_frames x 2). Shift (y, x) of each frame; positive values move
+            the content down/right.
+
+    Returns:
+        A num_frames x height x width float32 array. Shifted frames.
+    """
+    frames = np.asarray(frames, dtype=np.float32)
+    height, width = frames.shape[-2:]
+    shifts = np.asarray(shifts, dtype=np.float32)
+
+    # Phase ramps are separable in y and x (num_frames x height x 1, num_frames x 1 x width)
+    ky = np.fft.fftfreq(height).astype(np.float32)
+    kx = np.fft.rfftfreq(width).astype(np.float32)
+    y_phase = np.exp(-2j * np.pi * shifts[:, 0, None] * ky)[:, :, None]
+    x_phase = np.exp(-2j * np.pi * shifts[:, 1, None] * kx)[:, None, :]
+    frames_fft = np.fft.rfft2(frames)
+    frames_fft *= y_phase
+    frames_fft *= x_phase
+    shifted = np.fft.irfft2(frames_fft, s=(height, width))
+
+    return shifted.astype(np.float32)
+
+
+def create_template(scan, field, channel=0, num_frames=200, num_iterations=3,
+                    max_shift=None):
+    """ Creates a template by iteratively aligning and averaging frames in the middle
+    of the scan.
+
+    Args:
+        scan: A Scan object (subclass of BaseScan).
+        field: Integer. Field to use.
+        channel: Integer. Channel to use.
+        num_frames: Integer. Number of (consecutive) frames to average.
+        num_iterations: Integer. Number of align-and-average rounds.
+        max_shift: Integer or tuple of integers (y, x). See compute_shifts.
+
+    Returns:
+        A height x width float32 array.
+    """
+    num_frames = min(num_frames, scan.num_frames)
+    start = (scan.num_frames - num_frames) // 2
+    frames = np.moveaxis(scan[field, :, :, channel, start: start + num_frames], -1, 0)
+    frames = frames.astype(np.float32)
+
+    template = frames.mean(axis=0)
+    for _ in range(num_iterations):
+        shifts = compute_shifts(frames, template, max_shift)
+        template = apply_shifts(frames, shifts).mean(axis=0)
+
+    return template
+
+
+def correct_motion(scan, field, channel=0, template=None, max_shift=None, sink=None,
+                   chunk_size=None):
+    """ Estimates (and optionally applies) rigid shifts for every frame of a field.
+
+    The field is streamed from disk in chunks; each chunk is aligned to the template and,
+    if a sink is given, written corrected before the next one is read.
+
+    Args:
+        scan: A Scan object (subclass of BaseScan).
+        field: Integer. Field to correct.
+        channel: Integer. Channel used to estimate (and apply) shifts.
+        template: Array (height x width). Reference image. Defaults to
+            create_template(scan, field, channel).
+        max_shift: Integer or tuple of integers (y, x). See compute_shifts.
+        sink: A sink (see demux.py: an object with a write method or a callable) that
+            receives corrected frames (frames x height x width arrays, in scan.dtype). If
+            None, frames are not corrected.
+        chunk_size: Integer. Number of frames read (and aligned) at a time.
+
+    Returns:
+        A num_frames x 2 array. Shift (y, x) applied to each frame.
+    """
+    utils.check_index_type(0, field)
+    utils.check_index_is_in_bounds(0, field, scan.num_fields)
+    if template is None:
+        template = create_template(scan, field, channel, max_shift=max_shift)
+    if sink is not None:
+        sink = demux.as_sink(sink)
+
+    shifts = np.empty([scan.num_frames, 2], dtype=np.float32)
+    is_integer = np.issubdtype(scan.dtype, np.integer)
+    def align(first_frame, frames):
+        chunk_shifts = compute_shifts(frames, template, max_shift)
+        shifts[first_frame: first_frame + len(frames)] = chunk_shifts
+        if sink is not None:
+            corrected = apply_shifts(frames, chunk_shifts)
+            if is_integer:
+                corrected = np.rint(corrected)
+            sink.write(first_frame, corrected.astype(scan.dtype))
+
+    try:
+        demux.demultiplex(scan, {(field, channel): align}, chunk_size)
+    finally:
+        if hasattr(sink, 'close'):
+            sink.close()
+
+    return shifts
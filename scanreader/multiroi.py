@@ -164,7 +164,8 @@ class Field(Scanfield):
         output_xslices: list of slices. Where to paste this field in the output field.
         slice_id: index of the slice in the scan to which this field belongs.
         roi_ids: list of ROI indices to which each subfield belongs (one if single field).
-        offsets: list of masks with time offsets per pixel (seconds, one if single field).
+        offsets: list of TimeOffsets with the time offset of each pixel (seconds, one if
+            single field).
 
     Example:
         output_field[output_yslice, output_xslice] = page[yslice, xslice]
@@ -200,6 +201,7 @@ class Field(Scanfield):
         self.slice_id = slice_id
         self.roi_ids = roi_ids
         self.offsets = offsets
+        self._offset_mask = None # cached
 
     @property
     def has_contiguous_subfields(self):
@@ -217,12 +219,19 @@ class Field(Scanfield):
 
     @property
     def offset_mask(self):
-        """ Mask of the size of the field. Each pixel shows its time offset in seconds."""
-        mask = np.full([self.height, self.width], -1, dtype=np.float32)
-        for offsets, output_yslice, output_xslice in zip(self.offsets, self.output_yslices,
-                                                        self.output_xslices):
-            mask[output_yslice, output_xslice] = offsets
-        return mask
+        """ Mask of the size of the field. Each pixel shows its time offset in seconds.
+
+        Computed once and cached (read-only).
+        """
+        if self._offset_mask is None:
+            mask = np.full([self.height, self.width], -1, dtype=np.float32)
+            for offsets, output_yslice, output_xslice in zip(self.offsets,
+                                                            self.output_yslices,
+                                                            self.output_xslices):
+                mask[output_yslice, output_xslice] = offsets
+            mask.flags.writeable = False
+            self._offset_mask = mask
+        return self._offset_mask
 
     def _type_of_contiguity(self, field2):
         """ Compute how field 2 is contiguous to this one.
@@ -308,6 +317,41 @@ class Field(Scanfield):
         # Append roi ids and offsets
         self.roi_ids = self.roi_ids + field2.roi_ids
         self.offsets = self.offsets + field2.offsets
+        self._offset_mask = None
+
+
+class TimeOffsets:
+    """ Time offsets (seconds) at which each pixel of a field was recorded, stored
+    compactly: the start time of each line plus a per-column profile shared by all lines
+    (reversed in odd lines of bidirectional scans).
+
+    np.asarray(offsets) gives the full height x width mask (float32).
+
+    Attributes:
+        line_starts: Array. Seconds at which each line of the field starts.
+        line_profile: Array. Fraction of the line period elapsed at each column.
+        seconds_per_line: Float. Seconds it takes to scan one line.
+        is_bidirectional: Boolean. Whether odd lines are scanned in reverse.
+    """
+    def __init__(self, line_starts, line_profile, seconds_per_line, is_bidirectional):
+        self.line_starts = line_starts
+        self.line_profile = line_profile
+        self.seconds_per_line = seconds_per_line
+        self.is_bidirectional = is_bidirectional
+
+    @property
+    def shape(self):
+        return (len(self.line_starts), len(self.line_profile))
+
+    def __array__(self, dtype=None, copy=None):
+        column_offsets = (self.line_profile * self.seconds_per_line).astype(np.float32)
+        mask = np.empty(self.shape, dtype=np.float32)
+        mask[:] = self.line_starts.astype(np.float32)[:, None] + column_offsets
+        if self.is_bidirectional: # odd lines scanned from right to left
+            reversed_offsets = ((1 - self.line_profile) * self.seconds_per_line).astype(
+                np.float32)
+            mask[1::2] = self.line_starts[1::2].astype(np.float32)[:, None] + reversed_offsets
+        return mask if dtype is None else mask.astype(dtype)
 
 
 class Position:
@@ -0,0 +1,230 @@
+""" Thread-safe page reads with positional I/O.
+
+tifffile reads a page by seeking its (shared) file handle and reading from there, so
+threads reading from the same scan at once have to take turns or they read each other's
+pages. Instead, we compute once where the pixel data of every page is (ScanImage pages
+are equidistant so two IFDs are enough) and read it with os.preadv, which takes the
+offset as an argument and never moves a file position: any number of threads can read
+from the same scan concurrently, without locks.
+
+Pages are read in runs: pages that follow each other in the file, with at most max_gap
+bytes between them (IFDs, descriptions or pages not asked for), are read with a single
+os.preadv call that scatters page data straight into the output array and the bytes in
+between into a scratch buffer. Sparse selections (every 10th frame, trial-aligned frames)
+are thus read with few large requests instead of one small request per page; a larger
+max_gap trades bytes read for fewer requests.
+
+Files whose pages cannot be read this way (compressed or non-contiguous data, files
+that are not equidistant are handled by reading every IFD once) and platforms without
+os.pread are read through tifffile under a lock (see BaseScan._read_file_pages).
+
+Example:
+    layout = pageio.FileLayout.from_tiff(tiff_file)
+    pages = layout.read([0, 10, 20]) # 3 x height x width array
+"""
+import os
+import threading
+import numpy as np
+from . import profiling
+
+MAX_GAP = 2 ** 20 # largest gap (in bytes) read through to join two pages in one request
+try:
+    _IOV_MAX = os.sysconf('SC_IOV_MAX') # buffers per preadv call
+except (AttributeError, ValueError, OSError):
+    _IOV_MAX = 1024
+
+
+class FileLayout():
+    """ Where the pixel data of each page in a tiff file is.
+
+    Attributes:
+        filename: String. Name of the tiff file.
+        num_pages: Integer. Number of pages in the file.
+        page_shape: Tuple. Height and width of each page.
+        dtype: Data type of the pixels (in the file's byte order).
+        data_offsets: Array or None. Offset (in bytes) of the data of each page; None if
+            pages have to be read through tifffile.
+        identity: Tuple. Identifies the file (and its version) in page caches; see
+            file_identity.
+    """
+    def __init__(self, filename, num_pages, page_shape, dtype, data_offsets):
+        self.filename = filename
+        self.num_pages = num_pages
+        self.page_shape = tuple(page_shape)
+        self.dtype = np.dtype(dtype)
+        self.data_offsets = data_offsets
+        self.identity = file_identity(filename)
+        self._file = None # opened when first read
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_tiff(cls, tiff_file):
+        """ Computes the layout of a tifffile.TiffFile (not thread-safe: reads IFDs)."""
+        pages = tiff_file.pages
+        num_pages = len(pages)
+        first_page = pages[0]
+        dtype = None if first_page.dtype is None else (tiff_file.byteorder +
+                                                       first_page.dtype.char)
+        page_shape = (first_page.imagelength, first_page.imagewidth)
+        layout = cls(tiff_file.filehandle.path, num_pages, page_shape, dtype, None)
+
+        # Only plain, contiguous pages can be read directly
+        contiguous = first_page.is_contiguous
+        is_readable = (os.name == 'posix' and hasattr(os, 'pread') and contiguous and
+                       dtype is not None and first_page.shape == page_shape and
+                       contiguous[1] == layout.page_nbytes and
+                       getattr(first_page, 'predictor', 1) == 1 and
+                       getattr(first_page, 'fillorder', 1) == 1 and
+                       tiff_file.filehandle._offset == 0) # not embedded in another file
+        if not is_readable:
+            return layout
+
+        # Predict offsets from the distance between the first two IFDs (ScanImage)
+        offsets = np.array([contiguous[0]], dtype=np.int64)
+        if num_pages > 1:
+            ifd_offsets = [page if isinstance(page, int) else page.offset for page in
+                           pages.pages[:2]]
+            stride = ifd_offsets[1] - ifd_offsets[0]
+            offsets = contiguous[0] + np.arange(num_pages, dtype=np.int64) * stride
+
+            # Confirm with the last page, else read every page
+            last_contiguous = pages[num_pages - 1].is_contiguous
+            if last_contiguous is None or last_contiguous[0] != offsets[-1]:
+                page_contiguous = [pages[i].is_contiguous for i in range(num_pages)]
+                if any(c is None or c[1] != layout.page_nbytes for c in page_contiguous):
+                    return layout
+                offsets = np.array([c[0] for c in page_contiguous], dtype=np.int64)
+        layout.data_offsets = offsets
+
+        return layout
+
+    @property
+    def page_nbytes(self):
+        return self.page_shape[0] * self.page_shape[1] * self.dtype.itemsize
+
+    def fileno(self):
+        """ File descriptor used for reads (the file is opened on first use)."""
+        if self._file is None:
+            with self._lock:
+                if self._file is None:
+                    self._file = open(self.filename, 'rb', buffering=0)
+        return self._file.fileno()
+
+    def read(self, page_ids, out=None, max_gap=MAX_GAP):
+        """ Reads pages (thread-safe).
+
+        Pages are read in file order and only once: repeated pages are copied and pages
+        requested out of order are still joined into runs (see runs).
+
+        Args:
+            page_ids: List of integers. Pages to read (indices within this file), in any
+                order and possibly repeated.
+            out: Array or None. C-contiguous num_pages x height x width array (of
+                self.dtype) to read into.
+            max_gap: Integer. Pages separated by at most this many bytes are read in the
+                same request (the bytes in between are discarded). Negative values read
+                each page on its own.
+
+        Returns:
+            A num_pages x height x width array (pages in the order of page_ids).
+        """
+        if out is None:
+            out = np.empty([len(page_ids), *self.page_shape], dtype=self.dtype)
+        if len(page_ids) == 0:
+            return out
+        fd = self.fileno()
+
+        # Read each page once, sorted by offset, into its first position in out
+        unique_ids, first_positions, inverse = np.unique(page_ids, return_index=True,
+                                                         return_inverse=True)
+        order = np.argsort(self.data_offsets[unique_ids], kind='stable')
+        positions = first_positions[order]
+        offsets = self.data_offsets[unique_ids[order]]
+
+        runs = self.runs(offsets, max_gap)
+        gaps = np.diff(offsets) - self.page_nbytes
+        gaps_read = [gaps[start: stop - 1] for start, stop in runs if stop - start > 1]
+        scratch_size = max([0, *(int(gaps_.max()) for gaps_ in gaps_read)])
+        scratch = memoryview(np.empty(scratch_size, dtype=np.uint8)) # bytes between pages
+
+        num_reads = bytes_read = 0
+        for start, stop in runs:
+            buffers = [memoryview(out[positions[start]]).cast('B')]
+            for i in range(start + 1, stop):
+                buffers.append(scratch[:gaps[i - 1]])
+                buffers.append(memoryview(out[positions[i]]).cast('B'))
+            read_all(fd, buffers, int(offsets[start]))
+            num_reads += 1
+            bytes_read += int(offsets[stop - 1] - offsets[start]) + self.page_nbytes
+        profiling.count(num_reads=num_reads, bytes_read=bytes_read)
+
+        # Copy repeated pages
+        sources = first_positions[inverse.ravel()]
+        repeated = np.flatnonzero(sources != np.arange(len(sources)))
+        if len(repeated) > 0:
+            out[repeated] = out[sources[repeated]]
+
+        return out
+
+    def runs(self, offsets, max_gap=MAX_GAP):
+        """ Splits pages into runs read with a single request.
+
+        Args:
+            offsets: Array. Data offset of each page, in the order they are read (a run
+                breaks where offsets go back).
+            max_gap: Integer. Largest number of bytes between two pages of a run.
+
+        Returns:
+            A list of (start, stop) tuples: positions in offsets (stop excluded).
+        """
+        gaps = np.diff(offsets) - self.page_nbytes
+        breaks = np.flatnonzero((gaps < 0) | (gaps > max_gap)) + 1 # not ahead or too far
+
+        runs = []
+        max_pages = (_IOV_MAX + 1) // 2 # pages and gaps use one buffer each
+        for start, stop in zip([0, *breaks], [*breaks, len(offsets)]):
+            for run_start in range(start, stop, max_pages):
+                runs.append((run_start, min(run_start + max_pages, stop)))
+        return runs
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def file_identity(filename):
+    """ Path, device, inode, size and modification time (ns) of a file: changes if the
+    file is replaced or modified."""
+    stat = os.stat(filename)
+    return (os.path.realpath(filename), stat.st_dev, stat.st_ino, stat.st_size,
+            stat.st_mtime_ns)
+
+
+def read_all(fd, buffers, offset):
+    """ Fills byte buffers, one after the other, with the bytes starting at offset in the
+    file (one os.preadv call unless reads come up short)."""
+    buffers = [buffer for buffer in buffers if len(buffer) > 0]
+    while buffers:
+        if hasattr(os, 'preadv'):
+            num_bytes = os.preadv(fd, buffers, offset)
+        else:
+            data = os.pread(fd, sum(len(buffer) for buffer in buffers), offset)
+            num_bytes = len(data)
+            position = 0
+            for buffer in buffers:
+                chunk = data[position: position + len(buffer)]
+                buffer[:len(chunk)] = chunk
+                position += len(chunk)
+        if num_bytes == 0:
+            raise IOError('unexpected end of file reading {} bytes at {}'.format(
+                sum(len(buffer) for buffer in buffers), offset))
+        offset += num_bytes
+
+        # Short read: continue where it stopped
+        while buffers and num_bytes >= len(buffers[0]):
+            num_bytes -= len(buffers[0])
+            buffers.pop(0)
+        if buffers:
+            buffers[0] = buffers[0][num_bytes:]
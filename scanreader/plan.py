@@ -0,0 +1,244 @@
+""" Read plans and read-amplification counters.
+
+Scans read whole tiff pages: a field covering a small part of a multiROI page, or a key
+asking for a few rows, still reads every byte of the pages involved, and each subfield of
+a joined field re-reads them. A ReadPlan describes what scan[key] would read (files, page
+ranges, page rows and columns kept, bytes) without reading anything; ReadCounters
+accumulate what reads actually did.
+
+Bytes are counted as:
+    requested: Bytes (as stored in the files) of the pixels asked for.
+    read: Bytes read from disk. In a ReadPlan, whole pages every time they are read; in
+        ReadCounters, what the reads sent to disk (see profiling.count): pages served
+        from a cache count nothing and bytes read through between nearby pages count.
+        Bytes read for several fields at once are split among them in proportion to the
+        pages each one needs.
+    returned: Bytes of the returned array (in scan.dtype).
+Read amplification is bytes read / bytes requested.
+
+Example:
+    print(scan.explain((0, slice(None), slice(None), 0, slice(0, 1000))))
+    field = scan[0, :, :, 0, :1000]
+    print(scan.read_counters)
+"""
+from os import path
+import threading
+import numpy as np
+
+_MAX_RANGES = 4 # page ranges printed per region
+
+
+class RegionRead():
+    """ One read of pages of a slice (some channels and frames) sliced in y, x.
+
+    Attributes:
+        slice_id: Integer. Slice (depth) the pages belong to.
+        rows: Range. Page rows kept after reading.
+        columns: Range. Page columns kept after reading.
+        num_pages: Integer. Pages read (pages missing after remapping are not read).
+        bytes_read: Integer. Bytes read from disk.
+        page_ranges: List of (filename, start, stop) tuples. Runs of consecutive pages
+            read (indices within each file, stop excluded).
+    """
+    def __init__(self, slice_id, rows, columns, num_pages, bytes_read, page_ranges):
+        self.slice_id = slice_id
+        self.rows = rows
+        self.columns = columns
+        self.num_pages = num_pages
+        self.bytes_read = bytes_read
+        self.page_ranges = page_ranges
+
+
+class FieldRead():
+    """ Everything read to get one (requested) field.
+
+    Attributes:
+        field_id: Integer. Field index.
+        regions: List of RegionRead. One per read of pages (one per subfield in multiROI
+            scans).
+        bytes_requested: Integer. Bytes of the requested pixels (as stored in the files).
+        bytes_returned: Integer. Bytes of the field in the output.
+    """
+    def __init__(self, field_id, regions, bytes_requested, bytes_returned):
+        self.field_id = field_id
+        self.regions = regions
+        self.bytes_requested = bytes_requested
+        self.bytes_returned = bytes_returned
+
+    @property
+    def num_pages(self):
+        return sum(region.num_pages for region in self.regions)
+
+    @property
+    def bytes_read(self):
+        return sum(region.bytes_read for region in self.regions)
+
+
+def _amplification(bytes_read, bytes_requested):
+    return bytes_read / bytes_requested if bytes_requested > 0 else float('nan')
+
+
+class ReadPlan():
+    """ What scan[key] would read.
+
+    Attributes:
+        key: Tuple. Key filled to 5 dimensions.
+        shape: Tuple. Shape of the returned array.
+        dtype: Data type of the returned array.
+        field_reads: List of FieldRead. One per requested field (in order).
+    """
+    def __init__(self, key, shape, dtype, field_reads):
+        self.key = key
+        self.shape = shape
+        self.dtype = dtype
+        self.field_reads = field_reads
+
+    @property
+    def num_pages(self):
+        return sum(field_read.num_pages for field_read in self.field_reads)
+
+    @property
+    def bytes_requested(self):
+        return sum(field_read.bytes_requested for field_read in self.field_reads)
+
+    @property
+    def bytes_read(self):
+        return sum(field_read.bytes_read for field_read in self.field_reads)
+
+    @property
+    def bytes_returned(self):
+        return sum(field_read.bytes_returned for field_read in self.field_reads)
+
+    @property
+    def amplification(self):
+        return _amplification(self.bytes_read, self.bytes_requested)
+
+    @property
+    def files(self):
+        """ Dictionary mapping each file read to the number of pages read from it."""
+        files = {}
+        for field_read in self.field_reads:
+            for region in field_read.regions:
+                for filename, start, stop in region.page_ranges:
+                    files[filename] = files.get(filename, 0) + stop - start
+        return files
+
+    def __str__(self):
+        lines = ['Read plan for key {}: output {} {}'.format(self.key, self.shape,
+                                                              np.dtype(self.dtype).name),
+                 '  {} pages from {} files; {:.2f} MB requested, {:.2f} MB read ({:.1f}x), '
+                 '{:.2f} MB returned'.format(self.num_pages, len(self.files),
+                                              self.bytes_requested / 2 ** 20,
+                                              self.bytes_read / 2 ** 20, self.amplification,
+                                              self.bytes_returned / 2 ** 20)]
+        for field_read in self.field_reads:
+            lines.append('  field {}: {:.2f} MB read for {:.2f} MB requested ({:.1f}x)'.format(
+                field_read.field_id, field_read.bytes_read / 2 ** 20,
+                field_read.bytes_requested / 2 ** 20,
+                _amplification(field_read.bytes_read, field_read.bytes_requested)))
+            for region in field_read.regions:
+                ranges = ['{}[{}:{}]'.format(path.basename(filename), start, stop) for
+                          filename, start, stop in region.page_ranges]
+                if len(ranges) > _MAX_RANGES:
+                    ranges = ranges[:_MAX_RANGES] + ['... ({} runs)'.format(len(ranges))]
+                lines.append('    slice {}, rows {}:{}, columns {}:{}: {} pages {}'.format(
+                    region.slice_id, region.rows.start, region.rows.stop,
+                    region.columns.start, region.columns.stop, region.num_pages,
+                    ' '.join(ranges)))
+        return '\n'.join(lines)
+
+
+class ReadCounters():
+    """ Cumulative bytes requested, read and returned per field (thread-safe).
+
+    Attributes:
+        num_reads: Array. Number of times each field was read.
+        num_pages: Array. Pages read from disk for each field.
+        bytes_requested: Array. Bytes requested from each field.
+        bytes_read: Array. Bytes read from disk for each field.
+        bytes_returned: Array. Bytes returned for each field.
+    """
+    def __init__(self, num_fields):
+        self.num_fields = num_fields
+        self._lock = threading.Lock() # scans are read from several threads
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            for name in ['num_reads', 'num_pages', 'bytes_requested', 'bytes_read',
+                         'bytes_returned']:
+                setattr(self, name, np.zeros(self.num_fields, dtype=np.int64))
+
+    def add(self, field_ids, bytes_requested, bytes_returned, weights, num_pages,
+            bytes_read):
+        """ Adds one read of some fields.
+
+        Args:
+            field_ids: List of integers. Fields read.
+            bytes_requested: List of integers. Bytes requested from each field.
+            bytes_returned: List of integers. Bytes returned for each field.
+            weights: List of integers. Pages needed by each field; num_pages and
+                bytes_read are split among the fields in proportion to them.
+            num_pages: Integer. Pages read from disk for all fields.
+            bytes_read: Integer. Bytes read from disk for all fields.
+        """
+        pages_per_field = _split(num_pages, weights)
+        bytes_per_field = _split(bytes_read, weights)
+        with self._lock:
+            np.add.at(self.num_reads, field_ids, 1)
+            np.add.at(self.num_pages, field_ids, pages_per_field)
+            np.add.at(self.bytes_requested, field_ids, bytes_requested)
+            np.add.at(self.bytes_read, field_ids, bytes_per_field)
+            np.add.at(self.bytes_returned, field_ids, bytes_returned)
+
+    @property
+    def amplification(self):
+        """ Array. Bytes read / bytes requested per field (nan if never read)."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.bytes_requested > 0, self.bytes_read /
+                            np.maximum(self.bytes_requested, 1), np.nan)
+
+    def __str__(self):
+        lines = ['field  reads     pages  requested (MB)  read (MB)  returned (MB)  amplif.']
+        for field_id in range(self.num_fields):
+            lines.append('{:5d} {:6d} {:9d} {:15.2f} {:10.2f} {:14.2f} {:8.1f}'.format(
+                field_id, self.num_reads[field_id], self.num_pages[field_id],
+                self.bytes_requested[field_id] / 2 ** 20, self.bytes_read[field_id] / 2 ** 20,
+                self.bytes_returned[field_id] / 2 ** 20, self.amplification[field_id]))
+        return '\n'.join(lines)
+
+
+def _split(total, weights):
+    """ Splits an integer total in proportion to weights (integer parts add up to it)."""
+    weights = np.asarray(weights, dtype=np.float64)
+    parts = np.floor(total * weights / max(weights.sum(), 1)).astype(np.int64)
+    parts[0] += total - parts.sum()
+    return parts
+
+
+def page_runs(pages, file_starts, filenames):
+    """ Splits page indices (counted across files) into runs of consecutive pages.
+
+    Args:
+        pages: List of integers. Pages in the order they are read (negative ones are
+            skipped).
+        file_starts: List of integers. Index of the first page of each file (and, as last
+            item, the total number of pages).
+        filenames: List of strings. Name of each file.
+
+    Returns:
+        A list of (filename, start, stop) tuples (indices within the file, stop excluded).
+    """
+    pages = np.asarray(pages, dtype=np.int64)
+    pages = pages[pages >= 0]
+    if len(pages) == 0:
+        return []
+    file_ids = np.searchsorted(file_starts, pages, side='right') - 1
+
+    # Runs break where pages are not consecutive or the file changes
+    breaks = np.flatnonzero((np.diff(pages) != 1) | (np.diff(file_ids) != 0)) + 1
+    starts = np.concatenate([[0], breaks])
+    stops = np.concatenate([breaks, [len(pages)]])
+    return [(filenames[file_ids[start]], int(pages[start] - file_starts[file_ids[start]]),
+             int(pages[stop - 1] - file_starts[file_ids[start]] + 1)) for start, stop in
+            zip(starts, stops)]
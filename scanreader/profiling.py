@@ -0,0 +1,234 @@
+""" Opt-in instrumentation of the read path.
+
+Inside a profile() block every scan[...] call (and every direct page read, e.g., from
+demux.extract_fields) is recorded as a ReadStats: seconds spent in each stage of the read
+plus the number of pages, files and bytes it touched. Outside profile() blocks the hooks
+in scans.py do nothing but a thread-local lookup.
+
+Stages:
+    plan: Parsing the key and computing which pages to read (and where they are).
+    page_lookup: Finding the pages in the tiff files (parsing IFDs): once per file for
+        files read with positional I/O (see pageio.py), per read otherwise.
+    read: Reading pixel data from disk (and decoding it; pages are uncompressed, so this
+        is at most a byte swap).
+    raster: Raster correction (only if scan.raster_phase is set).
+    copy: Slicing pages in y, x and copying them into the output array.
+    fill: Filling pages missing in remapped scans (see check_integrity).
+    reshape: Reshaping/transposing pages into the output dimensions.
+    squeeze: Dropping dimensions indexed with integers.
+
+Example:
+    with scanreader.profile() as prof:
+        field = scan[0, :, :, 0, :1000]
+    print(prof)
+    logger.info(prof.to_dicts())
+"""
+import threading
+import time
+import contextlib
+
+STAGES = ['plan', 'page_lookup', 'read', 'raster', 'copy', 'fill', 'reshape', 'squeeze']
+COUNTERS = ['num_pages', 'num_files', 'num_reads', 'bytes_read', 'cache_hits']
+
+_active_profiles = [] # profiles receiving records (from any thread)
+_lock = threading.Lock()
+_local = threading.local() # ReadStats of the call being recorded in this thread
+
+
+class ReadStats():
+    """ Statistics of one read call.
+
+    Attributes:
+        call: String. What was called: 'getitem' for scan[key], 'read_many' for
+            scan.read_many(keys), 'read_file_pages' for pages read ahead by read_many (in
+            worker threads), 'read_pages' for direct page reads.
+        key: String. Key passed to scan[key] or (slices, channels, frames) read; long
+            lists are abbreviated.
+        total_seconds: Float. Wall time of the whole call.
+        stages: Dictionary. Seconds spent in each stage (see STAGES).
+        num_pages: Integer. Pages read from disk.
+        num_files: Integer. Files read from.
+        num_reads: Integer. Read requests issued for pixel data.
+        bytes_read: Integer. Bytes of pixel data read.
+        cache_hits: Integer. Pages (or, from a field cache, frames of a field) served from
+            a cache instead of the files.
+    """
+    def __init__(self, call, key):
+        self.call = call
+        self.key = key
+        self.total_seconds = 0.0
+        self.stages = {stage: 0.0 for stage in STAGES}
+        self._running_stages = [] # [stage, start time] of stages being timed
+        for counter in COUNTERS:
+            setattr(self, counter, 0)
+
+    def as_dict(self):
+        """ Flat dictionary (stage times as '<stage>_seconds'), e.g., to log as JSON."""
+        stats = {'call': self.call, 'key': self.key, 'total_seconds': self.total_seconds}
+        stats.update({'{}_seconds'.format(stage): seconds for stage, seconds in
+                      self.stages.items()})
+        stats.update({counter: getattr(self, counter) for counter in COUNTERS})
+        return stats
+
+    def __str__(self):
+        stages = ', '.join('{} {:.2f}'.format(stage, seconds * 1000) for stage, seconds
+                           in self.stages.items() if seconds > 0)
+        return ('{} {}: {:.2f} ms ({}); {} pages, {} files, {} reads, {:.1f} MB, {} cache '
+                'hits').format(self.call, self.key, self.total_seconds * 1000, stages,
+                               self.num_pages, self.num_files, self.num_reads,
+                               self.bytes_read / 2 ** 20, self.cache_hits)
+
+
+class Profile():
+    """ Collection of the ReadStats recorded inside a profile() block.
+
+    Attributes:
+        records: List of ReadStats. One per call, in the order they finished.
+    """
+    def __init__(self):
+        self.records = []
+
+    def totals(self):
+        """ Dictionary with the sum of each stage time and counter over all records."""
+        totals = {'num_calls': len(self.records),
+                  'total_seconds': sum(record.total_seconds for record in self.records)}
+        totals.update({'{}_seconds'.format(stage): sum(record.stages[stage] for record
+                                                       in self.records) for stage in STAGES})
+        totals.update({counter: sum(getattr(record, counter) for record in self.records)
+                       for counter in COUNTERS})
+        return totals
+
+    def to_dicts(self):
+        """ List of dictionaries (see ReadStats.as_dict), one per record."""
+        return [record.as_dict() for record in self.records]
+
+    def __len__(self):
+        return len(self.records)
+
+    def __str__(self):
+        totals = self.totals()
+        lines = [str(record) for record in self.records]
+        lines.append('total: {} calls, {:.2f} ms, {} pages, {:.1f} MB'.format(
+            totals['num_calls'], totals['total_seconds'] * 1000, totals['num_pages'],
+            totals['bytes_read'] / 2 ** 20))
+        return '\n'.join(lines)
+
+
+@contextlib.contextmanager
+def profile():
+    """ Records every read made inside the block (from any thread).
+
+    Yields:
+        A Profile that receives one ReadStats per read call.
+    """
+    prof = Profile()
+    with _lock:
+        _active_profiles.append(prof)
+    try:
+        yield prof
+    finally:
+        with _lock:
+            _active_profiles.remove(prof)
+
+
+class _Timer():
+    """ Adds the time spent inside the block to a stage of a ReadStats. Stages nested in
+    another stage pause it (stage times do not overlap)."""
+    def __init__(self, stats, stage):
+        self.stats = stats
+        self.stage = stage
+
+    def __enter__(self):
+        now = time.perf_counter()
+        running = self.stats._running_stages
+        if running: # pause the enclosing stage
+            self.stats.stages[running[-1][0]] += now - running[-1][1]
+        running.append([self.stage, now])
+
+    def __exit__(self, *exc_info):
+        now = time.perf_counter()
+        running = self.stats._running_stages
+        stage, start = running.pop()
+        self.stats.stages[stage] += now - start
+        if running: # resume the enclosing stage
+            running[-1][1] = now
+
+
+class _Call():
+    """ Records a read call (and everything called from it) as a ReadStats."""
+    def __init__(self, call, key):
+        self.stats = ReadStats(call, key)
+
+    def __enter__(self):
+        _local.stats = self.stats
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.stats.total_seconds = time.perf_counter() - self.start
+        _local.stats = None
+        with _lock:
+            for prof in _active_profiles:
+                prof.records.append(self.stats)
+
+
+_NULL = contextlib.nullcontext()
+
+
+def record_call(call, key):
+    """ Context manager wrapping a read call. Does nothing if no profile is active or if
+    already inside a recorded call (nested calls count towards the outer one)."""
+    if not _active_profiles or getattr(_local, 'stats', None) is not None:
+        return _NULL
+    return _Call(call, _describe(key))
+
+
+def _describe(key, max_items=6):
+    """ Short repr of a key (long lists are abbreviated)."""
+    if isinstance(key, tuple):
+        return '({})'.format(', '.join(_describe(index, max_items) for index in key))
+    if isinstance(key, list) and len(key) > max_items:
+        return '[{}, ..., {}] ({} items)'.format(', '.join(repr(index) for index in
+                                                         key[:max_items // 2]),
+                                                repr(key[-1]), len(key))
+    return repr(key)
+
+
+def stage(name):
+    """ Context manager timing a stage of the current call (if recording)."""
+    stats = getattr(_local, 'stats', None)
+    return _NULL if stats is None else _Timer(stats, name)
+
+
+def count(**counters):
+    """ Adds to the counters (num_pages, bytes_read, ...) of the current call and of the
+    tallies open in this thread."""
+    stats = getattr(_local, 'stats', None)
+    targets = getattr(_local, 'tallies', [])
+    if stats is not None:
+        targets = targets + [stats]
+    for target in targets:
+        for counter, value in counters.items():
+            setattr(target, counter, getattr(target, counter) + value)
+
+
+@contextlib.contextmanager
+def tally():
+    """ Counts what is read inside the block in this thread (whether or not a profile is
+    active); tallies can be nested.
+
+    Yields:
+        A ReadStats with the counters (see COUNTERS) of everything read in the block.
+    """
+    stats = ReadStats('tally', None)
+    if getattr(_local, 'tallies', None) is None:
+        _local.tallies = []
+    _local.tallies.append(stats)
+    try:
+        yield stats
+    finally:
+        _local.tallies.remove(stats)
+
+
+def is_recording():
+    """ Whether reads in this thread are being recorded."""
+    return getattr(_local, 'stats', None) is not None
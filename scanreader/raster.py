@@ -0,0 +1,113 @@
+""" Raster (line phase) correction for bidirectional resonant scans.
+
+In bidirectional scans, lines scanned right to left (odd rows) are misaligned with
+lines scanned left to right (even rows) if the recorded phase of the resonant mirror is
+off. We model the mirror position within a line as a sine of its phase (as in
+BaseScan._compute_offsets): pixel j is recorded at phase line_angles[j], i.e., at
+position sin(line_angles[j]). A raster phase error means odd rows were actually recorded
+at sin(line_angles + raster_phase); we resample them back to sin(line_angles).
+"""
+import numpy as np
+
+
+def _interpolation_weights(line_angles, raster_phase):
+    """ Indices and weights to linearly interpolate odd rows at the corrected positions.
+
+    Args:
+        line_angles: Array. Phase of the resonant mirror at which each pixel is recorded.
+        raster_phase: Float. Phase shift (radians) of odd rows relative to even rows.
+
+    Returns:
+        indices: Array. Index of the pixel to the left of each corrected position.
+        weights: Array. Weight of the pixel to the right of each corrected position.
+    """
+    # Positions are only sorted (as searchsorted needs) while angles stay in the same
+    # half period of the mirror
+    if np.max(np.abs(line_angles)) + abs(raster_phase) >= np.pi / 2:
+        error_msg = 'raster phase {} is too large for a line spanning {} radians'
+        raise ValueError(error_msg.format(raster_phase, np.ptp(line_angles)))
+    recorded_positions = np.sin(line_angles + raster_phase)
+    desired_positions = np.sin(line_angles)
+
+    # Find the recorded pixels around each desired position (clamped at the edges)
+    indices = np.searchsorted(recorded_positions, desired_positions) - 1
+    indices = np.clip(indices, 0, len(line_angles) - 2)
+    left, right = recorded_positions[indices], recorded_positions[indices + 1]
+    weights = np.clip((desired_positions - left) / (right - left), 0, 1)
+
+    return indices, weights.astype(np.float32)
+
+
+def correct_raster(pages, rows, line_angles, raster_phase, dtype=None):
+    """ Corrects the raster phase of the odd rows in pages.
+
+    Args:
+        pages: Array (..., num_rows, page_width). Pages (or a subset of their rows).
+        rows: List or array of integers. Row in the original page of each row in pages;
+            used to know which rows are odd.
+        line_angles: Array. Phase of the resonant mirror at which each pixel is recorded.
+        raster_phase: Float. Phase shift (radians) of odd rows relative to even rows.
+        dtype: Data type of the output. Defaults to pages.dtype. Integer outputs are
+            rounded.
+
+    Returns:
+        An array with the same shape as pages and the corrected odd rows.
+    """
+    dtype = pages.dtype if dtype is None else np.dtype(dtype)
+    corrected = pages.astype(dtype, copy=True)
+
+    odd_rows = np.flatnonzero(np.asarray(rows) % 2 == 1)
+    if len(odd_rows) > 0 and raster_phase != 0:
+        indices, weights = _interpolation_weights(line_angles, raster_phase)
+        odd_lines = pages[..., odd_rows, :].astype(np.float32)
+        lines = (odd_lines[..., indices] * (1 - weights) +
+                 odd_lines[..., indices + 1] * weights)
+        if np.issubdtype(dtype, np.integer):
+            lines = np.rint(lines)
+        corrected[..., odd_rows, :] = lines
+
+    return corrected
+
+
+def compute_raster_phase(image, line_angles, max_phase=0.1, num_steps=201):
+    """ Estimates the raster phase that best aligns odd rows with even rows.
+
+    Args:
+        image: A 2-d array. Average of some frames (full page, uncorrected).
+        line_angles: Array. Phase of the resonant mirror at which each pixel is recorded.
+        max_phase: Float. Largest (absolute) raster phase to try (less if line_angles
+            plus the phase would go past pi / 2).
+        num_steps: Integer. Number of phases to try in each round of the search.
+
+    Returns:
+        A float. Raster phase (radians) that maximizes the correlation between corrected
+            odd rows and the average of their neighbouring even rows.
+    """
+    image = np.asarray(image, dtype=np.float32)
+    height, width = image.shape
+    num_pairs = (height - 1) // 2
+    if num_pairs < 1:
+        return 0.0
+
+    # Even rows around each odd row (skip 10% of pixels at each side)
+    odd_rows = np.arange(1, 2 * num_pairs + 1, 2)
+    even_rows = (image[odd_rows - 1] + image[np.minimum(odd_rows + 1, height - 1)]) / 2
+    margin = width // 10
+    xs = slice(margin, width - margin)
+    target = even_rows[:, xs] - even_rows[:, xs].mean()
+
+    def alignment(raster_phase):
+        corrected = correct_raster(image[odd_rows], odd_rows, line_angles, raster_phase)
+        corrected = corrected[:, xs] - corrected[:, xs].mean()
+        norm = np.sqrt(np.sum(corrected ** 2) * np.sum(target ** 2))
+        return np.sum(corrected * target) / norm if norm > 0 else 0
+
+    # Coarse-to-fine grid search
+    max_phase = min(max_phase, 0.999 * (np.pi / 2 - np.max(np.abs(line_angles))))
+    center, radius = 0.0, max_phase
+    for _ in range(3):
+        phases = np.linspace(center - radius, center + radius, num_steps)
+        center = phases[np.argmax([alignment(phase) for phase in phases])]
+        radius = 2 * radius / (num_steps - 1)
+
+    return float(center)
@@ -0,0 +1,241 @@
+""" Streaming NumPy reductions over scans (the __array_function__ protocol).
+
+np.mean(scan, axis=-1) would otherwise call scan.__array__() and load the whole scan in
+memory before reducing it. Scans, binary scans and lazy views (see views.py) send
+np.sum, np.mean, np.max, np.min, np.std, np.var, np.percentile, np.quantile and
+np.median here; the data is read in chunks of frames (~256 MB each) and reduced as it
+arrives so peak memory is one chunk plus the output:
+    - reductions that do not include the frame axis are computed per chunk and
+        concatenated,
+    - sum, mean, max, min, std and var over the frame axis are accumulated chunk by chunk
+        (std and var with Chan et al.'s pairwise update),
+    - percentile, quantile and median over the frame axis are approximated with as many
+        evenly spaced frames as fit in one chunk (exact if all frames fit).
+Other numpy functions (and unsupported arguments such as out= or where=) read the data
+with np.asarray() and call numpy as usual.
+
+Example:
+    mean_image = np.mean(scan[0], axis=-1) # reads everything, then reduces
+    mean_image = np.mean(scan.view[0], axis=-1) # streams
+    max_projection = np.max(scan, axis=(0, 4)) # streams
+"""
+import inspect
+import numpy as np
+
+_CHUNK_BYTES = 2 ** 28 # aim for ~256 MB of data per read
+_AxisError = getattr(np, 'exceptions', np).AxisError # moved in numpy 1.25
+
+# numpy function: (name, supported arguments)
+_REDUCTIONS = {np.sum: ('sum', {'a', 'axis', 'dtype', 'out', 'keepdims'}),
+               np.mean: ('mean', {'a', 'axis', 'dtype', 'out', 'keepdims'}),
+               np.max: ('max', {'a', 'axis', 'out', 'keepdims'}),
+               np.min: ('min', {'a', 'axis', 'out', 'keepdims'}),
+               np.std: ('std', {'a', 'axis', 'dtype', 'out', 'ddof', 'keepdims'}),
+               np.var: ('var', {'a', 'axis', 'dtype', 'out', 'ddof', 'keepdims'}),
+               np.percentile: ('percentile', {'a', 'q', 'axis', 'out', 'overwrite_input',
+                                              'method', 'keepdims'}),
+               np.quantile: ('quantile', {'a', 'q', 'axis', 'out', 'overwrite_input',
+                                          'method', 'keepdims'}),
+               np.median: ('median', {'a', 'axis', 'out', 'overwrite_input', 'keepdims'})}
+_REDUCTIONS[np.amax] = _REDUCTIONS[np.max] # different objects in older numpy versions
+_REDUCTIONS[np.amin] = _REDUCTIONS[np.min]
+
+
+def array_function(obj, view, func, args, kwargs):
+    """ Implements __array_function__ for scan-like objects.
+
+    Args:
+        obj: Object whose __array_function__ was called (scan, binary scan or view).
+        view: views.ScanView of obj.
+        func, args, kwargs: As received by __array_function__.
+
+    Returns:
+        The result of func.
+    """
+    if func in _REDUCTIONS:
+        name, supported = _REDUCTIONS[func]
+        arguments = inspect.signature(func).bind(*args, **kwargs).arguments
+        if (arguments['a'] is obj and set(arguments) <= supported and
+                arguments.get('out') is None):
+            del arguments['a']
+            if arguments.get('keepdims') is np._NoValue:
+                del arguments['keepdims']
+            return reduce(view, name, **arguments)
+
+    # Anything else: read the data and let numpy handle it
+    def to_array(arg):
+        if arg is obj:
+            return np.asarray(arg)
+        if isinstance(arg, (list, tuple)):
+            return type(arg)(to_array(item) for item in arg)
+        return arg
+    return func(*[to_array(arg) for arg in args], **kwargs)
+
+
+def reduce(view, name, axis=None, keepdims=False, chunk_size=None, **kwargs):
+    """ Reduces a view chunk by chunk (over frames).
+
+    Args:
+        view: views.ScanView. Data to reduce.
+        name: String. One of 'sum', 'mean', 'max', 'min', 'std', 'var', 'percentile',
+            'quantile' or 'median'.
+        axis: Integer, tuple of integers or None. Axes to reduce (as in numpy).
+        keepdims: Boolean. Whether reduced axes are left with size one.
+        chunk_size: Integer. Number of frames read at a time. Defaults to as many frames
+            as fit in ~256 MB.
+        kwargs: Other arguments for the numpy function (dtype, ddof, q, method).
+
+    Returns:
+        Same as the numpy function applied to np.asarray(view).
+    """
+    func = getattr(np, name)
+    ndim = view.ndim
+    axes = tuple(range(ndim)) if axis is None else _normalize_axes(axis, ndim)
+
+    # Number of frames to read at a time
+    frame_axis = view._visible_axes.index(4) if 4 in view._visible_axes else None
+    num_frames = view.shape[frame_axis] if frame_axis is not None else 1
+    if chunk_size is None:
+        frame_bytes = max(1, view.nbytes // max(1, num_frames))
+        chunk_size = _CHUNK_BYTES // frame_bytes
+    chunk_size = max(1, chunk_size)
+
+    # Everything fits in one chunk: reduce it directly
+    if frame_axis is None or num_frames <= chunk_size:
+        return func(view.read(), axis=axes, keepdims=keepdims, **kwargs)
+
+    def chunk(start, stop):
+        key = [slice(None)] * ndim
+        key[frame_axis] = slice(start, stop)
+        return view[tuple(key)].read()
+    chunk_starts = range(0, num_frames, chunk_size)
+
+    # Frames are not reduced: reduce each chunk and concatenate along frames
+    if frame_axis not in axes:
+        results = [func(chunk(start, start + chunk_size), axis=axes, keepdims=True,
+                        **kwargs) for start in chunk_starts]
+        output_frame_axis = frame_axis + np.ndim(kwargs.get('q', 0)) # q dims go first
+        result = np.concatenate(results, axis=output_frame_axis)
+        return _finish(result, axes, keepdims, np.ndim(kwargs.get('q', 0)))
+
+    # Frames are reduced
+    if name in ['percentile', 'quantile', 'median']:
+        sample = np.unique(np.linspace(0, num_frames - 1, chunk_size).round().astype(int))
+        key = [slice(None)] * ndim
+        key[frame_axis] = list(sample)
+        return func(view[tuple(key)].read(), axis=axes, keepdims=keepdims, **kwargs)
+
+    accumulator = _ACCUMULATORS[name](view.dtype, axes, **kwargs)
+    for start in chunk_starts:
+        accumulator.update(chunk(start, start + chunk_size))
+    return _finish(accumulator.result(), axes, keepdims)
+
+
+def _normalize_axes(axis, ndim):
+    """ Tuple of positive axes (raises AxisError as numpy does)."""
+    axes = (axis, ) if np.ndim(axis) == 0 else tuple(axis)
+    normalized = []
+    for axis_ in axes:
+        if not -ndim <= axis_ < ndim:
+            raise _AxisError(axis_, ndim)
+        normalized.append(axis_ % ndim)
+    if len(set(normalized)) != len(normalized):
+        raise ValueError('repeated axis')
+    return tuple(normalized)
+
+
+def _finish(result, axes, keepdims, num_leading=0):
+    """ Drops reduced axes (kept with size one while accumulating) and returns scalars
+    instead of 0-d arrays, as numpy does."""
+    if not keepdims:
+        result = np.squeeze(result, axis=tuple(axis + num_leading for axis in axes))
+    return result[()] if result.ndim == 0 else result
+
+
+class _Sum():
+    def __init__(self, data_dtype, axes, dtype=None):
+        self.axes = axes
+        self.dtype = dtype if dtype is not None else np.sum(np.zeros(1, data_dtype)).dtype
+        self.total = None
+
+    def update(self, chunk):
+        chunk_sum = np.sum(chunk, axis=self.axes, keepdims=True, dtype=self.dtype)
+        self.total = chunk_sum if self.total is None else self.total + chunk_sum
+
+    def result(self):
+        return self.total
+
+
+class _Mean():
+    def __init__(self, data_dtype, axes, dtype=None):
+        self.axes = axes
+        self.dtype = dtype if dtype is not None else np.mean(np.zeros(1, data_dtype)).dtype
+        self.total = None
+        self.count = 0
+
+    def update(self, chunk):
+        chunk_sum = np.sum(chunk, axis=self.axes, keepdims=True, dtype=np.float64)
+        self.total = chunk_sum if self.total is None else self.total + chunk_sum
+        self.count += chunk.size // chunk_sum.size
+
+    def result(self):
+        return (self.total / self.count).astype(self.dtype)
+
+
+class _Maximum():
+    ufunc = np.maximum
+
+    def __init__(self, data_dtype, axes):
+        self.axes = axes
+        self.value = None
+
+    def update(self, chunk):
+        chunk_value = self.ufunc.reduce(chunk, axis=self.axes, keepdims=True)
+        self.value = chunk_value if self.value is None else self.ufunc(self.value,
+                                                                       chunk_value)
+
+    def result(self):
+        return self.value
+
+
+class _Minimum(_Maximum):
+    ufunc = np.minimum
+
+
+class _Variance():
+    """ Running variance (Chan et al. pairwise update of count, mean and M2)."""
+    def __init__(self, data_dtype, axes, dtype=None, ddof=0):
+        self.axes = axes
+        self.dtype = dtype if dtype is not None else np.var(np.zeros(1, data_dtype)).dtype
+        self.ddof = ddof
+        self.count = 0
+        self.mean = 0
+        self.m2 = 0
+
+    def update(self, chunk):
+        chunk = chunk.astype(np.float64)
+        chunk_mean = np.mean(chunk, axis=self.axes, keepdims=True)
+        chunk_m2 = np.sum((chunk - chunk_mean) ** 2, axis=self.axes, keepdims=True)
+        chunk_count = chunk.size // chunk_mean.size
+
+        count = self.count + chunk_count
+        delta = chunk_mean - self.mean
+        self.mean = self.mean + delta * chunk_count / count
+        self.m2 = self.m2 + chunk_m2 + delta ** 2 * self.count * chunk_count / count
+        self.count = count
+
+    def result(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            variance = self.m2 / max(self.count - self.ddof, 0)
+        return variance.astype(self.dtype)
+
+
+class _StandardDeviation(_Variance):
+    def result(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            variance = self.m2 / max(self.count - self.ddof, 0)
+        return np.sqrt(variance).astype(self.dtype)
+
+
+_ACCUMULATORS = {'sum': _Sum, 'mean': _Mean, 'max': _Maximum, 'min': _Minimum,
+                 'var': _Variance, 'std': _StandardDeviation}
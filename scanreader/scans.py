@@ -23,9 +23,28 @@ from .tifffile import matlabstr2py
 import numpy as np
 import re
 import itertools
+import threading
+import os
+from concurrent.futures import ThreadPoolExecutor
 from . import utils
-from .multiroi import ROI
-from .exceptions import FieldDimensionMismatch
+from .multiroi import ROI, Field, TimeOffsets
+from .exceptions import TimestampMismatch
+from . import binary
+from . import summary
+from . import raster
+from . import descriptions
+from . import integrity
+from . import profiling
+from . import cache
+from . import plan
+from . import views
+from . import reductions
+from . import pageio
+from . import windows
+from . import aio
+from .tifffile import stack_pages
+
+_CHUNK_BYTES = 2 ** 28 # aim for ~256 MB of data per read in chunked reads
 
 class BaseScan():
     """ Properties and methods shared among all scan versions.
@@ -62,12 +81,27 @@ class BaseScan():
         self.filenames = None
         self.dtype = None
         self._tiff_files = None
+        self._file_layouts = None # where page data is in each file (see pageio.py)
+        self._lock = threading.RLock() # for reads that go through tifffile and lazy attributes
+        self.max_read_gap = pageio.MAX_GAP # bytes read through to join pages in one read
+        self.page_cache = cache.default_page_cache # pages are looked up here (see cache.py)
+        self.field_cache = None # fields are read from here before the files (see cache.py)
         self.header = ''
+        self.raster_phase = None # applied to odd rows when reading (bidirectional scans)
+        self._line_timing = None # cached
+        self._page_descriptions = None # cached
+        self._page_map = None # set by check_integrity(remap=True)
+        self._page_steps = None # cached
+        self._fill_value = 0
+        self._read_counters = None
+        self._key_sizes = None # cached
 
     @property
     def tiff_files(self):
         if self._tiff_files is None:
-            self._tiff_files = [TiffFile(filename) for filename in self.filenames]
+            with self._lock: # opened once if several threads get here
+                if self._tiff_files is None:
+                    self._tiff_files = [TiffFile(filename) for filename in self.filenames]
         return self._tiff_files
 
     @tiff_files.deleter
@@ -76,6 +110,20 @@ class BaseScan():
             for tiff_file in self._tiff_files:
                 tiff_file.close()
             self._tiff_files = None
+        if self._file_layouts is not None:
+            for layout in self._file_layouts:
+                layout.close()
+            self._file_layouts = None
+
+    @property
+    def file_layouts(self):
+        """ List of pageio.FileLayout (one per file). Computed once, when first needed."""
+        if self._file_layouts is None:
+            with self._lock, profiling.stage('page_lookup'):
+                if self._file_layouts is None:
+                    self._file_layouts = [pageio.FileLayout.from_tiff(tiff_file) for
+                                          tiff_file in self.tiff_files]
+        return self._file_layouts
 
     @property
     def version(self):
@@ -120,7 +168,9 @@ class BaseScan():
 
     @property
     def num_scanning_depths(self):
-        if self.is_slow_stack:
+        if self.is_slow_stack and self._page_map is not None: # remapped
+            num_scanning_depths = self._page_map.shape[1]
+        elif self.is_slow_stack:
             """ Number of scanning depths actually recorded in this stack."""
             num_scanning_depths = self._num_pages / (self.num_channels * self.num_frames)
             num_scanning_depths = int(num_scanning_depths) # discard last slice if incomplete
@@ -146,7 +196,9 @@ class BaseScan():
     @property
     def num_frames(self):
         """ Each tiff page is an image at a given channel, scanning depth combination."""
-        if self.is_slow_stack:
+        if self._page_map is not None: # remapped (see check_integrity)
+            num_frames = self._page_map.shape[0]
+        elif self.is_slow_stack:
             num_frames = min(self.num_requested_frames / self._num_averaged_frames,
                              self._num_pages / self.num_channels) # finished in the first slice
         else:
@@ -178,7 +230,7 @@ class BaseScan():
 
     @property
     def _num_pages(self):
-        num_pages = sum([len(tiff_file.pages) for tiff_file in self.tiff_files])
+        num_pages = sum([layout.num_pages for layout in self.file_layouts])
         return num_pages
 
     @property
@@ -189,6 +241,11 @@ class BaseScan():
     def _page_width(self):
         return self.tiff_files[0].pages[0].imagewidth
 
+    @property
+    def _page_itemsize(self):
+        """ Bytes per pixel as stored in the tiff files."""
+        return self.tiff_files[0].pages[0].dtype.itemsize
+
     @property
     def _num_averaged_frames(self):
         """ Number of requested frames are averaged to form one saved frame. """
@@ -293,12 +350,223 @@ class BaseScan():
             dtype: Data type of the output array.
         """
         self.filenames = filenames # set filenames
+        self._line_timing = None
+        self._page_descriptions = None
+        self._page_map = None
+        self._page_steps = None
+        self._read_counters = None
+        self._key_sizes = None
         self.dtype=dtype # set dtype of read data
         self.header = '{}\n{}'.format(self.tiff_files[0].pages[0].description,
                                       self.tiff_files[0].pages[0].software) # set header (ScanImage metadata)
 
-    def __array__(self):
-        return self[:]
+    def export_binary(self, dirname, fields=None, channels=None, chunk_size=None):
+        """ Writes fields to flat binary files (frames x height x width, one per field and
+        channel) plus a JSON sidecar. Reopen them with scanreader.open_binary().
+
+        Args:
+            dirname: String. Directory where files will be written (created if needed).
+            fields: Integer or list of integers. Fields to export. Defaults to all fields.
+            channels: Integer or list of integers. Channels to export. Defaults to all.
+            chunk_size: Integer. Number of frames read at a time. Defaults to as many
+                frames as fit in ~256 MB.
+
+        Returns:
+            A string. Filename of the JSON sidecar.
+        """
+        return binary.export_binary(self, dirname, fields, channels, chunk_size)
+
+    def summary_images(self, fields=None, channels=None, chunk_size=None, num_workers=1):
+        """ Computes mean, max, std and local correlation images of each field in a
+        single (streaming) pass over the scan. See summary.summary_images for details.
+
+        Args:
+            fields: Integer or list of integers. Fields to summarize. Defaults to all.
+            channels: Integer or list of integers. Channels to summarize. Defaults to all.
+            chunk_size: Integer. Number of frames read at a time.
+            num_workers: Integer. Number of threads reading different files in parallel.
+
+        Returns:
+            A list of dictionaries (one per field) with keys 'mean', 'max', 'std' and
+            'correlation', each a [y, x, channels] float array.
+        """
+        return summary.summary_images(self, fields, channels, chunk_size, num_workers)
+
+    def aread(self, key):
+        """ Coroutine reading scan[key] in a worker thread without blocking the event loop.
+        Concurrent requests are read together (pages shared by them are read once). See
+        aio.py.
+
+        Args:
+            key: Tuple of indices or single index. As in scan[key].
+
+        Returns:
+            An awaitable. Awaiting it returns the same as scan[key].
+        """
+        return aio.aread(self, key)
+
+    def aiter_chunks(self, key=slice(None), chunk_size=None):
+        """ Asynchronous iterator over chunks of frames of scan[key] (the next chunk is
+        read while the current one is used). See aio.py.
+
+        Args:
+            key: Tuple of indices or single index. As in scan[key].
+            chunk_size: Integer. Number of frames per chunk. Defaults to as many frames as
+                fit in ~64 MB.
+
+        Returns:
+            An asynchronous iterator of arrays as scan[key] with chunk_size frames each.
+        """
+        return aio.aiter_chunks(self, key, chunk_size)
+
+    def read_windows(self, field, channel, starts, length, out=None, num_workers=None):
+        """ Reads windows of consecutive frames (e.g., around trial events). Overlapping
+        windows are read once and files are read in parallel. See windows.py.
+
+        Args:
+            field: Integer. Field to read.
+            channel: Integer. Channel to read.
+            starts: List/array of integers. First frame of each window.
+            length: Integer. Number of frames per window.
+            out: Array or None. num_windows x height x width x length array to write to.
+            num_workers: Integer. Number of threads reading in parallel. Defaults to one
+                per file (at most 8).
+
+        Returns:
+            A num_windows x height x width x length array.
+        """
+        return windows.read_windows(self, field, channel, starts, length, out, num_workers)
+
+    def estimate_raster_phase(self, num_sample_frames=100):
+        """ Estimates the raster phase of odd rows (bidirectional scans) from the average
+        of some frames (evenly spaced in the scan) of the first channel. See raster.py.
+
+        Args:
+            num_sample_frames: Integer. Number of frames to average.
+
+        Returns:
+            A float. Raster phase in radians (0 for unidirectional scans).
+        """
+        if not self.is_bidirectional or self.num_frames == 0:
+            return 0.0
+
+        # Read (uncorrected) sample frames of all slices
+        num_sample_frames = min(num_sample_frames, self.num_frames)
+        frame_list = sorted(set(int(frame) for frame in np.linspace(0, self.num_frames - 1,
+                                                                  num_sample_frames)))
+        pages = self._read_pages(list(range(self.num_scanning_depths)), [0], frame_list,
+                                 correct_raster=False)
+        image = pages.mean(axis=(0, 3, 4))
+
+        return raster.compute_raster_phase(image, self._line_angles)
+
+    def frame_times(self, field, validate=False):
+        """ Seconds (since the start of the scan) at which each frame of a field starts.
+
+        Computed from the header: a frame is recorded every 1 / fps seconds (in slow
+        stacks, every time a page is scanned) and each field starts at the time of its
+        first line (see field_offsets).
+
+        Args:
+            field: Integer. Field index.
+            validate: Boolean. Whether to check the times against the timestamps ScanImage
+                writes in each page description (see page_descriptions). Raises
+                TimestampMismatch if they differ by half a frame or more.
+
+        Returns:
+            A num_frames array.
+        """
+        utils.check_index_type(0, field)
+        utils.check_index_is_in_bounds(0, field, self.num_fields)
+        field = self.fields[field]
+
+        # Compute times from header timing
+        if self.is_slow_stack:
+            seconds_per_frame = (self._num_lines_between_fields * self.seconds_per_line /
+                                 self.num_frames)
+        else:
+            seconds_per_frame = 1 / self.fps
+        field_start = field.offsets[0].line_starts[0]
+        frame_times = np.arange(self.num_frames) * seconds_per_frame + field_start
+
+        if validate:
+            # Timestamps mark the start of each page
+            pages = np.array(self._page_indices([field.slice_id], [0],
+                                                range(self.num_frames)))
+            timestamps = self.page_descriptions.timestamp
+            page_times = np.where(pages >= 0, timestamps[pages] - timestamps[0], np.nan)
+            page_start = field_start - field.yslices[0].start * self.seconds_per_line
+            differences = np.abs(page_times - (frame_times - field_start + page_start))
+            if np.any(differences >= seconds_per_frame / 2):
+                first_frame = int(np.argmax(differences >= seconds_per_frame / 2))
+                error_msg = ('Frame times computed from the header differ from the page '
+                             'timestamps from frame {} on'.format(first_frame))
+                raise TimestampMismatch(error_msg)
+
+        return frame_times
+
+    def check_integrity(self, remap=False, fill_value=None):
+        """ Looks for dropped, duplicated or misaligned frames using the frame number
+        stored in each page description. See integrity.py.
+
+        Args:
+            remap: Boolean. If True, later reads use the frame numbers to place each page
+                at its true frame and slice (num_frames may change); missing frames are
+                filled with fill_value. Pixel data is not read.
+            fill_value: Value for missing frames. Defaults to nan for float dtypes and 0
+                otherwise.
+
+        Returns:
+            An IntegrityReport.
+        """
+        page_map = self._page_map
+        if page_map is not None:
+            self._set_page_map(None) # check the original layout
+        try:
+            report = integrity.check_integrity(self)
+        finally:
+            if not remap and page_map is not None: # keep an earlier remap
+                self._set_page_map(page_map)
+
+        if remap:
+            if fill_value is None:
+                fill_value = np.nan if np.issubdtype(self.dtype, np.floating) else 0
+            self._set_page_map(report.page_map)
+            self._fill_value = fill_value
+
+        return report
+
+    def _set_page_map(self, page_map):
+        """ Sets where each (frame, slice, channel) page is (None for the original
+        layout) and resets everything computed from the old layout."""
+        self._page_map = page_map
+        self._line_timing = None
+        self._page_steps = None
+        self._read_counters = None # sized to the old number of fields
+        self._key_sizes = None
+
+    @property
+    def page_descriptions(self):
+        """ Per-page ScanImage metadata (frame numbers, timestamps, triggers, I2C data) of
+        all pages in the scan as a record array (one record per page, counted across
+        files). Read in a single pass over the files and cached. See descriptions.py."""
+        if self._page_descriptions is None:
+            self._page_descriptions = descriptions.read_descriptions(self.filenames)
+        return self._page_descriptions
+
+    @property
+    def view(self):
+        """ Lazy view of the scan: scan.view[key] composes indices without reading (see
+        views.ScanView)."""
+        return views.ScanView(self)
+
+    def __array__(self, dtype=None, copy=None):
+        item = self[:]
+        return item if dtype is None else item.astype(dtype, copy=False)
+
+    def __array_function__(self, func, types, args, kwargs):
+        """ Reductions (np.mean, np.max, ...) stream over frames; see reductions.py."""
+        return reductions.array_function(self, self.view, func, args, kwargs)
 
     def __str__(self):
         msg = '{}\n{}\n{}'.format(type(self), '*' * 80, self.header, '*' * 80)
@@ -310,8 +578,429 @@ class BaseScan():
     def __getitem__(self, key):
         """ Index scans by field, y, x, channels, frames. Supports integer, slice and
         array/tuple/list of integers as indices."""
+        with profiling.record_call('getitem', key):
+            with profiling.stage('plan'):
+                full_key, *index_lists = self._parse_key(key)
+            item = self._read_parsed_key(full_key, index_lists)
+
+        return item
+
+    def _read_parsed_key(self, full_key, index_lists):
+        """ Reads the item defined by a parsed key (as returned by _parse_key) and adds the
+        read to self.read_counters."""
+        # Edge case when slice index gives 0 elements or index is empty list, e.g., scan[10:0], scan[[]]
+        field_list, y_lists, x_lists, channel_list, frame_list = index_lists
+        if [] in [field_list, *y_lists, *x_lists, channel_list, frame_list]:
+            return np.empty(0)
+
+        # Read the required pages
+        with profiling.tally() as disk:
+            item = self._read_cached_item(full_key, *index_lists)
+        self._count_reads([index_lists], disk.num_pages, disk.bytes_read)
+
+        # If original index was an integer, delete that axis (as in numpy indexing)
+        with profiling.stage('squeeze'):
+            squeeze_dims = [i for i, index in enumerate(full_key) if
+                            np.issubdtype(type(index), np.signedinteger)]
+            item = np.squeeze(item, axis=tuple(squeeze_dims))
+
+        return item
+
+    def prefetch(self, key):
+        """ Reads the pages needed for scan[key] into self.page_cache (so that reading
+        key later does not go to disk). Does nothing if the scan has no page cache.
+
+        Args:
+            key: Tuple of indices or single index. As in scan[key].
+        """
+        if self.page_cache is None:
+            return
+        _, field_list, _, _, channel_list, frame_list = self._parse_key(key)
+        slice_list = sorted(set(region[0] for field_id in field_list for region in
+                                self._field_regions(field_id)))
+        pages = self._page_indices(slice_list, channel_list, frame_list)
+        pages = np.unique(pages[pages >= 0])
+        file_starts = np.cumsum([0] + [layout.num_pages for layout in self.file_layouts])
+        file_ids = np.searchsorted(file_starts, pages, side='right') - 1
+        for file_id in np.unique(file_ids):
+            self._read_cached_pages(file_id, pages[file_ids == file_id] -
+                                    file_starts[file_id])
+
+    def read_many(self, keys, num_workers=None):
+        """ Reads many keys at once; same as [scan[key] for key in keys].
+
+        Keys are planned together: the pages needed by all keys are read once (in file
+        order, different files in parallel) into a single array and each item is
+        gathered from it. Keys are processed in batches of ~256 MB of pages.
+
+        Args:
+            keys: List (or any iterable) of keys (tuples of indices or single indices, as
+                in scan[key]).
+            num_workers: Integer. Number of threads reading different files in parallel.
+                Defaults to one per file (at most 8).
+
+        Returns:
+            A list of arrays, one per key.
+        """
+        keys = list(keys) # iterated more than once
+        with profiling.record_call('read_many', keys):
+            with profiling.stage('plan'):
+                parsed_keys = [self._parse_key(key) for key in keys]
+            if self.field_cache is not None: # read from the field cache (not page by page)
+                return [self._read_parsed_key(full_key, index_lists) for full_key,
+                        *index_lists in parsed_keys]
+
+            with profiling.stage('plan'):
+                file_starts = np.cumsum([0] + [layout.num_pages for layout in
+                                               self.file_layouts])
+                page_bytes = self._page_height * self._page_width * self._page_itemsize
+                if num_workers is None:
+                    num_workers = min(len(self.filenames), os.cpu_count() or 1,
+                                      windows._MAX_WORKERS)
+
+                # Plan every key and group keys in batches
+                key_reads = [self._region_reads(*index_lists) for _, *index_lists in
+                             parsed_keys]
+                batches = [] # (list of key positions, pages they need)
+                for i, field_reads in enumerate(key_reads):
+                    if (not batches or len(batches[-1][1]) * page_bytes > _CHUNK_BYTES):
+                        batches.append(([], set()))
+                    batches[-1][0].append(i)
+                    for region_reads in field_reads:
+                        for pages, *_ in region_reads:
+                            batches[-1][1].update(pages[pages >= 0].tolist())
+
+            items = [None] * len(parsed_keys)
+            for key_positions, pages in batches:
+                # Read the pages of all keys in the batch (files in parallel)
+                pages = np.array(sorted(pages), dtype=np.int64)
+                layout = self.file_layouts[0]
+                page_dtype = (layout.dtype if layout.data_offsets is not None else
+                              self.tiff_files[0].pages[0].dtype)
+                batch_pages = np.empty([max(len(pages), 1), self._page_height,
+                                        self._page_width], dtype=page_dtype) # 1 if all missing
+                file_ids = np.searchsorted(file_starts, pages, side='right') - 1
+                file_reads = [(file_id, np.flatnonzero(file_ids == file_id)) for file_id in
+                              np.unique(file_ids)]
+                def read_file(file_read):
+                    file_id, positions = file_read
+                    file_indices = pages[positions] - file_starts[file_id]
+                    with profiling.record_call('read_file_pages', (self.filenames[file_id],
+                                                                   file_indices.tolist())):
+                        with profiling.tally() as disk:
+                            self._read_file_pages(file_id, file_indices,
+                                                  out=batch_pages[positions[0]:
+                                                                  positions[-1] + 1])
+                        return disk
+                with ThreadPoolExecutor(max(1, min(num_workers, len(file_reads)))) as executor:
+                    disks = list(executor.map(read_file, file_reads))
+
+                # Gather each item from the pages read
+                for i in key_positions:
+                    full_key, *index_lists = parsed_keys[i]
+                    items[i] = self._gather_item(full_key, index_lists, key_reads[i],
+                                                 pages, batch_pages)
+                del batch_pages
+
+                # Pages read for the batch are counted once, split among its keys
+                self._count_reads([parsed_keys[i][1:] for i in key_positions],
+                                  sum(disk.num_pages for disk in disks),
+                                  sum(disk.bytes_read for disk in disks))
+
+        return items
+
+    def _region_reads(self, field_list, y_lists, x_lists, channel_list, frame_list):
+        """ Where the requested part of each field is in the pages (see _field_regions).
+
+        Returns:
+            A list (one per field) of lists (one per region with requested pixels) of
+                (pages, page_rows, page_columns, rows, columns) tuples: pages with each
+                frame, channel combination (frames change slowest; -1 if missing), rows
+                and columns to take from them and where they go in the requested field.
+        """
+        field_reads = []
+        for field_id, y_list, x_list in zip(field_list, y_lists, x_lists):
+            region_reads = []
+            for slice_id, yslice, xslice, y, x in self._field_regions(field_id):
+                region_rows = range(*yslice.indices(self._page_height))
+                region_columns = range(*xslice.indices(self._page_width))
+                ys, xs = np.asarray(y_list) - y, np.asarray(x_list) - x
+                rows = np.flatnonzero((ys >= 0) & (ys < len(region_rows)))
+                columns = np.flatnonzero((xs >= 0) & (xs < len(region_columns)))
+                if len(rows) > 0 and len(columns) > 0:
+                    pages = self._page_indices([slice_id], channel_list, frame_list)
+                    page_rows = region_rows.start + ys[rows] * region_rows.step
+                    page_columns = region_columns.start + xs[columns] * region_columns.step
+                    region_reads.append((pages, page_rows, page_columns, rows, columns))
+            field_reads.append(region_reads)
+        return field_reads
+
+    def _gather_item(self, full_key, index_lists, field_reads, pages, batch_pages):
+        """ Assembles the item of a parsed key from pages already read (see read_many).
+
+        Args:
+            full_key, index_lists: As returned by _parse_key.
+            field_reads: As returned by _region_reads.
+            pages: Array. Page indices (counted across files, sorted) of batch_pages.
+            batch_pages: Array. Pages read (num_pages x page_height x page_width).
+
+        Returns:
+            The same array as self[key].
+        """
+        field_list, y_lists, x_lists, channel_list, frame_list = index_lists
+        if [] in [field_list, *y_lists, *x_lists, channel_list, frame_list]:
+            return np.empty(0)
+
+        # Pages of each field (frames change slowest), as returned by _read_pages
+        item_pages = np.empty([len(field_list), len(frame_list) * len(channel_list),
+                               len(y_lists[0]), len(x_lists[0])], dtype=self.dtype)
+        for field_pages, region_reads in zip(item_pages, field_reads):
+            for region_pages, page_rows, page_columns, rows, columns in region_reads:
+                positions = np.searchsorted(pages, region_pages)
+                positions = np.minimum(positions, len(pages) - 1) # missing pages (-1)
+
+                # Take rows and columns (whole rows first for raster correction)
+                with profiling.stage('copy'):
+                    region = batch_pages[utils.as_index(positions)]
+                    region = region[:, utils.as_index(page_rows)]
+                    if not self.raster_phase:
+                        region = region[..., utils.as_index(page_columns)]
+                if self.raster_phase:
+                    with profiling.stage('raster'):
+                        region = raster.correct_raster(region, page_rows, self._line_angles,
+                                                       self.raster_phase, self.dtype)
+                        region = region[..., utils.as_index(page_columns)]
+
+                # Place them in the field
+                with profiling.stage('copy'):
+                    yindex, xindex = utils.as_index(rows), utils.as_index(columns)
+                    if not isinstance(yindex, slice) and not isinstance(xindex, slice):
+                        yindex, xindex = np.ix_(rows, columns) # outer, not paired, indexing
+                    field_pages[:, yindex, xindex] = region
+                with profiling.stage('fill'): # only after remapping (see check_integrity)
+                    for page_position in np.flatnonzero(region_pages < 0):
+                        field_pages[page_position, yindex, xindex] = self._fill_value
+
+        # Reshape the pages into (fields, y, x, channels, frames)
+        with profiling.stage('reshape'):
+            item = item_pages.reshape(len(field_list), len(frame_list), len(channel_list),
+                                      len(y_lists[0]), len(x_lists[0]))
+            item = item.transpose([0, 3, 4, 2, 1])
+
+        # If original index was an integer, delete that axis (as in numpy indexing)
+        with profiling.stage('squeeze'):
+            squeeze_dims = [i for i, index in enumerate(full_key) if
+                            np.issubdtype(type(index), np.signedinteger)]
+            item = np.squeeze(item, axis=tuple(squeeze_dims))
+
+        return item
+
+    def _parse_key(self, key):
+        """ Checks the key and computes the indices to read in each dimension.
+
+        Args:
+            key: Tuple of indices or single index. Key as received by __getitem__().
+
+        Returns:
+            full_key: Tuple of 5 indices. Key filled with slice(None) until size 5.
+            field_list: List of integers. Fields to read.
+            y_lists: List of lists. Rows to read in each field.
+            x_lists: List of lists. Columns to read in each field.
+            channel_list: List of integers. Channels to read.
+            frame_list: List of integers. Frames to read.
+
+        Raises:
+            IndexError, TypeError: If the key is invalid or out of bounds.
+        """
+        raise NotImplementedError('Subclasses of BaseScan must implement this method')
+
+    def _read_cached_item(self, full_key, field_list, y_lists, x_lists, channel_list,
+                          frame_list):
+        """ Same as _read_item but through self.field_cache (if set)."""
+        if self.field_cache is not None:
+            return self.field_cache.read_item(self, full_key, field_list, y_lists, x_lists,
+                                              channel_list, frame_list)
+        return self._read_item(full_key, field_list, y_lists, x_lists, channel_list,
+                               frame_list)
+
+    def _read_item(self, full_key, field_list, y_lists, x_lists, channel_list, frame_list):
+        """ Reads the data defined by the lists of indices (as returned by _parse_key).
+
+        Returns:
+            A 5-D array (num_fields, num_ys, num_xs, num_channels, num_frames).
+        """
+        raise NotImplementedError('Subclasses of BaseScan must implement this method')
+
+    def _field_regions(self, field_id):
+        """ How _read_item reads a field: one (slice_id, yslice, xslice, y, x) tuple per
+        read of pages (pages of slice_id sliced in y, x after reading and placed at row y,
+        column x of the field)."""
         raise NotImplementedError('Subclasses of BaseScan must implement this method')
 
+    def _count_reads(self, index_lists_list, num_pages, bytes_read):
+        """ Adds reads (index lists as returned by _parse_key) to self.read_counters.
+        Pages and bytes read from disk for all of them are split among the fields read in
+        proportion to the pages each one needs."""
+        field_ids, bytes_requested, bytes_returned, weights = [], [], [], []
+        for field_list, y_lists, x_lists, channel_list, frame_list in index_lists_list:
+            if [] in [field_list, *y_lists, *x_lists, channel_list, frame_list]:
+                continue # nothing read
+            num_planes = len(channel_list) * len(frame_list)
+            pages_per_read = len(set(channel_list)) * len(set(frame_list)) # read once
+            for field_id, y_list, x_list in zip(field_list, y_lists, x_lists):
+                num_pixels = len(y_list) * len(x_list) * num_planes
+                field_ids.append(field_id)
+                bytes_requested.append(num_pixels * self._page_itemsize)
+                bytes_returned.append(num_pixels * np.dtype(self.dtype).itemsize)
+                weights.append(len(self._field_regions(field_id)) * pages_per_read)
+        if not field_ids:
+            return
+        self.read_counters.add(field_ids, bytes_requested, bytes_returned, weights,
+                               num_pages, bytes_read)
+
+    @property
+    def read_counters(self):
+        """ Cumulative bytes requested, read from disk and returned per field by scan[key],
+        read_many() and read_binned() (see plan.ReadCounters; explain() gives the bytes
+        planned for a key). Call read_counters.reset() to restart."""
+        if self._read_counters is None:
+            read_counters = plan.ReadCounters(self.num_fields)
+            with self._lock: # created once if several threads get here
+                if self._read_counters is None:
+                    self._read_counters = read_counters
+        return self._read_counters
+
+    def explain(self, key):
+        """ Describes what scan[key] would read without reading it.
+
+        Args:
+            key: Tuple of indices or single index. As in scan[key].
+
+        Returns:
+            A plan.ReadPlan with the files, page ranges, page rows/columns and bytes that
+                would be read for each requested field.
+
+        Raises:
+            IndexError, TypeError: If the key is invalid or out of bounds.
+        """
+        full_key, *index_lists = self._parse_key(key)
+        field_list, y_lists, x_lists, channel_list, frame_list = index_lists
+        if [] in [field_list, *y_lists, *x_lists, channel_list, frame_list]:
+            return plan.ReadPlan(full_key, (0, ), np.float64, [])
+
+        shape = [len(field_list), len(y_lists[0]), len(x_lists[0]), len(channel_list),
+                 len(frame_list)]
+        shape = tuple(size for size, index in zip(shape, full_key) if not
+                      np.issubdtype(type(index), np.signedinteger))
+        field_reads = self._plan_fields(*index_lists)
+
+        return plan.ReadPlan(full_key, shape, self.dtype, field_reads)
+
+    def _plan_fields(self, field_list, y_lists, x_lists, channel_list, frame_list):
+        """ Pages and bytes read for each requested field (see _read_item).
+
+        Args:
+            field_list, y_lists, x_lists, channel_list, frame_list: As returned by
+                _parse_key.
+
+        Returns:
+            A list of plan.FieldRead, one per field in field_list.
+        """
+        page_bytes = self._page_height * self._page_width * self._page_itemsize
+        pages_per_read = len(channel_list) * len(frame_list)
+        unique_pages_per_read = len(set(channel_list)) * len(set(frame_list)) # read once
+        file_starts = np.cumsum([0] + [layout.num_pages for layout in self.file_layouts])
+
+        field_reads = []
+        for field_id, y_list, x_list in zip(field_list, y_lists, x_lists):
+            regions = []
+            for slice_id, yslice, xslice, _, _ in self._field_regions(field_id):
+                num_pages = unique_pages_per_read
+                if self._page_map is not None: # pages missing after remapping are not read
+                    page_map = self._page_map[:, slice_id][np.ix_(frame_list, channel_list)]
+                    num_pages = len(np.unique(page_map[page_map >= 0]))
+                # Pages are read sorted (see _read_file_pages)
+                pages = self._page_indices([slice_id], channel_list, frame_list)
+                page_ranges = plan.page_runs(np.unique(pages), file_starts, self.filenames)
+                regions.append(plan.RegionRead(slice_id,
+                                               range(*yslice.indices(self._page_height)),
+                                               range(*xslice.indices(self._page_width)),
+                                               num_pages, num_pages * page_bytes,
+                                               page_ranges))
+            num_pixels = len(y_list) * len(x_list) * pages_per_read
+            field_reads.append(plan.FieldRead(field_id, regions,
+                                              num_pixels * self._page_itemsize,
+                                              num_pixels * np.dtype(self.dtype).itemsize))
+
+        return field_reads
+
+    def read_binned(self, key, bin_size, reducer='mean', chunk_size=None):
+        """ Reads the scan reducing each bin of consecutive frames to a single frame.
+
+        Frames are read in chunks and reduced as they arrive so memory usage is bounded
+        by the chunk size (plus the output), not by the number of frames requested.
+
+        Args:
+            key: Tuple of indices or single index. As in scan[key]. Frames in the key are
+                grouped in bins of bin_size (the last bin may be smaller).
+            bin_size: Integer. Number of frames per bin.
+            reducer: String. How to reduce each bin: 'mean', 'sum' or 'max'.
+            chunk_size: Integer. Number of frames read at a time (rounded up to a
+                multiple of bin_size). Defaults to as many frames as fit in ~256 MB.
+
+        Returns:
+            An array as scan[key] with num_frames / bin_size frames. float32 for 'mean'
+            and 'sum', self.dtype for 'max'.
+        """
+        if reducer not in ['mean', 'sum', 'max']:
+            raise ValueError('reducer should be one of mean, sum or max')
+        if bin_size < 1:
+            raise ValueError('bin_size should be a positive integer')
+
+        full_key, *index_lists = self._parse_key(key)
+        field_list, y_lists, x_lists, channel_list, frame_list = index_lists
+        if [] in [field_list, *y_lists, *x_lists, channel_list, frame_list]:
+            return np.empty(0)
+
+        # Compute how many bins to read at a time
+        bin_starts = list(range(0, len(frame_list), bin_size))
+        if chunk_size is None:
+            frame_bytes = (len(field_list) * len(y_lists[0]) * len(x_lists[0]) *
+                           len(channel_list) * np.dtype(self.dtype).itemsize)
+            chunk_size = _CHUNK_BYTES // frame_bytes
+        bins_per_chunk = max(1, int(np.ceil(chunk_size / bin_size)))
+
+        # Read and reduce chunk by chunk
+        out_dtype = self.dtype if reducer == 'max' else np.float32
+        item = np.empty([len(field_list), len(y_lists[0]), len(x_lists[0]),
+                         len(channel_list), len(bin_starts)], dtype=out_dtype)
+        for i in range(0, len(bin_starts), bins_per_chunk):
+            chunk_starts = bin_starts[i: i + bins_per_chunk]
+            chunk_frames = frame_list[chunk_starts[0]: chunk_starts[-1] + bin_size]
+            with profiling.tally() as disk:
+                chunk = self._read_cached_item(full_key, field_list, y_lists, x_lists,
+                                               channel_list, chunk_frames)
+            self._count_reads([(field_list, y_lists, x_lists, channel_list, chunk_frames)],
+                              disk.num_pages, disk.bytes_read)
+
+            # Reduce bins in this chunk
+            bin_offsets = [start - chunk_starts[0] for start in chunk_starts]
+            if reducer == 'max':
+                reduced = np.maximum.reduceat(chunk, bin_offsets, axis=-1)
+            else:
+                reduced = np.add.reduceat(chunk, bin_offsets, axis=-1, dtype=np.float32)
+                if reducer == 'mean':
+                    bin_lengths = np.diff(bin_offsets + [len(chunk_frames)])
+                    reduced /= bin_lengths
+            item[..., i: i + len(chunk_starts)] = reduced
+
+        # If original index was an integer, delete that axis (as in numpy indexing)
+        squeeze_dims = [i for i, index in enumerate(full_key) if np.issubdtype(type(index),
+                                                                               np.signedinteger)]
+        item = np.squeeze(item, axis=tuple(squeeze_dims))
+
+        return item
+
     def __iter__(self):
         class ScanIterator:
             """ Iterator for Scan objects."""
@@ -330,7 +1019,7 @@ class BaseScan():
         return ScanIterator(self)
 
     def _read_pages(self, slice_list, channel_list, frame_list, yslice=slice(None),
-                    xslice=slice(None)):
+                    xslice=slice(None), correct_raster=True):
         """ Reads the tiff pages with the content of each slice, channel, frame
         combination and slices them in the y, x dimension.
 
@@ -358,6 +1047,8 @@ class BaseScan():
             frame_list: List of integers. Frames to read
             yslice: Slice object. How to slice the pages in the y axis.
             xslice: Slice object. How to slice the pages in the x axis.
+            correct_raster: Boolean. Whether to correct the raster phase of odd rows (if
+                self.raster_phase is set).
 
         Returns:
             A 5-D array (num_slices, output_height, output_width, num_channels, num_frames).
@@ -372,48 +1063,166 @@ class BaseScan():
             want to read (the output array, the read pages and the list-sliced pages).
             Slices limit this to 2x (output array and read pages which are sliced in place).
         """
-        # Compute pages to load from tiff files
-        if self.is_slow_stack:
-            frame_step = self.num_channels
-            slice_step = self.num_channels * self.num_frames
-        else:
-            slice_step = self.num_channels
-            frame_step = self.num_channels * self.num_scanning_depths
-        pages_to_read = []
-        for frame in frame_list:
-            for slice_ in slice_list:
-                for channel in channel_list:
-                    new_page = frame * frame_step + slice_ * slice_step + channel
-                    pages_to_read.append(new_page)
-
-        # Compute output dimensions
-        out_height = len(utils.listify_index(yslice, self._page_height))
-        out_width = len(utils.listify_index(xslice, self._page_width))
-
-        # Read pages
-        pages = np.empty([len(pages_to_read), out_height, out_width], dtype=self.dtype)
-        start_page = 0
-        for tiff_file in self.tiff_files:
-
-            # Get indices in this tiff file and in output array
-            final_page_in_file = start_page + len(tiff_file.pages)
-            is_page_in_file = lambda page: page in range(start_page, final_page_in_file)
-            pages_in_file = filter(is_page_in_file, pages_to_read)
-            file_indices = [page - start_page for page in pages_in_file]
-            global_indices = [is_page_in_file(page) for page in pages_to_read]
-
-            # Read from this tiff file (if needed)
-            if len(file_indices) > 0:
-                # this line looks a bit ugly but is memory efficient. Do not separate
-                pages[global_indices] = tiff_file.asarray(key=file_indices)[..., yslice, xslice]
-            start_page += len(tiff_file.pages)
-
-        # Reshape the pages into (slices, y, x, channels, frames)
-        new_shape = [len(frame_list), len(slice_list), len(channel_list), out_height, out_width]
-        pages = pages.reshape(new_shape).transpose([1, 3, 4, 2, 0])
+        with profiling.record_call('read_pages', (slice_list, channel_list, frame_list)):
+            # Compute pages to load from tiff files
+            with profiling.stage('plan'):
+                pages_to_read = self._page_indices(slice_list, channel_list, frame_list)
+
+                # Compute output dimensions
+                page_rows = utils.listify_index(yslice, self._page_height)
+                out_height = len(page_rows)
+                out_width = len(utils.listify_index(xslice, self._page_width))
+
+            # Read pages
+            pages = np.empty([len(pages_to_read), out_height, out_width], dtype=self.dtype)
+            start_page = 0
+            for file_id, layout in enumerate(self.file_layouts):
+
+                # Get indices in this tiff file and in output array
+                with profiling.stage('plan'):
+                    global_indices = ((pages_to_read >= start_page) &
+                                      (pages_to_read < start_page + layout.num_pages))
+                    file_indices = pages_to_read[global_indices] - start_page
+
+                # Read whole pages straight into the output (if they go in one block)
+                positions = np.flatnonzero(global_indices)
+                if (len(file_indices) > 0 and yslice == slice(None) and
+                    xslice == slice(None) and not (self.raster_phase and correct_raster) and
+                    positions[-1] - positions[0] + 1 == len(positions)):
+                    self._read_file_pages(file_id, file_indices,
+                                          out=pages[positions[0]: positions[-1] + 1])
+
+                # Read from this tiff file (if needed)
+                elif len(file_indices) > 0:
+                    file_pages = self._read_file_pages(file_id, file_indices)[..., yslice, :]
+                    if self.raster_phase and correct_raster:
+                        # correct whole lines (before slicing in x)
+                        with profiling.stage('raster'):
+                            file_pages = raster.correct_raster(file_pages, page_rows,
+                                                               self._line_angles,
+                                                               self.raster_phase, self.dtype)
+                    with profiling.stage('copy'):
+                        pages[global_indices] = file_pages[..., xslice]
+                    del file_pages # free memory before reading the next file
+                start_page += layout.num_pages
+
+            # Fill pages missing in the scan (only after remapping, see check_integrity)
+            with profiling.stage('fill'):
+                is_missing = pages_to_read < 0
+                if np.any(is_missing):
+                    pages[is_missing] = self._fill_value
+
+            # Reshape the pages into (slices, y, x, channels, frames)
+            with profiling.stage('reshape'):
+                new_shape = [len(frame_list), len(slice_list), len(channel_list), out_height,
+                             out_width]
+                pages = pages.reshape(new_shape).transpose([1, 3, 4, 2, 0])
 
         return pages
 
+    def _read_file_pages(self, file_id, file_indices, out=None):
+        """ Reads pages from one tiff file. Thread-safe.
+
+        Each page is read once and in file order, whatever the order of file_indices
+        (repeated pages are copied), so reversed or shuffled frame lists cost as much as
+        sorted ones. Pages are read with positional I/O, nearby pages in a single request
+        (see pageio.py and self.max_read_gap); files whose pages cannot be read that way
+        are read through tifffile, one thread at a time. If self.page_cache is set, only
+        pages not in it are read.
+
+        Args:
+            file_id: Integer. Index of the file in self.filenames.
+            file_indices: List of integers. Pages to read (indices in this file).
+
+        Returns:
+            A num_pages x page_height x page_width array (in the file's dtype), pages in
+                the order of file_indices.
+        """
+        if self.page_cache is not None:
+            file_pages = self._read_cached_pages(file_id, file_indices)
+        else:
+            file_pages = self._read_uncached_pages(file_id, file_indices, out)
+        if out is not None and file_pages is not out:
+            with profiling.stage('copy'):
+                out[...] = file_pages
+            file_pages = out
+
+        return file_pages
+
+    def _read_cached_pages(self, file_id, file_indices):
+        """ Reads pages from one tiff file through self.page_cache: cached pages are not
+        read and pages read are added to the cache. See _read_file_pages."""
+        identity = self.file_layouts[file_id].identity
+        with profiling.stage('plan'):
+            unique_indices, inverse = np.unique(file_indices, return_inverse=True)
+        with profiling.stage('page_lookup'):
+            pages = self.page_cache.get(identity, unique_indices.tolist())
+        missing = [i for i, page in enumerate(pages) if page is None]
+        profiling.count(cache_hits=len(pages) - len(missing))
+
+        if len(missing) > 0:
+            read_pages = self._read_uncached_pages(file_id, unique_indices[missing])
+            self.page_cache.put(identity, unique_indices[missing].tolist(), read_pages)
+            for i, page in zip(missing, read_pages):
+                pages[i] = page
+        with profiling.stage('copy'):
+            file_pages = np.stack(pages)
+            if not np.array_equal(unique_indices, file_indices):
+                file_pages = file_pages[inverse.ravel()] # back to the requested order
+
+        return file_pages
+
+    def _read_uncached_pages(self, file_id, file_indices, out=None):
+        """ Reads pages from one tiff file (from disk). See _read_file_pages; pages are
+        read straight into out if it has the file's dtype."""
+        layout = self.file_layouts[file_id]
+        with profiling.stage('plan'):
+            unique_indices, inverse = np.unique(file_indices, return_inverse=True)
+        if layout.data_offsets is not None:
+            if out is not None and out.dtype != layout.dtype:
+                out = None # read in the file's byte order, then copy
+            with profiling.stage('read'):
+                file_pages = layout.read(file_indices, out=out, max_gap=self.max_read_gap)
+        else:
+            with self._lock:
+                tiff_file = self.tiff_files[file_id]
+                with profiling.stage('page_lookup'):
+                    page_list = tiff_file.pages._getlist(unique_indices.tolist())
+                with profiling.stage('read'):
+                    file_pages = stack_pages(page_list).reshape(-1, *page_list[0].shape)
+            profiling.count(num_reads=len(page_list), bytes_read=file_pages.nbytes)
+            if not np.array_equal(unique_indices, file_indices):
+                with profiling.stage('copy'):
+                    file_pages = file_pages[inverse.ravel()] # back to the requested order
+        profiling.count(num_pages=len(unique_indices), num_files=1)
+
+        return file_pages
+
+    def _page_indices(self, slice_list, channel_list, frame_list):
+        """ Indices (counted across files) of the pages holding each slice, channel, frame
+        combination; frames change slowest and channels fastest. See _read_pages.
+
+        If frames have been remapped (see check_integrity), missing pages are -1.
+
+        Returns:
+            An array of integers (num_frames * num_slices * num_channels).
+        """
+        frames, slices, channels = np.ix_(np.asarray(frame_list, dtype=np.int64),
+                                          np.asarray(slice_list, dtype=np.int64),
+                                          np.asarray(channel_list, dtype=np.int64))
+        if self._page_map is not None:
+            return self._page_map[frames, slices, channels].astype(np.int64).ravel()
+
+        if self._page_steps is None: # header metadata is parsed once
+            if self.is_slow_stack:
+                self._page_steps = (self.num_channels, self.num_channels * self.num_frames)
+            else:
+                self._page_steps = (self.num_channels * self.num_scanning_depths,
+                                    self.num_channels)
+        frame_step, slice_step = self._page_steps
+        pages = frames * frame_step + slices * slice_step + channels
+        return pages.ravel()
+
     def _seconds_to_lines(self, seconds):
         """ Compute how many lines would be scanned in the given amount of seconds."""
         num_lines = int(np.ceil(seconds / self.seconds_per_line))
@@ -423,32 +1232,37 @@ class BaseScan():
 
         return num_lines
 
+    @property
+    def _line_angles(self):
+        """ Phase of the resonant mirror at which each pixel in a line is recorded."""
+        max_angle = (np.pi / 2) * self.temporal_fill_fraction
+        return np.linspace(-max_angle, max_angle, self._page_width + 2)[1:-1]
+
     def _compute_offsets(self, field_height, start_line):
         """ Computes the time offsets at which a given field was recorded.
 
         Computes the time delay at which each pixel was recorded using the start of the
-        scan as zero. It first creates an image with the number of lines scanned until
-        that point and then uses self.seconds_per_line to  transform it into seconds.
+        scan as zero. Each line starts self.seconds_per_line after the previous one and
+        pixels within a line follow the sinusoidal profile of the resonant mirror.
 
         :param int field_height: Height of the field.
         :param int start_line: Line at which this field starts.
 
-        :returns: A field_height x page_width mask with time offsets in seconds.
+        :returns: A TimeOffsets object (field_height x page_width, np.asarray(offsets)
+            gives the mask of offsets in seconds).
         """
-        # Compute offsets within a line (negligible if seconds_per_line is small)
-        max_angle = (np.pi / 2) * self.temporal_fill_fraction
-        line_angles = np.linspace(-max_angle, max_angle, self._page_width + 2)[1:-1]
-        line_offsets = (np.sin(line_angles) + 1) / 2
-
-        # Compute offsets for entire field
-        field_offsets = np.expand_dims(np.arange(0, field_height), -1) + line_offsets
-        if self.is_bidirectional: # odd lines scanned from left to right
-            field_offsets[1::2] = field_offsets[1::2] - line_offsets + (1 - line_offsets)
+        seconds_per_line, line_profile, is_bidirectional = self._get_line_timing()
+        line_starts = (np.arange(field_height) + start_line) * seconds_per_line
+        return TimeOffsets(line_starts, line_profile, seconds_per_line, is_bidirectional)
 
-        # Transform offsets from line counts to seconds
-        field_offsets = (field_offsets + start_line) * self.seconds_per_line
-
-        return field_offsets
+    def _get_line_timing(self):
+        """ Seconds per line, offsets within a line (as fraction of the line period) and
+        whether scanning is bidirectional. Parsed from the header once and cached."""
+        if self._line_timing is None:
+            # Offsets within a line (negligible if seconds_per_line is small)
+            line_profile = (np.sin(self._line_angles) + 1) / 2
+            self._line_timing = (self.seconds_per_line, line_profile, self.is_bidirectional)
+        return self._line_timing
 
 
 class ScanLegacy(BaseScan):
@@ -462,6 +1276,19 @@ class BaseScan5(BaseScan):
     """ ScanImage 5 scans: one field per scanning depth and all fields have the same
     height and width."""
 
+    def __init__(self):
+        super().__init__()
+        self._fields = None # cached
+
+    def read_data(self, filenames, dtype):
+        """ Set the header and reset cached fields."""
+        super().read_data(filenames, dtype)
+        self._fields = None
+
+    def _set_page_map(self, page_map):
+        super()._set_page_map(page_map)
+        self._fields = None # one per scanning depth (which may change)
+
     @property
     def num_fields(self):
         return self.num_scanning_depths # one field per scanning depth
@@ -496,15 +1323,29 @@ class BaseScan5(BaseScan):
         uses_fastZ = (match.group('uses_fastZ') in ['true', '1']) if match else None
         return self.is_slow_stack and uses_fastZ
 
+    @property
+    def fields(self):
+        """ One Field object per scanning depth, each covering the entire page."""
+        if self._fields is None:
+            fields = []
+            next_line = 0
+            for slice_id, depth in enumerate(self.field_depths):
+                offsets = self._compute_offsets(self.image_height, next_line)
+                field = Field(height=self.image_height, width=self.image_width,
+                              depth=depth, yslices=[slice(0, self.image_height)],
+                              xslices=[slice(0, self.image_width)],
+                              output_yslices=[slice(0, self.image_height)],
+                              output_xslices=[slice(0, self.image_width)],
+                              slice_id=slice_id, offsets=[offsets])
+                fields.append(field)
+                next_line += self._num_lines_between_fields
+            self._fields = fields
+        return self._fields
+
     @property
     def field_offsets(self):
         """ Seconds elapsed between start of frame scanning and each pixel."""
-        next_line = 0
-        field_offsets = []
-        for i in range(self.num_fields):
-            field_offsets.append(self._compute_offsets(self.image_height, next_line))
-            next_line += self._num_lines_between_fields
-        return field_offsets
+        return [field.offset_mask for field in self.fields]
 
     @property
     def _y_angle_scale_factor(self):
@@ -522,48 +1363,31 @@ class BaseScan5(BaseScan):
         x_angle_scaler = float(match.group('angle_scaler')) if match else None
         return x_angle_scaler
 
-    def __getitem__(self, key):
+    def _parse_key(self, key):
         """ In non-multiROI, all fields have the same x, y dimensions. """
-        # Fill key to size 5 (raises IndexError if more than 5)
-        full_key = utils.fill_key(key, num_dimensions=5)
-
-        # Check index types are valid
-        for i, index in enumerate(full_key):
-            utils.check_index_type(i, index)
+        if self._key_sizes is None: # header metadata is parsed once
+            num_fields, height, width, num_channels, num_frames = self.shape
+            self._key_sizes = (num_fields, [height] * num_fields, [width] * num_fields,
+                               num_channels, num_frames)
+        return utils.parse_key(key, *self._key_sizes)
 
-        # Check each dimension is in bounds
-        max_dimensions = self.shape
-        for i, (index, dim_size) in enumerate(zip(full_key, max_dimensions)):
-            utils.check_index_is_in_bounds(i, index, dim_size)
-
-        # Get fields, channels and frames as lists
-        field_list = utils.listify_index(full_key[0], self.num_fields)
-        y_list = utils.listify_index(full_key[1], self.image_height)
-        x_list = utils.listify_index(full_key[2], self.image_width)
-        channel_list = utils.listify_index(full_key[3], self.num_channels)
-        frame_list = utils.listify_index(full_key[4], self.num_frames)
-
-        # Edge case when slice index gives 0 elements or index is empty list, e.g., scan[10:0], scan[[]]
-        if [] in [field_list, y_list, x_list, channel_list, frame_list,]:
-            return np.empty(0)
+    def _field_regions(self, field_id):
+        return [(field_id, slice(None), slice(None), 0, 0)] # fields are whole pages
 
+    def _read_item(self, full_key, field_list, y_lists, x_lists, channel_list, frame_list):
         # Read the required pages
         pages = self._read_pages(field_list, channel_list, frame_list)
 
         # Index in y, x using the original key (usually slices) for memory efficiency.
-        if isinstance(full_key[1], list) and isinstance(full_key[2], list):
-            # Our behaviour for lists is to take the submatrix defined by those indices.
-            ys = [[y] for y in y_list] # ys as nested lists does the trick
-            item = pages[:, ys, x_list, :, :]
-        else:
-            item = pages[:, full_key[1], full_key[2], :, :]
-            item = item.reshape(len(field_list), len(y_list), len(x_list), len(channel_list),
-                                len(frame_list)) # put back any dropped dimension
-
-        # If original index was an integer, delete that axis (as in numpy indexing)
-        squeeze_dims = [i for i, index in enumerate(full_key) if np.issubdtype(type(index),
-                                                                               np.signedinteger)]
-        item = np.squeeze(item, axis=tuple(squeeze_dims))
+        with profiling.stage('copy'):
+            if isinstance(full_key[1], list) and isinstance(full_key[2], list):
+                # Our behaviour for lists is to take the submatrix defined by those indices.
+                ys = [[y] for y in y_lists[0]] # ys as nested lists does the trick
+                item = pages[:, ys, x_lists[0], :, :]
+            else:
+                item = pages[:, full_key[1], full_key[2], :, :]
+                item = item.reshape(len(field_list), len(y_lists[0]), len(x_lists[0]),
+                                    len(channel_list), len(frame_list)) # put back any dropped dimension
 
         return item
 
@@ -733,6 +1557,13 @@ class ScanMultiROI(NewerScan, BaseScan):
         if self.join_contiguous:
             self._join_contiguous_fields()
 
+    def _set_page_map(self, page_map):
+        super()._set_page_map(page_map)
+        if self.rois is not None: # scanning depths and time offsets may change
+            self.fields = self._create_fields()
+            if self.join_contiguous:
+                self._join_contiguous_fields()
+
     def _create_rois(self):
         """Create scan rois from the configuration file. """
         roi_infos = self.tiff_files[0].scanimage_metadata['RoiGroups']['imagingRoiGroup']['rois']
@@ -820,41 +1651,19 @@ class ScanMultiROI(NewerScan, BaseScan):
                         two_fields_were_joined = True
                         break
 
-    def __getitem__(self, key):
-        # Fill key to size 5 (raises IndexError if more than 5)
-        full_key = utils.fill_key(key, num_dimensions=5)
-
-        # Check index types are valid
-        for i, index in enumerate(full_key):
-            utils.check_index_type(i, index)
-
-        # Check each dimension is in bounds
-        utils.check_index_is_in_bounds(0, full_key[0], self.num_fields)
-        for field_id in utils.listify_index(full_key[0], self.num_fields):
-            utils.check_index_is_in_bounds(1, full_key[1], self.field_heights[field_id])
-            utils.check_index_is_in_bounds(2, full_key[2], self.field_widths[field_id])
-        utils.check_index_is_in_bounds(3, full_key[3], self.num_channels)
-        utils.check_index_is_in_bounds(4, full_key[4], self.num_frames)
-
-        # Get fields, channels and frames as lists
-        field_list = utils.listify_index(full_key[0], self.num_fields)
-        y_lists = [utils.listify_index(full_key[1], self.field_heights[field_id]) for
-                   field_id in field_list]
-        x_lists = [utils.listify_index(full_key[2], self.field_widths[field_id]) for
-                   field_id in field_list]
-        channel_list = utils.listify_index(full_key[3], self.num_channels)
-        frame_list = utils.listify_index(full_key[4], self.num_frames)
-
-        # Edge case when slice index gives 0 elements or index is empty list, e.g., scan[10:0], scan[[]]
-        if [] in [field_list, *y_lists, *x_lists, channel_list, frame_list]:
-            return np.empty(0)
+    def _parse_key(self, key):
+        if self._key_sizes is None: # header metadata is parsed once
+            self._key_sizes = (self.num_fields, self.field_heights, self.field_widths,
+                               self.num_channels, self.num_frames)
+        return utils.parse_key(key, *self._key_sizes)
 
-        # Check output heights and widths match for all fields
-        if not all(len(y_list) == len(y_lists[0]) for y_list in y_lists):
-            raise FieldDimensionMismatch('Image heights for all fields do not match')
-        if not all(len(x_list) == len(x_lists[0]) for x_list in x_lists):
-            raise FieldDimensionMismatch('Image widths for all fields do not match')
+    def _field_regions(self, field_id):
+        field = self.fields[field_id]
+        return [(field.slice_id, yslice, xslice, output_yslice.start, output_xslice.start)
+                for yslice, xslice, output_yslice, output_xslice in zip(
+                    field.yslices, field.xslices, field.output_yslices, field.output_xslices)]
 
+    def _read_item(self, full_key, field_list, y_lists, x_lists, channel_list, frame_list):
         # Over each field, read required pages and slice
         item = np.empty([len(field_list), len(y_lists[0]), len(x_lists[0]),
                         len(channel_list), len(frame_list)], dtype=self.dtype)
@@ -879,11 +1688,7 @@ class ScanMultiROI(NewerScan, BaseScan):
                 # ys as nested lists are needed for numpy to slice them correctly
 
                 # Index pages in y, x
-                item[i, output_ys, output_xs] = pages[0, ys, xs]
-
-        # If original index was an integer, delete that axis (as in numpy indexing)
-        squeeze_dims = [i for i, index in enumerate(full_key) if np.issubdtype(type(index),
-                                                                               np.signedinteger)]
-        item = np.squeeze(item, axis=tuple(squeeze_dims))
+                with profiling.stage('copy'):
+                    item[i, output_ys, output_xs] = pages[0, ys, xs]
 
         return item
\ No newline at end of file
@@ -0,0 +1,411 @@
+""" Local scan server: one process hosts scans for every client on the machine.
+
+Processes that open the same scan each parse its IFDs and read its pages on their own
+(over NFS, for instance). Instead, run a server (scanreader serve) and open scans through
+it with read_remote_scan: the server opens each scan once, keeps its page index (see
+pageio.py) and a page cache shared by all scans and clients (see cache.py), prefetches the
+frames that follow each read and sends the data back through shared memory (only a short
+JSON message goes through the socket). The socket (by default in $XDG_RUNTIME_DIR or a
+private directory in /tmp) is only accessible by the user running the server.
+
+Protocol (Unix stream socket): each message is an 8-byte little-endian length followed by
+a JSON object. Requests have an 'op' ('open', 'read', 'stats') and replies either the
+result or an 'error' (exception name and message, raised again in the client). Reads are
+written to a shared memory block owned by the connection (reused and grown as needed)
+and copied out by the client before the next request.
+
+Example:
+    $ scanreader serve --cache-size 4096
+
+    scan = scanreader.read_remote_scan(server.DEFAULT_SOCKET, '/data/my_scan_*.tif')
+    field = scan[0, :, :, 0, :1000]
+"""
+import builtins
+import json
+import os
+import socket
+import socketserver
+import stat
+import struct
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from . import core
+from . import cache
+from . import views
+from . import reductions
+from . import exceptions
+
+# Per-user directory: the socket gives access to any file the server can read
+DEFAULT_SOCKET = os.path.join(os.environ.get('XDG_RUNTIME_DIR') or os.path.join(
+    tempfile.gettempdir(), 'scanreader-{}'.format(os.getuid())), 'scanreader.sock')
+_HEADER = struct.Struct('<Q') # message length
+
+# Metadata sent to clients (when the scan has it)
+_METADATA = ['version', 'filenames', 'header', 'is_slow_stack', 'is_multiROI',
+             'num_channels', 'requested_scanning_depths', 'num_scanning_depths',
+             'scanning_depths', 'num_requested_frames', 'num_frames', 'is_bidirectional',
+             'scanner_frequency', 'seconds_per_line', 'num_fields', 'field_depths', 'fps',
+             'spatial_fill_fraction', 'temporal_fill_fraction', 'scanner_type',
+             'motor_position_at_zero', 'initial_secondary_z', 'image_height',
+             'image_width', 'shape', 'zoom', 'field_heights', 'field_widths',
+             'field_slices', 'field_rois', 'raster_phase']
+
+
+class ScanServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ Serves scans to local clients (one thread per connection).
+
+    Attributes:
+        page_cache: cache.PageCache. Pages cached for all hosted scans.
+        prefetch: Boolean. Whether the frames following each read are read into the
+            page cache in the background.
+        scans: Dictionary. Open scans by id.
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, cache_bytes=2 ** 30, prefetch=True):
+        _check_socket_path(socket_path)
+        super().__init__(socket_path, _Handler)
+        self.page_cache = cache.PageCache(cache_bytes)
+        self.prefetch = prefetch
+        self.scans = {}
+        self._scan_ids = {} # (filenames, dtype, join_contiguous, raster_correction): id
+        self._lock = threading.Lock()
+        self._prefetcher = ThreadPoolExecutor(1, thread_name_prefix='scanreader-prefetch')
+        self._prefetching = set() # scan ids with a prefetch queued or running
+
+    def server_bind(self):
+        # Created with permissions for this user only (never accessible to others)
+        umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+
+    def open_scan(self, pathnames, dtype, join_contiguous, raster_correction):
+        """ Opens a scan (or returns the id of the same scan already open)."""
+        filenames = core.expand_wildcard(pathnames)
+        key = (tuple(filenames), dtype, join_contiguous, repr(raster_correction))
+        with self._lock:
+            if key not in self._scan_ids:
+                scan = core.read_scan(filenames, np.dtype(dtype), join_contiguous,
+                                      raster_correction)
+                scan.page_cache = self.page_cache
+                scan.num_frames # index pages (once for all clients)
+                self._scan_ids[key] = len(self.scans)
+                self.scans[len(self.scans)] = scan
+        return self._scan_ids[key]
+
+    def schedule_prefetch(self, scan_id, key):
+        """ Reads the frames after key (as many as key asked for) into the page cache, in
+        the background (skipped if the scan is already prefetching)."""
+        scan = self.scans[scan_id]
+        frame_index = key[4] if len(key) == 5 else slice(None)
+        if not isinstance(frame_index, slice) or frame_index.step not in [None, 1]:
+            return
+        start, stop, _ = frame_index.indices(scan.num_frames)
+        if stop <= start or stop >= scan.num_frames:
+            return
+        next_key = key[:4] + (slice(stop, min(stop + (stop - start), scan.num_frames)), )
+        with self._lock:
+            if scan_id in self._prefetching:
+                return
+            self._prefetching.add(scan_id)
+
+        def prefetch():
+            try:
+                scan.prefetch(next_key)
+            finally:
+                with self._lock:
+                    self._prefetching.discard(scan_id)
+        self._prefetcher.submit(prefetch)
+
+    def server_close(self):
+        super().server_close()
+        self._prefetcher.shutdown(wait=False)
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    """ Answers the requests of one client connection."""
+    def setup(self):
+        self.shm = None # shared memory block for replies
+
+    def handle(self):
+        while True:
+            try:
+                request = _receive(self.request)
+            except ConnectionError:
+                break
+            try:
+                reply = getattr(self, 'do_' + request['op'])(request)
+            except Exception as error:
+                reply = {'error': type(error).__name__, 'message': str(error)}
+            _send(self.request, reply)
+
+    def do_open(self, request):
+        scan_id = self.server.open_scan(request['pathnames'], request['dtype'],
+                                        request['join_contiguous'],
+                                        request['raster_correction'])
+        scan = self.server.scans[scan_id]
+        metadata = {}
+        for name in _METADATA:
+            try:
+                metadata[name] = _to_json(getattr(scan, name))
+            except (AttributeError, NotImplementedError): # not available for this scan type
+                pass
+        return {'scan_id': scan_id, 'metadata': metadata, 'dtype': np.dtype(scan.dtype).str}
+
+    def do_read(self, request):
+        scan = self.server.scans[request['scan_id']]
+        key = decode_key(request['key'])
+        item = np.asarray(scan[key])
+        if self.server.prefetch and isinstance(key, tuple):
+            self.server.schedule_prefetch(request['scan_id'], key)
+        reply = {'shape': list(item.shape), 'dtype': item.dtype.str, 'shm': None}
+        if item.nbytes > 0:
+            if self.shm is None or self.shm.size < item.nbytes: # grow
+                size = max(item.nbytes, 2 * self.shm.size if self.shm else 0)
+                self._release()
+                self.shm = shared_memory.SharedMemory(create=True, size=size)
+            np.ndarray(item.shape, item.dtype, buffer=self.shm.buf)[...] = item
+            reply['shm'] = self.shm.name
+        return reply
+
+    def do_stats(self, request):
+        page_cache = self.server.page_cache
+        return {'num_scans': len(self.server.scans), 'cached_pages': len(page_cache),
+                'cached_bytes': page_cache.nbytes, 'hits': page_cache.hits,
+                'misses': page_cache.misses}
+
+    def _release(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def finish(self):
+        self._release()
+
+
+def _check_socket_path(socket_path):
+    """ Makes sure a server can listen on socket_path: creates its directory (private)
+    if needed and removes a socket left by a server that is no longer running.
+
+    Raises:
+        OSError: If another server is listening there, if something other than a socket
+            is there or if the directory is not private (for the default directory).
+    """
+    directory = os.path.dirname(os.path.abspath(socket_path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory, mode=0o700)
+    if directory == os.path.dirname(DEFAULT_SOCKET):
+        directory_stat = os.stat(directory)
+        if directory_stat.st_uid != os.getuid() or directory_stat.st_mode & 0o077:
+            raise OSError('{} should be a directory only accessible by this user'.format(
+                directory))
+
+    if not os.path.lexists(socket_path):
+        return
+    if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+        raise OSError('{} exists and is not a socket'.format(socket_path))
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except (ConnectionRefusedError, FileNotFoundError): # left by a previous server
+            pass
+        else:
+            raise OSError('a server is already listening on {}'.format(socket_path))
+    os.remove(socket_path)
+
+
+def serve(socket_path=DEFAULT_SOCKET, cache_bytes=2 ** 30, prefetch=True):
+    """ Runs a scan server until interrupted.
+
+    Args:
+        socket_path: String. Path of the Unix socket to listen on.
+        cache_bytes: Integer. Size of the page cache shared by all scans.
+        prefetch: Boolean. Whether to prefetch the frames following each read.
+    """
+    with ScanServer(socket_path, cache_bytes, prefetch) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+class RemoteScan():
+    """ A scan opened through a scan server; indexed as scans (scan[field, y, x, channel,
+    frame]) with the scan's metadata as attributes.
+
+    Each RemoteScan has its own connection; use one per thread.
+
+    Attributes:
+        socket_path: String. Socket of the server.
+        dtype: Data type of the data.
+        metadata: Dictionary. Metadata of the scan (num_fields, num_frames, ...).
+    """
+    def __init__(self, socket_path, pathnames, dtype=np.int16, join_contiguous=False,
+                 raster_correction=None):
+        self.socket_path = socket_path
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(socket_path)
+        self._shm = None
+        if isinstance(pathnames, str):
+            pathnames = [pathnames]
+        pathnames = [os.path.abspath(pathname) for pathname in pathnames] # server's cwd
+        reply = self._request({'op': 'open', 'pathnames': pathnames,
+                               'dtype': np.dtype(dtype).str,
+                               'join_contiguous': join_contiguous,
+                               'raster_correction': raster_correction})
+        self._scan_id = reply['scan_id']
+        self.metadata = reply['metadata']
+        self.dtype = np.dtype(reply['dtype'])
+
+    def __getattr__(self, name):
+        metadata = self.__dict__.get('metadata', {})
+        if name not in metadata:
+            raise AttributeError("'RemoteScan' object has no attribute '{}'".format(name))
+        value = metadata[name]
+        return tuple(value) if name == 'shape' else value
+
+    def _request(self, request):
+        _send(self._socket, request)
+        reply = _receive(self._socket)
+        if 'error' in reply:
+            raise _exception_class(reply['error'])(reply['message'])
+        return reply
+
+    def __getitem__(self, key):
+        reply = self._request({'op': 'read', 'scan_id': self._scan_id,
+                               'key': encode_key(key)})
+        item = np.empty(reply['shape'], dtype=reply['dtype'])
+        if reply['shm'] is not None:
+            if self._shm is None or self._shm.name != reply['shm']:
+                self._close_shm()
+                self._shm = _attach(reply['shm'])
+            item[...] = np.ndarray(item.shape, item.dtype, buffer=self._shm.buf)
+        return item
+
+    def __len__(self):
+        return self.num_fields
+
+    def __iter__(self):
+        for field_id in range(self.num_fields):
+            yield self[field_id]
+
+    @property
+    def view(self):
+        """ Lazy view of the scan (see views.py)."""
+        return views.ScanView(self)
+
+    def __array__(self, dtype=None, copy=None):
+        item = self[:]
+        return item if dtype is None else item.astype(dtype, copy=False)
+
+    def __array_function__(self, func, types, args, kwargs):
+        """ Reductions (np.mean, np.max, ...) stream over frames; see reductions.py."""
+        return reductions.array_function(self, self.view, func, args, kwargs)
+
+    def stats(self):
+        """ Dictionary with the number of scans and the page cache usage of the server."""
+        return self._request({'op': 'stats'})
+
+    def _close_shm(self):
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
+
+    def close(self):
+        self._close_shm()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __str__(self):
+        return 'Remote scan ({}) of {} via {}'.format(self.metadata.get('version'),
+                                                     self.metadata.get('filenames'),
+                                                     self.socket_path)
+
+
+def encode_key(key):
+    """ JSON-compatible version of a key (decoded back with decode_key)."""
+    if isinstance(key, tuple):
+        return {'tuple': [encode_key(index) for index in key]}
+    if isinstance(key, slice):
+        return {'slice': [encode_key(key.start), encode_key(key.stop),
+                          encode_key(key.step)]}
+    if isinstance(key, (list, np.ndarray)):
+        return [encode_key(index) for index in key]
+    if isinstance(key, np.generic):
+        return key.item()
+    return key
+
+
+def decode_key(encoded_key):
+    if isinstance(encoded_key, dict) and 'tuple' in encoded_key:
+        return tuple(decode_key(index) for index in encoded_key['tuple'])
+    if isinstance(encoded_key, dict) and 'slice' in encoded_key:
+        return slice(*encoded_key['slice'])
+    return encoded_key
+
+
+def _to_json(value):
+    """ Converts tuples, arrays and numpy scalars (recursively) to JSON types."""
+    if isinstance(value, (list, tuple)):
+        return [_to_json(item) for item in value]
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    json.dumps(value) # raises TypeError if not serializable
+    return value
+
+
+def _exception_class(name):
+    """ Exception class (builtin or scanreader's) with this name; RuntimeError if none."""
+    exception_class = getattr(exceptions, name, getattr(builtins, name, None))
+    is_exception = isinstance(exception_class, type) and issubclass(exception_class,
+                                                                    Exception)
+    return exception_class if is_exception else RuntimeError
+
+
+def _send(sock, message):
+    data = json.dumps(message).encode()
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+
+def _receive(sock):
+    length, = _HEADER.unpack(_receive_bytes(sock, _HEADER.size))
+    return json.loads(_receive_bytes(sock, length).decode())
+
+
+def _receive_bytes(sock, num_bytes):
+    data = bytearray()
+    while len(data) < num_bytes:
+        chunk = sock.recv(num_bytes - len(data))
+        if not chunk:
+            raise ConnectionError('connection closed')
+        data += chunk
+    return bytes(data)
+
+
+def _attach(name):
+    """ Attaches to a shared memory block created (and unlinked) by the server."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False) # python >= 3.13
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        from multiprocessing import resource_tracker
+        try: # the resource tracker would unlink it when this process exits
+            resource_tracker.unregister('/' + shm.name, 'shared_memory') # as registered
+        except OSError: # tracker not running
+            pass
+        return shm
@@ -0,0 +1,195 @@
+""" Summary images (mean, max, std and local correlation) computed in a single pass.
+
+Statistics are accumulated chunk by chunk with mergeable accumulators (Chan et al.'s
+parallel version of Welford's algorithm) so memory is bounded by the chunk size and
+partial results computed over different parts of the scan can be combined.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from . import utils
+from . import demux
+
+# Neighbours used for the local correlation image (each pair is only stored once)
+_NEIGHBOUR_OFFSETS = [(0, 1), (1, 0), (1, 1), (1, -1)]
+
+
+class SummaryAccumulator():
+    """ Running mean, max, variance and neighbour covariances of a field over time.
+
+    Attributes:
+        count: Integer. Number of frames accumulated.
+        mean: A height x width array. Mean of each pixel.
+        m2: A height x width array. Sum of squared deviations from the mean.
+        max: A height x width array. Max of each pixel.
+        comoments: List of arrays. Sum of co-deviations of each pixel with its right,
+            bottom, bottom-right and bottom-left neighbours.
+    """
+    def __init__(self, height, width):
+        self.height = height
+        self.width = width
+        self.count = 0
+        self.mean = np.zeros([height, width])
+        self.m2 = np.zeros([height, width])
+        self.max = np.full([height, width], -np.inf)
+        self.comoments = [np.zeros(_neighbour_shape(height, width, offset)) for offset
+                          in _NEIGHBOUR_OFFSETS]
+
+    def update(self, frames):
+        """ Adds frames (a num_frames x height x width array) to the statistics."""
+        if len(frames) == 0:
+            return
+        frames = np.asarray(frames, dtype=np.float64)
+
+        # Compute statistics of this chunk
+        chunk = SummaryAccumulator(self.height, self.width)
+        chunk.count = len(frames)
+        chunk.mean = frames.mean(axis=0)
+        deviations = frames - chunk.mean
+        chunk.m2 = np.einsum('tyx,tyx->yx', deviations, deviations)
+        chunk.max = frames.max(axis=0)
+        for i, offset in enumerate(_NEIGHBOUR_OFFSETS):
+            pixels, neighbours = _neighbour_pairs(deviations, offset)
+            chunk.comoments[i] = np.einsum('tyx,tyx->yx', pixels, neighbours)
+
+        self.merge(chunk)
+
+    def merge(self, other):
+        """ Combines the statistics of other (accumulated over different frames) into
+        this accumulator."""
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        weight = self.count * other.count / count
+
+        self.m2 += other.m2 + delta ** 2 * weight
+        for i, offset in enumerate(_NEIGHBOUR_OFFSETS):
+            pixel_delta, neighbour_delta = _neighbour_pairs(delta, offset)
+            self.comoments[i] += other.comoments[i] + pixel_delta * neighbour_delta * weight
+        self.mean += delta * other.count / count
+        self.max = np.maximum(self.max, other.max)
+        self.count = count
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / self.count)
+
+    @property
+    def correlation_image(self):
+        """ Mean correlation of each pixel with its (up to 8) neighbours."""
+        correlation_sum = np.zeros([self.height, self.width])
+        num_neighbours = np.zeros([self.height, self.width])
+        for comoment, offset in zip(self.comoments, _NEIGHBOUR_OFFSETS):
+            pixel_m2, neighbour_m2 = _neighbour_pairs(self.m2, offset)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                correlations = comoment / np.sqrt(pixel_m2 * neighbour_m2)
+            correlations[~np.isfinite(correlations)] = 0 # constant pixels
+
+            # Each correlation counts for both pixels in the pair
+            pixel_sum, neighbour_sum = _neighbour_pairs(correlation_sum, offset)
+            pixel_sum += correlations
+            neighbour_sum += correlations
+            pixel_count, neighbour_count = _neighbour_pairs(num_neighbours, offset)
+            pixel_count += 1
+            neighbour_count += 1
+
+        return correlation_sum / np.maximum(num_neighbours, 1)
+
+
+def _neighbour_shape(height, width, offset):
+    """ Shape of the arrays of pixel pairs for a given neighbour offset."""
+    return (height - abs(offset[0]), width - abs(offset[1]))
+
+
+def _neighbour_pairs(images, offset):
+    """ Views of images (..., height, width) aligned so that each pixel in the first view
+    is paired with its neighbour (at offset) in the second."""
+    dy, dx = offset
+    height, width = images.shape[-2:]
+    ys, neighbour_ys = slice(0, height - dy), slice(dy, height)
+    if dx >= 0:
+        xs, neighbour_xs = slice(0, width - dx), slice(dx, width)
+    else:
+        xs, neighbour_xs = slice(-dx, width), slice(0, width + dx)
+    return images[..., ys, xs], images[..., neighbour_ys, neighbour_xs]
+
+
+def summary_images(scan, fields=None, channels=None, chunk_size=None, num_workers=1):
+    """ Computes mean, max, std and local correlation images of each field/channel.
+
+    Args:
+        scan: A Scan object (subclass of BaseScan).
+        fields: Integer or list of integers. Fields to summarize. Defaults to all.
+        channels: Integer or list of integers. Channels to summarize. Defaults to all.
+        chunk_size: Integer. Number of frames read at a time.
+        num_workers: Integer. Number of threads reading different parts of the scan
+            (split at file boundaries when possible).
+
+    Returns:
+        A list of dictionaries (one per field) with keys 'mean', 'max', 'std' and
+        'correlation', each a [y, x, channels] float array.
+    """
+    field_list = utils.listify_selection(0, fields, scan.num_fields)
+    channel_list = utils.listify_selection(3, channels, scan.num_channels)
+    scan_fields = scan.fields
+    keys = [(field_id, channel) for field_id in set(field_list) for channel in
+            set(channel_list)]
+
+    def accumulate(frame_range): # scans are thread-safe (see pageio.py)
+        accumulators = {key: SummaryAccumulator(scan_fields[key[0]].height,
+                                                scan_fields[key[0]].width) for key in keys}
+        sinks = {key: demux.CallbackSink(lambda _, data, acc=acc: acc.update(data)) for
+                 key, acc in accumulators.items()}
+        demux.demultiplex(scan, sinks, chunk_size, frame_range=frame_range)
+        return accumulators
+
+    # Accumulate statistics (in parallel over different frame ranges)
+    frame_ranges = _split_frames(scan, num_workers)
+    with ThreadPoolExecutor(max(1, min(num_workers, len(frame_ranges)))) as executor:
+        partial_results = list(executor.map(accumulate, frame_ranges))
+    accumulators = partial_results[0]
+    for partial_accumulators in partial_results[1:]:
+        for key, accumulator in partial_accumulators.items():
+            accumulators[key].merge(accumulator)
+
+    # Gather results per field
+    results = []
+    for field_id in field_list:
+        field_accumulators = [accumulators[(field_id, channel)] for channel in channel_list]
+        results.append({
+            'mean': np.stack([acc.mean for acc in field_accumulators], axis=-1),
+            'max': np.stack([acc.max for acc in field_accumulators], axis=-1),
+            'std': np.stack([acc.std for acc in field_accumulators], axis=-1),
+            'correlation': np.stack([acc.correlation_image for acc in
+                                     field_accumulators], axis=-1)})
+
+    return results
+
+
+def _split_frames(scan, num_parts):
+    """ Splits the frames of the scan into (at most) num_parts consecutive ranges. Splits
+    happen at file boundaries when there are at least num_parts files.
+
+    Returns:
+        A list of (start, stop) tuples.
+    """
+    num_frames = scan.num_frames
+    if num_parts <= 1 or num_frames == 0:
+        return [(0, num_frames)]
+
+    # Frame at which each file starts (pages of slow stacks are not stored frame by frame)
+    if len(scan.filenames) >= num_parts and not scan.is_slow_stack:
+        file_starts = np.cumsum([0] + [layout.num_pages for layout in
+                                       scan.file_layouts])[:-1]
+        if scan._page_map is not None: # remapped: first frame with pages in each file
+            frame_pages = scan._page_map.reshape(num_frames, -1).max(axis=1)
+            file_starts = np.searchsorted(np.maximum.accumulate(frame_pages), file_starts)
+        else:
+            file_starts = file_starts // (scan.num_channels * scan.num_scanning_depths)
+        boundaries = [file_starts[i] for i in np.linspace(0, len(file_starts), num_parts,
+                                                          endpoint=False).astype(int)]
+    else:
+        boundaries = np.linspace(0, num_frames, num_parts, endpoint=False).astype(int)
+    boundaries = sorted(set(int(b) for b in boundaries) | {num_frames})
+
+    return [(start, stop) for start, stop in zip(boundaries[:-1], boundaries[1:])]
@@ -0,0 +1,270 @@
+""" Synthetic ScanImage scans for tests and benchmarks.
+
+Files written here mimic the layout of ScanImage BigTIFFs: a static header block at the
+start of the file (the 'SI.*' header and the RoiGroups JSON) followed by equidistant
+IFDs, each one immediately followed by its (padded) ImageDescription and image data.
+
+Pages are built in batches as structured arrays (IFD, description and image data of each
+page in one record) and written with one sequential write per batch, so large scans are
+written at close to disk speed.
+
+Example:
+    filenames = testing.write_synthetic_scan('/tmp/scan.tif', version='2016b', frames=1000,
+                                             depths=[0, 50], files=4)
+    scan = scanreader.read_scan(filenames)
+    expected_page = testing.synthetic_page(0, scan.image_height, scan.image_width)
+"""
+import json
+import struct
+from os import path
+import numpy as np
+
+_DESCRIPTION_SIZE = 512  # bytes reserved for each page description
+_BATCH_BYTES = 2 ** 26  # write ~64 MB of pages at a time
+
+
+def synthetic_page(page_id, height, width):
+    """ Deterministic content of one synthetic page.
+
+    Args:
+        page_id: Integer. Index of the page in the scan (counted across files).
+        height: Integer. Page height.
+        width: Integer. Page width.
+
+    Returns:
+        A height x width int16 array.
+    """
+    return _synthetic_pages(np.array([page_id]), height, width)[0]
+
+
+def _synthetic_pages(page_ids, height, width, out=None):
+    """ Content of many synthetic pages (num_pages x height x width int16 array).
+
+    Values are ((pixel * 7 + page_id * 1031) % 4001 - 2000); both terms are reduced modulo
+    4001 first so the sum fits in int16 and the modulo becomes a single subtraction.
+    """
+    base = (np.arange(height * width, dtype=np.int64) * 7 % 4001).astype(np.int16)
+    shifts = (np.asarray(page_ids, dtype=np.int64) * 1031 % 4001).astype(np.int16)
+    if out is None:
+        out = np.empty([len(shifts), height, width], dtype=np.int16)
+    pages = out.reshape(len(shifts), height * width)
+    np.add(base, shifts[:, None], out=pages)
+    pages -= np.where(pages >= 4001, np.int16(4001 + 2000), np.int16(2000))
+    return out
+
+
+def write_synthetic_scan(filename, version='5.1', num_channels=1, depths=(0,), frames=10,
+                         files=1, height=64, width=64, rois=None, slow_stack=False,
+                         bidirectional=True, scanner_frequency=12000, num_fly_to_lines=16,
+                         num_fly_back_lines=16, dropped_frames=()):
+    """ Writes a ScanImage-like scan to disk.
+
+    Args:
+        filename: String. Name of the tiff file. If files > 1, '_00001', '_00002', ...
+            are appended to the base name (as ScanImage does).
+        version: String. ScanImage version written in the header, e.g., '5.1', '2016b'.
+        num_channels: Integer. Number of channels saved.
+        depths: List of integers. Scanning depths (one field per depth in non-multiROI
+            scans).
+        frames: Integer. Number of frames (timesteps) in the scan.
+        files: Integer. Number of files in which to split the scan.
+        height: Integer. Page height. Ignored if rois is given.
+        width: Integer. Page width. Ignored if rois is given.
+        rois: List of dictionaries or None. If given, a multiROI scan is written. Each
+            dictionary has keys 'height', 'width' (pixels), 'y', 'x', 'height_in_degrees',
+            'width_in_degrees' (scan angle) and optionally 'depths' (the ROI is only
+            recorded at those depths; by default it is recorded at every depth).
+        slow_stack: Boolean. Whether all frames of one depth are recorded before moving
+            to the next depth.
+        bidirectional: Boolean. Whether scanning is bidirectional.
+        scanner_frequency: Float. Resonant scanner frequency (Hz).
+        num_fly_to_lines: Integer. Lines between two fields in a multiROI page.
+        num_fly_back_lines: Integer. Lines to fly back from the end of one depth to the
+            start of the next one.
+        dropped_frames: List of integers. Frame numbers (as in the page descriptions,
+            starting at 1; one per depth and timestep) that are not written, as if
+            ScanImage had dropped them. Pages keep the content they would have had.
+
+    Returns:
+        A list of strings. Names of the written files.
+    """
+    depths = list(depths)
+    seconds_per_line = (1 / scanner_frequency) / (2 if bidirectional else 1)
+
+    # Page geometry for multiROI scans: fields in a depth are stacked in y
+    if rois is not None:
+        page_heights = []
+        for depth in depths:
+            roi_heights = [roi['height'] for roi in rois if depth in roi.get('depths',
+                                                                             depths)]
+            page_heights.append(sum(roi_heights) + num_fly_to_lines * (len(roi_heights) - 1))
+        height = max(page_heights)
+        width = rois[0]['width']
+
+    # Create header and roi metadata
+    lines_per_volume = (height + num_fly_back_lines) * len(depths)
+    header = _create_header(version, num_channels, depths, frames, rois is not None,
+                            slow_stack, bidirectional, scanner_frequency,
+                            seconds_per_line, lines_per_volume, num_fly_to_lines,
+                            num_fly_back_lines)
+    roi_data = _create_roi_data(rois, depths) if rois is not None else ''
+    header_bytes = header.encode('ascii') + b'\0'
+    roi_bytes = roi_data.encode('ascii') + b'\0'
+
+    # Split pages in files (ScanImage splits at frame boundaries, all channels together)
+    slice_numbers = np.setdiff1d(np.arange(frames * len(depths)),
+                                 np.asarray(dropped_frames, dtype=np.int64) - 1)
+    slices_per_file = -(-len(slice_numbers) // files)
+    if files > 1:
+        base, ext = path.splitext(filename)
+        filenames = ['{}_{:05d}{}'.format(base, i + 1, ext) for i in range(files)]
+    else:
+        filenames = [filename]
+
+    # Write files
+    seconds_per_page = seconds_per_line * (height + num_fly_back_lines)
+    for i, filename in enumerate(filenames):
+        file_slices = slice_numbers[i * slices_per_file: (i + 1) * slices_per_file]
+        _write_file(filename, header_bytes, roi_bytes, height, width, file_slices,
+                    num_channels, seconds_per_page)
+
+    return filenames
+
+
+def _create_header(version, num_channels, depths, frames, is_multiROI, slow_stack,
+                   bidirectional, scanner_frequency, seconds_per_line, lines_per_volume,
+                   num_fly_to_lines, num_fly_back_lines):
+    """ Static ScanImage header ('SI.*' lines) as stored in the Software tag."""
+    def matlab(value):
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+        if isinstance(value, (list, tuple)):
+            return '[' + ' '.join(str(v) for v in value) + ']' if len(value) != 1 else str(value[0])
+        return str(value)
+
+    channels = list(range(1, num_channels + 1))
+    fields = [
+        ('LINE_FORMAT_VERSION', 1),
+        ('VERSION_MAJOR', "'{}'".format(version)),
+        ('VERSION_MINOR', 0),
+        ('hChannels.channelSave', '[' + ';'.join(str(c) for c in channels) + ']'
+                                  if num_channels > 1 else '1'),
+        ('hFastZ.enable', matlab(not slow_stack)),
+        ('hFastZ.numVolumes', frames),
+        ('hMotors.motorPosition', '[0 0 0]'),
+        ('hMotors.motorSecondMotorZEnable', 'false'),
+        ('hRoiManager.imagingFovUm', '[-250 -250;250 -250;250 250;-250 250]'),
+        ('hRoiManager.linePeriod', seconds_per_line),
+        ('hRoiManager.mroiEnable', int(is_multiROI)),
+        ('hRoiManager.scanAngleMultiplierFast', 1),
+        ('hRoiManager.scanAngleMultiplierSlow', 1),
+        ('hRoiManager.scanVolumeRate', round(1 / (seconds_per_line * lines_per_volume), 4)),
+        ('hRoiManager.scanZoomFactor', 1),
+        ('hScan2D.bidirectional', matlab(bidirectional)),
+        ('hScan2D.fillFractionSpatial', 0.9),
+        ('hScan2D.fillFractionTemporal', 0.712867),
+        ('hScan2D.flybackTimePerFrame', num_fly_back_lines * seconds_per_line * 0.999),
+        ('hScan2D.flytoTimePerScanfield', num_fly_to_lines * seconds_per_line * 0.999),
+        ('hScan2D.logAverageFactor', 1),
+        ('hScan2D.scannerFrequency', scanner_frequency),
+        ('hScan2D.scannerType', "'Resonant'"),
+        ('hStackManager.framesPerSlice', frames),
+        ('hStackManager.slowStackWithFastZ', 'false'),
+        ('hStackManager.zs', matlab(depths)),
+        ('objectiveResolution', 15),
+    ]
+    return '\n'.join('SI.{} = {}'.format(name, value) for name, value in fields)
+
+
+def _create_roi_data(rois, depths):
+    """ RoiGroups JSON as stored after the static header."""
+    roi_infos = []
+    for roi in rois:
+        scanfield = {'pixelResolutionXY': [roi['width'], roi['height']],
+                     'centerXY': [roi['x'], roi['y']],
+                     'sizeXY': [roi['width_in_degrees'], roi['height_in_degrees']]}
+        if 'depths' in roi:
+            roi_info = {'zs': list(roi['depths']), 'discretePlaneMode': 1,
+                        'scanfields': [scanfield] * len(roi['depths'])}
+        else:
+            roi_info = {'zs': depths[0], 'discretePlaneMode': 0, 'scanfields': scanfield}
+        roi_infos.append(roi_info)
+    return json.dumps({'RoiGroups': {'imagingRoiGroup': {'rois': roi_infos}}})
+
+
+def _description(frame_number, timestamp):
+    """ Per-page ScanImage description (padded with null bytes to a fixed size)."""
+    description = ('frameNumbers = {0}\nacquisitionNumbers = 1\nframeNumberAcquisition = {0}'
+                   '\nframeTimestamps_sec = {1:.6f}\nacqTriggerTimestamps_sec = \n'
+                   'nextFileMarkerTimestamps_sec = \nendOfAcquisition = 0\n'
+                   'endOfAcquisitionMode = 0\ndcOverVoltage = 0\n'
+                   'epoch = [2019 1 1 0 0 0]\nauxTrigger0 = []\nauxTrigger1 = []\n'
+                   'auxTrigger2 = []\nauxTrigger3 = []\nI2CData = {{}}\n').format(
+                       frame_number, timestamp)
+    return description.encode('ascii').ljust(_DESCRIPTION_SIZE, b'\0')
+
+
+def _write_file(filename, header_bytes, roi_bytes, height, width, slice_numbers,
+                num_channels, seconds_per_page):
+    """ Writes one BigTIFF file with equidistant pages (num_channels per slice number).
+
+    Args:
+        slice_numbers: Array. Frame numbers (0-based) of the slices saved in this file.
+    """
+    # Static metadata block: BigTIFF header, ScanImage v3 magic, header and roi data
+    header_offset = 32
+    first_ifd = header_offset + len(header_bytes) + len(roi_bytes)
+    first_ifd += (-first_ifd) % 8
+    file_header = (b'II' + struct.pack('<HHHQ', 43, 8, 0, first_ifd) +
+                   struct.pack('<IIII', 117637889, 3, len(header_bytes), len(roi_bytes)))
+
+    # IFD layout: tag count, tags, next IFD offset, description, image data
+    num_tags = 13
+    ifd_size = 8 + num_tags * 20 + 8
+    page_nbytes = height * width * 2
+    page_size = ifd_size + _DESCRIPTION_SIZE + page_nbytes
+
+    def tag(code, dtype, count, value):
+        fmt = {3: '<H6x', 4: '<I4x', 16: '<Q', 2: '<Q'}[dtype]
+        return struct.pack('<HHQ', code, dtype, count) + struct.pack(fmt, value)
+    tags = [tag(256, 4, 1, width), tag(257, 4, 1, height), tag(258, 3, 1, 16),
+            tag(259, 3, 1, 1), tag(262, 3, 1, 1), tag(270, 2, _DESCRIPTION_SIZE, 0),
+            tag(273, 16, 1, 0), tag(277, 3, 1, 1), tag(278, 4, 1, height),
+            tag(279, 16, 1, page_nbytes), tag(284, 3, 1, 1),
+            tag(305, 2, len(header_bytes), header_offset), tag(339, 3, 1, 2)]
+    ifd_template = np.frombuffer(struct.pack('<Q', num_tags) + b''.join(tags) + b'\0' * 8,
+                                 dtype=np.uint8)
+
+    # One record per page; offsets of the description (tag 270) and image data (tag 273)
+    # and of the next IFD change from page to page
+    page_dtype = np.dtype({'names': ['ifd', 'description_offset', 'data_offset',
+                                     'next_offset', 'description', 'data'],
+                           'formats': [(np.uint8, ifd_size), '<u8', '<u8', '<u8',
+                                       'S{}'.format(_DESCRIPTION_SIZE),
+                                       ('<i2', (height, width))],
+                           'offsets': [0, 8 + 5 * 20 + 12, 8 + 6 * 20 + 12, ifd_size - 8,
+                                       ifd_size, ifd_size + _DESCRIPTION_SIZE],
+                           'itemsize': page_size})
+
+    num_pages = len(slice_numbers) * num_channels
+    page_slices = np.repeat(slice_numbers, num_channels)
+    page_ids = page_slices * num_channels + np.tile(np.arange(num_channels),
+                                                    len(slice_numbers))
+    batch_size = max(1, _BATCH_BYTES // page_size)
+    with open(filename, 'wb') as f:
+        f.write(file_header + header_bytes + roi_bytes)
+        f.write(b'\0' * (first_ifd - f.tell()))
+
+        for start in range(0, num_pages, batch_size):
+            indices = np.arange(start, min(start + batch_size, num_pages))
+            offsets = first_ifd + indices * page_size
+            pages = np.zeros(len(indices), dtype=page_dtype)
+            pages['ifd'] = ifd_template
+            pages['description_offset'] = offsets + ifd_size
+            pages['data_offset'] = offsets + ifd_size + _DESCRIPTION_SIZE
+            pages['next_offset'] = np.where(indices < num_pages - 1, offsets + page_size, 0)
+            pages['description'] = [_description(slice_number + 1,
+                                                 slice_number * seconds_per_page) for
+                                    slice_number in page_slices[indices]]
+            _synthetic_pages(page_ids[indices], height, width, out=pages['data'])
+            pages.tofile(f)
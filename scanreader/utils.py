@@ -1,5 +1,6 @@
 """Utility functions to check that the key and indices send to __getitem__ are valid."""
 import numpy as np
+from .exceptions import FieldDimensionMismatch
 
 def fill_key(key, num_dimensions):
     """ Fill key with slice(None) (':') until num_dimensions size.
@@ -80,7 +81,8 @@ def _is_index_in_bounds(index, dim_size):
     if np.issubdtype(type(index), np.signedinteger):
         return (index in range(-dim_size, dim_size))
     elif isinstance(index, (list, tuple, np.ndarray)):
-        return all(x in range(-dim_size, dim_size) for x in index)
+        index = np.asarray(index)
+        return index.size == 0 or (index.min() >= -dim_size and index.max() < dim_size)
     elif isinstance(index, slice):
         return True  # slices never go out of bounds, they are just cropped
     else:
@@ -89,6 +91,17 @@ def _is_index_in_bounds(index, dim_size):
         raise TypeError(error_msg)
 
 
+def as_index(indices):
+    """ Slice equivalent to a list of evenly spaced increasing indices (a view instead of a
+    copy when indexing); the indices as an array otherwise."""
+    indices = np.asarray(indices, dtype=np.int64)
+    steps = np.diff(indices)
+    if len(indices) > 0 and (len(steps) == 0 or (steps[0] > 0 and np.all(steps == steps[0]))):
+        step = int(steps[0]) if len(steps) > 0 else 1
+        return slice(int(indices[0]), int(indices[-1]) + 1, step)
+    return indices
+
+
 def listify_index(index, dim_size):
     """ Generates the list representation of an index for the given dim_size.
 
@@ -114,4 +127,83 @@ def listify_index(index, dim_size):
                      'integers'.format(index))
         raise TypeError(error_msg)
 
-    return index_as_list
\ No newline at end of file
+    return index_as_list
+
+
+def listify_selection(axis, index, dim_size):
+    """ Checks and listifies an optional index; None selects the entire dimension.
+
+    Args:
+        axis: An integer. Axis of the index.
+        index: A single index (integer, slice or list/tuple/array of integers) or None.
+        dim_size: Size of the dimension corresponding to the index.
+
+    Returns:
+        A list of positive integers. List of indices.
+
+    Raises:
+        TypeError: If index is not integer, slice, or array/list/tuple of integers.
+        IndexError: If index is out of bounds for the specified axis.
+    """
+    index = slice(None) if index is None else index
+    check_index_type(axis, index)
+    check_index_is_in_bounds(axis, index, dim_size)
+    return listify_index(index, dim_size)
+
+
+def parse_key(key, num_fields, field_heights, field_widths, num_channels, num_frames):
+    """ Checks a key (as received by __getitem__) and computes the indices to read in each
+    dimension. Shared by scans and binary scans so both accept the same keys.
+
+    Args:
+        key: Tuple of indices or single index.
+        num_fields: Integer. Number of fields.
+        field_heights: List of integers. Height of each field.
+        field_widths: List of integers. Width of each field.
+        num_channels: Integer. Number of channels.
+        num_frames: Integer. Number of frames.
+
+    Returns:
+        full_key: Tuple of 5 indices. Key filled with slice(None) until size 5.
+        field_list: List of integers. Fields to read.
+        y_lists: List of lists. Rows to read in each field.
+        x_lists: List of lists. Columns to read in each field.
+        channel_list: List of integers. Channels to read.
+        frame_list: List of integers. Frames to read.
+
+    Raises:
+        IndexError, TypeError: If the key is invalid or out of bounds.
+        FieldDimensionMismatch: If the fields read would have different heights or widths.
+    """
+    # Fill key to size 5 (raises IndexError if more than 5)
+    full_key = fill_key(key, num_dimensions=5)
+
+    # Check index types are valid
+    for i, index in enumerate(full_key):
+        check_index_type(i, index)
+
+    # Check each dimension is in bounds
+    check_index_is_in_bounds(0, full_key[0], num_fields)
+    for field_id in listify_index(full_key[0], num_fields):
+        check_index_is_in_bounds(1, full_key[1], field_heights[field_id])
+        check_index_is_in_bounds(2, full_key[2], field_widths[field_id])
+    check_index_is_in_bounds(3, full_key[3], num_channels)
+    check_index_is_in_bounds(4, full_key[4], num_frames)
+
+    # Get fields, channels and frames as lists
+    field_list = listify_index(full_key[0], num_fields)
+    y_lists = [listify_index(full_key[1], field_heights[field_id]) for field_id in
+               field_list]
+    x_lists = [listify_index(full_key[2], field_widths[field_id]) for field_id in
+               field_list]
+    channel_list = listify_index(full_key[3], num_channels)
+    frame_list = listify_index(full_key[4], num_frames)
+
+    # Check output heights and widths match for all fields (if anything is read)
+    if [] not in [field_list, *y_lists, *x_lists, channel_list, frame_list]:
+        if not all(len(y_list) == len(y_lists[0]) for y_list in y_lists):
+            raise FieldDimensionMismatch('Image heights for all fields do not match')
+        if not all(len(x_list) == len(x_lists[0]) for x_list in x_lists):
+            raise FieldDimensionMismatch('Image widths for all fields do not match')
+
+    return full_key, field_list, y_lists, x_lists, channel_list, frame_list
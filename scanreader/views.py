@@ -0,0 +1,207 @@
+""" Lazy views of scans.
+
+scan[key] reads from disk right away, so chained indexing (scan[0][..., 100:200]) reads
+the whole field before discarding most of it. scan.view[key] returns a ScanView instead:
+it only records the index used in each of the five axes (field, y, x, channel, frame),
+composes successive indexing operations and reads once, with the combined key, when
+asked for the data (view.read() or np.asarray(view)).
+
+Example:
+    view = scan.view[0][..., 100:200] # nothing read yet
+    view.shape, view.nbytes
+    frames = view.read() # same as scan[0, :, :, :, 100:200]
+
+    for field in scan.view: # fields as views
+        frames = np.asarray(field[:, :, 0, :500])
+"""
+import numpy as np
+from . import utils
+from . import reductions
+from .exceptions import FieldDimensionMismatch
+
+_AXES = ['field', 'y', 'x', 'channel', 'frame']
+
+
+class ScanView():
+    """ Lazy view of a scan (or binary scan) with numpy-like indexing.
+
+    Attributes:
+        scan: Scan object being viewed.
+        dtype: Data type of the data (scan.dtype).
+
+    Indices (integers, slices, lists/arrays of integers and Ellipsis) are composed as
+    numpy would: integers drop the axis, slices and lists select from the current view.
+    Lists in more than one axis select the submatrix (as scans do), not pointwise.
+    """
+    def __init__(self, scan, chains=None):
+        self.scan = scan
+        self.dtype = np.dtype(scan.dtype)
+        self._chains = chains if chains is not None else [()] * 5 # indices used per axis
+
+    def _resolve(self, axis, size):
+        """ Selection in an axis (an integer, range or list of absolute indices)."""
+        selection = range(size)
+        for index in self._chains[axis]:
+            selection = _apply_index(selection, index)
+        return selection
+
+    def _spatial_sizes(self, axis):
+        """ Size of the y (axis=1) or x (axis=2) dimension of each field."""
+        sizes = getattr(self.scan, 'field_heights' if axis == 1 else 'field_widths', None)
+        if sizes is None:
+            size = self.scan.image_height if axis == 1 else self.scan.image_width
+            sizes = [size] * self.scan.num_fields
+        return sizes
+
+    def _selections(self):
+        """ Selections in each axis; y, x selections are lists (one per selected field)."""
+        fields = self._resolve(0, self.scan.num_fields)
+        field_list = [fields] if isinstance(fields, int) else list(fields)
+        yss = [self._resolve(1, self._spatial_sizes(1)[field]) for field in field_list]
+        xss = [self._resolve(2, self._spatial_sizes(2)[field]) for field in field_list]
+        channels = self._resolve(3, self.scan.num_channels)
+        frames = self._resolve(4, self.scan.num_frames)
+        return fields, yss, xss, channels, frames
+
+    @property
+    def _visible_axes(self):
+        """ Axes not indexed with an integer (the axes of the view)."""
+        return [axis for axis, chain in enumerate(self._chains) if not any(
+            np.issubdtype(type(index), np.signedinteger) for index in chain)]
+
+    @property
+    def shape(self):
+        fields, yss, xss, channels, frames = self._selections()
+        sizes = []
+        for axis, selection in zip(range(5), [fields, yss, xss, channels, frames]):
+            if axis not in self._visible_axes:
+                continue
+            if axis in [1, 2]: # may differ across fields
+                lengths = set(len(selection_) for selection_ in selection)
+                if len(lengths) > 1:
+                    raise FieldDimensionMismatch('{} dimensions of the selected fields do '
+                                                 'not match'.format(_AXES[axis]))
+                sizes.append(lengths.pop() if lengths else 0)
+            else:
+                sizes.append(len(selection))
+        return tuple(sizes)
+
+    @property
+    def ndim(self):
+        return len(self._visible_axes)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self):
+        return self.size * self.dtype.itemsize
+
+    def __len__(self):
+        if self.ndim == 0:
+            raise TypeError('len() of unsized view')
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        """ Returns a new view; nothing is read."""
+        key = key if isinstance(key, tuple) else (key, )
+        visible_axes = self._visible_axes
+
+        # Expand Ellipsis
+        num_ellipsis = sum(index is Ellipsis for index in key)
+        if num_ellipsis > 1:
+            raise IndexError('an index can only have a single ellipsis')
+        if num_ellipsis == 1:
+            position = next(i for i, index in enumerate(key) if index is Ellipsis)
+            missing = len(visible_axes) - (len(key) - 1)
+            key = key[:position] + (slice(None), ) * missing + key[position + 1:]
+        full_key = utils.fill_key(key, len(visible_axes))
+
+        # Compose with the current indices
+        chains = list(self._chains)
+        for axis, index in zip(visible_axes, full_key):
+            utils.check_index_type(axis, index)
+            if isinstance(index, slice) and index == slice(None):
+                continue
+            if isinstance(index, (tuple, np.ndarray)):
+                index = list(index)
+            chains[axis] = chains[axis] + (index, )
+        view = ScanView(self.scan, chains)
+        view._selections() # raises IndexError if out of bounds
+
+        return view
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def read(self):
+        """ Reads the data in the view (with a single scan[key] when possible).
+
+        Returns:
+            An array with the view's shape.
+        """
+        fields, yss, xss, channels, frames = self._selections()
+        shape = self.shape # raises FieldDimensionMismatch
+        if 0 in shape:
+            return np.empty(shape, dtype=self.dtype)
+
+        channel_key = _to_key(channels)
+        frame_key = _to_key(frames)
+        if all(ys == yss[0] for ys in yss) and all(xs == xss[0] for xs in xss):
+            key = (_to_key(fields), _to_key(yss[0]), _to_key(xss[0]), channel_key,
+                   frame_key)
+            return self.scan[key]
+
+        # Rows/columns differ across fields (fields of different sizes): read each field
+        items = [self.scan[field, _to_key(ys), _to_key(xs), channel_key, frame_key] for
+                 field, ys, xs in zip(fields, yss, xss)]
+        return np.stack(items)
+
+    def __array__(self, dtype=None, copy=None):
+        item = self.read()
+        return item if dtype is None else item.astype(dtype, copy=False)
+
+    def __array_function__(self, func, types, args, kwargs):
+        """ Reductions (np.mean, np.max, ...) stream over frames; see reductions.py."""
+        return reductions.array_function(self, self, func, args, kwargs)
+
+    def __repr__(self):
+        key = []
+        for axis, chain in enumerate(self._chains):
+            key.append(':' if not chain else ']['.join(str(index) for index in chain))
+        return '<ScanView [{}] of {}>'.format(', '.join(key), type(self.scan).__name__)
+
+
+def _apply_index(selection, index):
+    """ Indexes a selection (range or list of absolute indices) as numpy would.
+
+    Raises:
+        IndexError: If the index is out of bounds or the axis was already dropped.
+    """
+    if isinstance(selection, int):
+        raise IndexError('too many indices for view')
+    if isinstance(index, slice):
+        return selection[index]
+    try:
+        if isinstance(index, list):
+            return [selection[i] for i in index]
+        return selection[index] # integer
+    except IndexError:
+        raise IndexError('index {} is out of bounds for axis with size '
+                         '{}'.format(index, len(selection)))
+
+
+def _to_key(selection):
+    """ Converts a selection (int, range or list) into an index accepted by scan[key].
+
+    Ranges are passed as slices so scans can slice pages (cheaper than fancy indexing).
+    """
+    if isinstance(selection, range):
+        if selection.step > 0 or selection.stop >= 0:
+            return slice(selection.start, selection.stop, selection.step)
+        return slice(selection.start, None, selection.step) # stop before index 0
+    if isinstance(selection, list):
+        return selection
+    return int(selection)
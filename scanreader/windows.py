@@ -0,0 +1,132 @@
+""" Extraction of frame windows (e.g., around trial events).
+
+Reading N windows of L frames with one scan[...] call per window re-reads frames shared by
+overlapping windows and allocates one array per window. read_windows merges overlapping
+windows into runs of consecutive frames, splits the runs at file boundaries (and in
+chunks of ~256 MB), reads the pieces in parallel (scans are thread-safe, see pageio.py)
+and copies each piece into every window it overlaps in a single output array.
+
+Example:
+    event_frames = np.searchsorted(scan.frame_times(0), event_times)
+    windows = scan.read_windows(0, 0, event_frames - 10, 50) # windows x y x 50
+    trial_average = windows.mean(axis=0)
+"""
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from . import utils
+
+_CHUNK_BYTES = 2 ** 28 # aim for ~256 MB of data per read
+_MAX_WORKERS = 8
+
+
+def read_windows(scan, field, channel, starts, length, out=None, num_workers=None):
+    """ Reads windows of consecutive frames of a field and channel.
+
+    Args:
+        scan: A Scan object (subclass of BaseScan).
+        field: Integer. Field to read.
+        channel: Integer. Channel to read.
+        starts: List/array of integers. First frame of each window (in any order; windows
+            may overlap).
+        length: Integer. Number of frames per window.
+        out: Array or None. num_windows x height x width x length array (of scan.dtype)
+            to write the windows into.
+        num_workers: Integer. Number of threads reading in parallel. Defaults to one per
+            file (at most 8).
+
+    Returns:
+        A num_windows x height x width x length array.
+
+    Raises:
+        IndexError: If a window starts before the first frame or ends after the last one.
+        ValueError: If out does not have the expected shape or dtype.
+    """
+    utils.check_index_type(0, field)
+    utils.check_index_type(3, channel)
+    utils.check_index_is_in_bounds(0, field, scan.num_fields)
+    utils.check_index_is_in_bounds(3, channel, scan.num_channels)
+    field = utils.listify_index(field, scan.num_fields)[0]
+    if length < 1:
+        raise ValueError('length should be a positive integer')
+    starts = np.asarray(starts, dtype=np.int64).ravel()
+    if np.any(starts < 0) or np.any(starts + length > scan.num_frames):
+        raise IndexError('windows should be within frames 0 to {} (windows of {} frames '
+                         'starting at {} to {})'.format(scan.num_frames - 1, length,
+                                                       starts.min(), starts.max()))
+
+    # Check output array
+    height, width = scan.fields[field].height, scan.fields[field].width
+    shape = (len(starts), height, width, length)
+    if out is None:
+        out = np.empty(shape, dtype=scan.dtype)
+    elif out.shape != shape or out.dtype != np.dtype(scan.dtype):
+        raise ValueError('out should be a {} array of shape {}'.format(
+            np.dtype(scan.dtype).name, shape))
+    if len(starts) == 0:
+        return out
+
+    # Split the frames to read into pieces
+    frame_bytes = height * width * np.dtype(scan.dtype).itemsize
+    max_frames = max(1, _CHUNK_BYTES // frame_bytes)
+    boundaries = _file_boundaries(scan)
+    pieces = []
+    for run_start, run_stop in merge_windows(starts, length):
+        splits = [run_start, *(b for b in boundaries if run_start < b < run_stop), run_stop]
+        for start, stop in zip(splits[:-1], splits[1:]):
+            pieces.extend((piece_start, min(piece_start + max_frames, stop)) for
+                          piece_start in range(start, stop, max_frames))
+
+    # Read pieces and copy them to the windows they overlap
+    order = np.argsort(starts, kind='stable')
+    sorted_starts = starts[order]
+
+    def read_piece(piece):
+        start, stop = piece
+        frames = scan[field, :, :, channel, start: stop]
+        first, last = np.searchsorted(sorted_starts, [start - length + 1, stop])
+        for window_id, window_start in zip(order[first: last], sorted_starts[first: last]):
+            copy_start, copy_stop = max(start, window_start), min(stop, window_start + length)
+            out[window_id, ..., copy_start - window_start: copy_stop - window_start] = \
+                frames[..., copy_start - start: copy_stop - start]
+
+    if num_workers is None:
+        num_workers = min(len(scan.filenames), os.cpu_count() or 1, _MAX_WORKERS)
+    num_workers = max(1, min(num_workers, len(pieces)))
+    if num_workers == 1:
+        for piece in pieces:
+            read_piece(piece)
+    else:
+        with ThreadPoolExecutor(num_workers) as executor:
+            list(executor.map(read_piece, pieces)) # raises errors from the threads
+
+    return out
+
+
+def merge_windows(starts, length):
+    """ Merges windows of frames that overlap or touch.
+
+    Args:
+        starts: Array of integers. First frame of each window.
+        length: Integer. Number of frames per window.
+
+    Returns:
+        A list of (start, stop) tuples (stop excluded) covering all windows, sorted.
+    """
+    runs = []
+    for start in np.unique(starts):
+        if runs and start <= runs[-1][1]:
+            runs[-1][1] = max(runs[-1][1], start + length)
+        else:
+            runs.append([start, start + length])
+    return [(int(start), int(stop)) for start, stop in runs]
+
+
+def _file_boundaries(scan):
+    """ Frames at which each file (after the first) starts; empty for slow stacks (whose
+    pages are not stored frame by frame)."""
+    if scan.is_slow_stack:
+        return []
+    pages_per_frame = scan.num_channels * scan.num_scanning_depths
+    file_starts = np.cumsum([layout.num_pages for layout in scan.file_layouts])[:-1]
+    return sorted(set(int(start) for start in file_starts // pages_per_frame))
@@ -15,6 +15,7 @@ setup(
     keywords='ScanImage scanreader multiROI 2016b tiff',
     packages=['scanreader'],
     install_requires=['numpy>=1.12.0', 'tifffile>=2019.2.22'],
+    entry_points={'console_scripts': ['scanreader=scanreader.__main__:main']},
     classifiers=[
         'Development Status :: 3 - Alpha',
         'Intended Audience :: Science/Research',
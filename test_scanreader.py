@@ -6,7 +6,7 @@ from unittest import TestCase
 from os import path
 import numpy as np
 import scanreader
-from scanreader.exceptions import ScanReaderException
+from scanreader.exceptions import ScanReaderException, FieldDimensionMismatch
 
 # Get data directory
 data_dir = path.join(path.dirname(path.abspath(__file__)), 'data')
@@ -706,4 +706,1076 @@ class StackTest(TestCase):
         first_channel = scan[:, :, :, 0, :]
         self.assertEqualShapeAndSum(first_channel, (204, 360, 120, 10), 26825949131)
         first_frame = scan[:, :, :, :, 0]
-        self.assertEqualShapeAndSum(first_frame, (204, 360, 120, 2), 2952050950)
\ No newline at end of file
+        self.assertEqualShapeAndSum(first_frame, (204, 360, 120, 2), 2952050950)
+
+class BinaryTest(TestCase):
+    """ Test exporting scans to flat binary files and reading them back. """
+
+    def test_export_and_open(self):
+        from tempfile import TemporaryDirectory
+
+        scan = scanreader.read_scan(scan_file_5_1)
+        with TemporaryDirectory() as dirname:
+            scan.export_binary(dirname, chunk_size=7)
+            binary_scan = scanreader.open_binary(dirname)
+
+            # Test attributes
+            self.assertEqual(binary_scan.shape, scan.shape)
+            self.assertEqual(binary_scan.version, scan.version)
+            self.assertEqual(binary_scan.field_depths, scan.field_depths)
+
+            # Test indexation matches the original scan
+            self.assertTrue(np.array_equal(np.array(binary_scan), np.array(scan)))
+            for key in [0, (slice(None), 0), (-1, slice(10, 20), [3, 1], 1, [-1, 0, 0]),
+                        (slice(None, None, -2), slice(None), slice(None), 0, slice(5, 15))]:
+                self.assertTrue(np.array_equal(binary_scan[key], scan[key]))
+
+            # Files are frames x height x width
+            data = np.fromfile(path.join(dirname, 'field1_channel0.bin'), dtype=np.int16)
+            data = data.reshape(scan.num_frames, scan.image_height, scan.image_width)
+            self.assertTrue(np.array_equal(data, scan[1, :, :, 0].transpose([2, 0, 1])))
+
+    def test_export_multiroi_subset(self):
+        from tempfile import TemporaryDirectory
+
+        scan = scanreader.read_scan(scan_file_2016b_multiroi_hard)
+        with TemporaryDirectory() as dirname:
+            scan.export_binary(dirname, fields=[3, 0], channels=1)
+            binary_scan = scanreader.open_binary(dirname)
+
+            self.assertEqual(binary_scan.num_fields, 2)
+            self.assertEqual(binary_scan.num_channels, 1)
+            self.assertTrue(np.array_equal(binary_scan[0], scan[3, :, :, [1]]))
+            self.assertTrue(np.array_equal(binary_scan[1], scan[0, :, :, [1]]))
+            self.assertRaises(ScanReaderException, lambda: binary_scan[:])
+
+    def test_same_keys(self):
+        """ Binary scans check keys as scans do (see utils.parse_key)."""
+        from tempfile import TemporaryDirectory
+
+        scan = scanreader.read_scan(scan_file_2016b_multiroi_hard)
+        with TemporaryDirectory() as dirname:
+            scan.export_binary(dirname)
+            binary_scan = scanreader.open_binary(dirname)
+            for key in [(0, -1), (slice(None), 0, 0, 0, -1), ([3, 0], slice(2, 5), [1, 0]),
+                        (0, 0, 0, 0, slice(9, 2))]:
+                self.assertTrue(np.array_equal(binary_scan[key], scan[key]))
+            for key in [(0, 0, 0, 0, 0, 0), (0.5, ), (0, 0, 0, 2), slice(None)]:
+                with self.assertRaises(Exception) as scan_error:
+                    scan[key]
+                with self.assertRaises(Exception) as binary_error:
+                    binary_scan[key]
+                self.assertEqual(type(scan_error.exception), type(binary_error.exception))
+
+
+class DemuxTest(TestCase):
+    """ Test reading all fields in a single pass over the scan. """
+
+    def test_extract_fields(self):
+        from scanreader import demux
+
+        for filename in [scan_file_5_1_multifiles, scan_file_2016b_multiroi_hard,
+                         stack_file_5_1]:
+            scan = scanreader.read_scan(filename)
+            fields = demux.extract_fields(scan, chunk_size=3)
+            self.assertEqual(len(fields), scan.num_fields)
+            for i, field in enumerate(fields):
+                self.assertTrue(np.array_equal(field, scan[i]))
+
+        # Selected fields and channels (in requested order)
+        fields = demux.extract_fields(scan, fields=[2, 0], channels=[1, 0, 1])
+        self.assertTrue(np.array_equal(fields[0], scan[2, :, :, [1, 0, 1]]))
+        self.assertTrue(np.array_equal(fields[1], scan[0, :, :, [1, 0, 1]]))
+
+    def test_sinks(self):
+        from scanreader import demux
+
+        scan = scanreader.read_scan(scan_file_2016b_multiroi_hard)
+        received = []
+        array_sink = demux.ArraySink(scan.field_heights[1], scan.field_widths[1],
+                                     scan.num_frames)
+        sinks = {(1, 0): array_sink, (1, 1): lambda start, data: received.append((start, data))}
+        demux.demultiplex(scan, sinks, chunk_size=4)
+
+        self.assertTrue(np.array_equal(array_sink.array, scan[1, :, :, 0]))
+        self.assertEqual([start for start, _ in received], [0, 4, 8])
+        self.assertTrue(np.array_equal(np.concatenate([data for _, data in received]),
+                                       scan[1, :, :, 1].transpose([2, 0, 1])))
+
+
+class BinnedTest(TestCase):
+    """ Test reading scans binned in time. """
+
+    def test_read_binned(self):
+        scan = scanreader.read_scan(scan_file_5_1)
+        data = scan[:, :, :, :, :12].astype(np.float32)
+        binned = data.reshape(data.shape[:-1] + (4, 3))
+
+        # Test reducers (bins are never split between chunks)
+        mean = scan.read_binned((slice(None), slice(None), slice(None), slice(None),
+                                 slice(0, 12)), bin_size=3, chunk_size=4)
+        self.assertEqual(mean.dtype, np.float32)
+        self.assertTrue(np.allclose(mean, binned.mean(axis=-1)))
+        total = scan.read_binned((slice(None),) * 4 + (slice(0, 12),), 3, reducer='sum')
+        self.assertTrue(np.allclose(total, binned.sum(axis=-1)))
+        maximum = scan.read_binned((slice(None),) * 4 + (slice(0, 12),), 3, reducer='max')
+        self.assertEqual(maximum.dtype, scan.dtype)
+        self.assertTrue(np.array_equal(maximum, binned.max(axis=-1)))
+
+        # Last bin can be incomplete, integer indices are squeezed
+        mean = scan.read_binned((1, slice(5, 9), slice(None), 0), bin_size=7)
+        self.assertEqual(mean.shape, (4, scan.image_width, int(np.ceil(scan.num_frames / 7))))
+        last_bin = scan[1, 5:9, :, 0, (scan.num_frames - 1) // 7 * 7:]
+        self.assertTrue(np.allclose(mean[..., -1], last_bin.mean(axis=-1)))
+
+        # MultiROI
+        scan = scanreader.read_scan(scan_file_2016b_multiroi_hard)
+        mean = scan.read_binned(0, bin_size=5, chunk_size=1)
+        self.assertTrue(np.allclose(mean, scan[0].reshape(scan[0].shape[:-1] + (2, 5)).mean(-1)))
+        self.assertRaises(ValueError, lambda: scan.read_binned(0, 2, reducer='median'))
+
+
+class SummaryTest(TestCase):
+    """ Test streaming summary images. """
+
+    def assertSummaryImagesEqual(self, images, field):
+        field = field.astype(np.float64)
+        self.assertTrue(np.allclose(images['mean'], field.mean(axis=-1)))
+        self.assertTrue(np.allclose(images['max'], field.max(axis=-1)))
+        self.assertTrue(np.allclose(images['std'], field.std(axis=-1)))
+
+        # Correlation of each pixel with its 8 neighbours (computed in memory)
+        normalized = (field - field.mean(-1, keepdims=True)) / field.std(-1, keepdims=True)
+        height, width = field.shape[:2]
+        padded = np.pad(normalized, [(1, 1), (1, 1), (0, 0), (0, 0)], mode='constant',
+                        constant_values=np.nan)
+        correlations = [(normalized * padded[1 + dy: 1 + dy + height, 1 + dx: 1 + dx + width]).mean(-1)
+                        for dy in [-1, 0, 1] for dx in [-1, 0, 1] if (dy, dx) != (0, 0)]
+        expected = np.nanmean(correlations, axis=0)
+        self.assertTrue(np.allclose(images['correlation'], expected))
+
+    def test_summary_images(self):
+        scan = scanreader.read_scan(scan_file_5_1_multifiles)
+        summaries = scan.summary_images(fields=[2, 0], channels=1, chunk_size=4)
+        self.assertEqual(len(summaries), 2)
+        self.assertEqual(summaries[0]['mean'].shape, (scan.image_height, scan.image_width, 1))
+        self.assertSummaryImagesEqual(summaries[0], scan[2, :, :, [1]])
+        self.assertSummaryImagesEqual(summaries[1], scan[0, :, :, [1]])
+
+        # Parallel over files gives the same result
+        parallel_summaries = scan.summary_images(fields=[2, 0], channels=1, num_workers=2)
+        for images, parallel_images in zip(summaries, parallel_summaries):
+            for name in ['mean', 'max', 'std', 'correlation']:
+                self.assertTrue(np.allclose(images[name], parallel_images[name]))
+
+    def test_split_frames(self):
+        from scanreader import summary
+        scan = scanreader.read_scan(scan_file_5_1_multifiles)
+        self.assertEqual(summary._split_frames(scan, 2), [(0, 15), (15, 30)])
+
+        # Split at the remapped frame where the second file starts (a volume was dropped)
+        frame_numbers = scan.page_descriptions.frame_number
+        frame_numbers[frame_numbers >= 8] += 3
+        scan.check_integrity(remap=True)
+        self.assertEqual(summary._split_frames(scan, 2), [(0, 16), (16, scan.num_frames)])
+        summaries = scan.summary_images(fields=[0], num_workers=1)
+        parallel_summaries = scan.summary_images(fields=[0], num_workers=2)
+        for name in ['mean', 'max', 'std', 'correlation']:
+            self.assertTrue(np.allclose(summaries[0][name], parallel_summaries[0][name]))
+
+    def test_summary_images_multiroi(self):
+        scan = scanreader.read_scan(scan_file_2016b_multiroi_hard)
+        summaries = scan.summary_images(num_workers=3)
+        for i, images in enumerate(summaries):
+            self.assertSummaryImagesEqual(images, scan[i])
+
+
+class RasterTest(TestCase):
+    """ Test raster phase correction of bidirectional scans. """
+
+    def test_compute_raster_phase(self):
+        from scanreader import raster
+        max_angle = (np.pi / 2) * 0.712867
+        line_angles = np.linspace(-max_angle, max_angle, 258)[1:-1]
+
+        # Odd rows recorded with a phase shift
+        profile = lambda positions: np.cos(8 * positions) + np.exp(-(positions - 0.3) ** 2 / 0.01)
+        image = np.tile(profile(np.sin(line_angles)), (64, 1))
+        image[1::2] = profile(np.sin(line_angles + 0.02))
+
+        raster_phase = raster.compute_raster_phase(image, line_angles)
+        self.assertAlmostEqual(raster_phase, 0.02, places=3)
+        corrected = raster.correct_raster(image, range(64), line_angles, raster_phase)
+        self.assertTrue(np.allclose(corrected[1::2, 10:-10], image[0::2, 10:-10], atol=0.01))
+
+    def test_correction_during_read(self):
+        from scanreader import raster
+        scan = scanreader.read_scan(scan_file_2016b_multiroi_hard)
+        corrected_scan = scanreader.read_scan(scan_file_2016b_multiroi_hard,
+                                              raster_correction=0.01)
+        self.assertEqual(corrected_scan.raster_phase, 0.01)
+
+        # Odd rows (of the page) are corrected, even rows are untouched
+        pages = np.moveaxis(scan._read_pages([0], [0], [0, 1]), [3, 4], [0, 1])
+        expected = raster.correct_raster(pages, range(scan._page_height), scan._line_angles,
+                                         0.01)
+        corrected_pages = corrected_scan._read_pages([0], [0], [0, 1], slice(3, 20))
+        self.assertTrue(np.array_equal(np.moveaxis(corrected_pages, [3, 4], [0, 1]),
+                                       expected[..., 3:20, :]))
+        self.assertTrue(np.array_equal(corrected_scan[0, ::2], scan[0, ::2]))
+        self.assertFalse(np.array_equal(corrected_scan[0, 1::2], scan[0, 1::2]))
+
+        self.assertRaises(ValueError, lambda: scanreader.read_scan(scan_file_5_1,
+                                                                   raster_correction='on'))
+
+        # Mirror angles past pi / 2 (positions would not be sorted)
+        self.assertRaises(ValueError, lambda: raster.correct_raster(pages, range(
+            scan._page_height), scan._line_angles, np.pi / 2))
+        line_angles = np.linspace(-np.pi / 2, np.pi / 2, scan._page_width + 2)[1:-1]
+        self.assertLess(abs(raster.compute_raster_phase(pages[0, 0, 0], line_angles)),
+                        np.pi / 2 - line_angles[-1])
+
+    def test_estimate_during_reads(self):
+        from concurrent.futures import ThreadPoolExecutor
+        scan = scanreader.read_scan(scan_file_2016b_multiroi_hard, raster_correction=0.01)
+        expected = scan[0, 1::2]
+
+        # Estimating reads uncorrected pages without changing the phase used by other reads
+        with ThreadPoolExecutor(2) as executor:
+            futures = [executor.submit(function) for _ in range(8) for function in
+                       [scan.estimate_raster_phase, lambda: scan[0, 1::2]]]
+        estimates, reads = futures[::2], futures[1::2]
+        self.assertEqual(len(set(estimate.result() for estimate in estimates)), 1)
+        self.assertTrue(all(np.array_equal(read.result(), expected) for read in reads))
+        self.assertEqual(scan.raster_phase, 0.01)
+
+
+class MotionTest(TestCase):
+    """ Test rigid motion correction. """
+
+    def test_compute_shifts(self):
+        from scanreader import motion
+        image = np.zeros([64, 80], dtype=np.float32)
+        image[20:30, 30:45] = 1
+        image[40:44, 10:60] = 2
+        shifts = np.array([[0, 0], [3, -5], [-7, 2], [10, 10]])
+        frames = np.stack([np.roll(image, -shift, axis=(0, 1)) for shift in shifts])
+
+        estimated_shifts = motion.compute_shifts(frames, image)
+        self.assertTrue(np.allclose(estimated_shifts, shifts, atol=0.1))
+        self.assertTrue(np.allclose(motion.apply_shifts(frames, estimated_shifts), image,
+                                    atol=0.05))
+        estimated_shifts = motion.compute_shifts(frames, image, max_shift=8)
+        self.assertTrue(np.all(np.abs(estimated_shifts) <= 8.5))
+
+    def test_correct_motion(self):
+        from scanreader import motion, demux
+        scan = scanreader.read_scan(scan_file_2016b_multiroi_hard)
+        field = np.moveaxis(scan[1, :, :, 0], -1, 0)
+        template = motion.create_template(scan, 1, num_frames=5)
+        self.assertEqual(template.shape, field.shape[1:])
+
+        sink = demux.ArraySink(*field.shape[1:], scan.num_frames)
+        shifts = motion.correct_motion(scan, 1, template=template, sink=sink, chunk_size=3)
+        self.assertTrue(np.allclose(shifts, motion.compute_shifts(field, template),
+                                    atol=1e-4))
+        corrected = np.rint(motion.apply_shifts(field, shifts)).astype(scan.dtype)
+        self.assertTrue(np.allclose(np.moveaxis(sink.array, -1, 0), corrected, atol=1))
+
+        # Callables are sinks too
+        chunks = {}
+        motion.correct_motion(scan, 1, template=template, chunk_size=3,
+                              sink=lambda first_frame, data: chunks.update({first_frame: data}))
+        self.assertTrue(np.array_equal(np.concatenate([chunks[frame] for frame in
+                                                       sorted(chunks)]),
+                                       np.moveaxis(sink.array, -1, 0)))
+
+
+class OffsetsTest(TestCase):
+    """ Test compact (cached) time offsets. """
+
+    def test_offsets(self):
+        scan = scanreader.read_scan(scan_file_2016b_multiroi_hard)
+        field = scan.fields[0]
+        self.assertIs(field.offset_mask, field.offset_mask) # cached
+        self.assertEqual(field.offset_mask.dtype, np.float32)
+        self.assertFalse(field.offset_mask.flags.writeable)
+
+        # Same as computing each pixel explicitly
+        offsets = field.offsets[0]
+        start_line = offsets.line_starts[0] / scan.seconds_per_line
+        line_offsets = (np.sin(scan._line_angles) + 1) / 2
+        expected = np.arange(field.height)[:, None] + line_offsets + start_line
+        expected[1::2] = np.arange(1, field.height, 2)[:, None] + (1 - line_offsets) + start_line
+        expected *= scan.seconds_per_line
+        self.assertTrue(np.allclose(np.asarray(offsets), expected, rtol=1e-6))
+        self.assertTrue(np.allclose(scan.field_offsets[0], expected, rtol=1e-6))
+
+
+class FrameTimesTest(TestCase):
+    """ Test frame times computed from the header and page timestamps. """
+
+    def test_frame_times(self):
+        from scanreader.exceptions import TimestampMismatch
+        scan = scanreader.read_scan(scan_file_5_1_multifiles)
+        for i in range(scan.num_fields):
+            frame_times = scan.frame_times(i, validate=True)
+            self.assertEqual(frame_times.shape, (scan.num_frames,))
+            self.assertTrue(np.allclose(np.diff(frame_times), 1 / scan.fps))
+            self.assertEqual(frame_times[0], scan.fields[i].offsets[0].line_starts[0])
+
+        # Page timestamps are read once
+        timestamps = scan.page_descriptions.timestamp
+        self.assertIs(scan.page_descriptions, scan.page_descriptions)
+        self.assertEqual(len(timestamps), scan._num_pages)
+        timestamps[scan.num_channels * scan.num_fields * 5:] += 1 # lost time after frame 5
+        self.assertRaises(TimestampMismatch, lambda: scan.frame_times(0, validate=True))
+
+        scan = scanreader.read_scan(stack_file_5_1)
+        frame_times = scan.frame_times(1, validate=True)
+        self.assertTrue(np.all(frame_times > scan.frame_times(0)[-1]))
+
+
+class DescriptionsTest(TestCase):
+    """ Test bulk parsing of page descriptions. """
+
+    def test_read_descriptions(self):
+        from scanreader import descriptions
+        from scanreader.tifffile import TiffFile
+        scan = scanreader.read_scan(scan_file_5_1_multifiles)
+        records = descriptions.read_descriptions(scan.filenames, batch_size=7)
+        self.assertEqual(len(records), scan._num_pages)
+
+        # Same as reading each page through tifffile
+        page_descriptions = []
+        for filename in scan.filenames:
+            with TiffFile(filename) as tiff_file:
+                page_descriptions.extend(tiff_file.pages[i].description for i in
+                                         range(len(tiff_file.pages)))
+        for record, description in zip(records, page_descriptions):
+            info = dict(line.split(' = ') for line in description.splitlines())
+            self.assertEqual(record.frame_number, int(info['frameNumbers']))
+            self.assertEqual(record.timestamp, float(info['frameTimestamps_sec']))
+            self.assertTrue(np.isnan(record.acq_trigger_timestamp))
+            self.assertEqual(len(record.aux_trigger0), 0)
+
+        # All channels of a slice share its frame number
+        frame_numbers = records.frame_number.reshape(-1, scan.num_channels)
+        self.assertTrue(np.all(np.diff(frame_numbers[:, 0]) == 1))
+        self.assertTrue(np.all(frame_numbers == frame_numbers[:, :1]))
+
+
+class IntegrityTest(TestCase):
+    """ Test detection of dropped frames and frame remapping. """
+
+    def test_check_integrity(self):
+        scan = scanreader.read_scan(scan_file_5_1_multifiles)
+        report = scan.check_integrity()
+        self.assertTrue(report.is_ok)
+        self.assertEqual(report.num_frames, scan.num_frames)
+        self.assertEqual(report.num_missing_pages, 0)
+        expected_map = np.arange(scan._num_pages).reshape(scan.num_frames, scan.num_fields,
+                                                          scan.num_channels)
+        self.assertTrue(np.array_equal(report.page_map, expected_map))
+
+    def test_remap_dropped_frames(self):
+        scan = scanreader.read_scan(scan_file_5_1_multifiles, dtype=np.float32)
+        data = scan[:]
+
+        # Pretend ScanImage dropped frame number 8 (slice 1 of the third volume)
+        frame_numbers = scan.page_descriptions.frame_number
+        frame_numbers[frame_numbers >= 8] += 1
+        report = scan.check_integrity(remap=True)
+        self.assertFalse(report.is_ok)
+        self.assertEqual(list(report.missing_frame_numbers), [8])
+        self.assertEqual(report.num_missing_pages, scan.num_channels)
+        self.assertIn('1 missing frame numbers: 8', str(report))
+
+        # Pages after the gap move one slice forward, the gap is filled with nan
+        self.assertEqual(scan.num_frames, report.num_frames)
+        remapped = scan[:]
+        self.assertTrue(np.array_equal(remapped[:, :, :, :, :2], data[:, :, :, :, :2]))
+        self.assertTrue(np.all(np.isnan(remapped[1, :, :, :, 2])))
+        self.assertTrue(np.array_equal(remapped[0, :, :, :, 2], data[0, :, :, :, 2]))
+        self.assertTrue(np.array_equal(remapped[2, :, :, :, 2], data[1, :, :, :, 2]))
+        self.assertTrue(np.array_equal(remapped[0, :, :, :, 3], data[2, :, :, :, 2]))
+
+        # Checking again without remap keeps the remap
+        self.assertFalse(scan.check_integrity().is_ok)
+        self.assertEqual(scan.num_frames, report.num_frames)
+        self.assertTrue(np.array_equal(scan[:], remapped, equal_nan=True))
+
+
+class SyntheticScanTest(TestCase):
+    """ Test scans written by scanreader.testing (no data files needed). """
+
+    def setUp(self):
+        from tempfile import TemporaryDirectory
+        self.tmpdir = TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def write(self, **kwargs):
+        from scanreader import testing
+        return testing.write_synthetic_scan(path.join(self.tmpdir.name, 'scan.tif'),
+                                            **kwargs)
+
+    def test_scan(self):
+        from scanreader import testing
+        filenames = self.write(version='2016b', num_channels=2, depths=[0, 10, 20],
+                               frames=7, files=3, height=24, width=16)
+        self.assertEqual(len(filenames), 3)
+        scan = scanreader.read_scan(filenames)
+        self.assertEqual(scan.version, '2016b')
+        self.assertEqual(scan.num_channels, 2)
+        self.assertEqual(scan.num_fields, 3)
+        self.assertEqual(scan.num_frames, 7)
+        self.assertEqual(scan.field_depths, [0, 10, 20])
+        self.assertEqual(scan.shape, (3, 24, 16, 2, 7))
+
+        # Page i holds synthetic_page(i); pages go channel, slice, frame
+        data = scan[:]
+        for frame, field, channel in [(0, 0, 0), (3, 1, 1), (6, 2, 1)]:
+            page_id = (frame * 3 + field) * 2 + channel
+            expected = testing.synthetic_page(page_id, 24, 16)
+            self.assertTrue(np.array_equal(data[field, :, :, channel, frame], expected))
+
+    def test_multiroi(self):
+        rois = [dict(height=20, width=16, y=-4, x=0, height_in_degrees=4,
+                     width_in_degrees=4),
+                dict(height=10, width=16, y=4, x=0, height_in_degrees=2,
+                     width_in_degrees=4, depths=[0])]
+        scan = scanreader.read_scan(self.write(version='2018b', depths=[0, 10], frames=3,
+                                               rois=rois))
+        self.assertTrue(scan.is_multiROI)
+        self.assertEqual(scan.num_rois, 2)
+        self.assertEqual(scan.num_fields, 3)
+        self.assertEqual(scan.field_heights, [20, 10, 20])
+        self.assertEqual(scan.num_frames, 3)
+
+    def test_slow_stack(self):
+        from scanreader import testing
+        scan = scanreader.read_scan(self.write(num_channels=2, depths=[0, 5, 10],
+                                               frames=4, slow_stack=True))
+        self.assertTrue(scan.is_slow_stack)
+        self.assertEqual(scan.shape, (3, 64, 64, 2, 4))
+        expected = testing.synthetic_page((1 * 4 + 2) * 2 + 1, 64, 64) # slice 1, frame 2
+        self.assertTrue(np.array_equal(scan[1, :, :, 1, 2], expected))
+
+    def test_dropped_frames(self):
+        from scanreader import testing
+        filenames = self.write(num_channels=2, depths=[0, 10], frames=5, files=2,
+                               height=8, width=8, dropped_frames=[4])
+        scan = scanreader.read_scan(filenames)
+        report = scan.check_integrity(remap=True)
+        self.assertEqual(list(report.missing_frame_numbers), [4])
+        self.assertEqual(scan.num_frames, 5)
+
+        # Remapped pages are the ones originally written for each slice
+        data = scan[:]
+        self.assertTrue(np.all(data[1, :, :, :, 1] == 0))
+        expected = testing.synthetic_page((2 * 2 + 1) * 2 + 1, 8, 8) # frame 2, slice 1
+        self.assertTrue(np.array_equal(data[1, :, :, 1, 2], expected))
+
+
+    def test_remap_multiroi(self):
+        rois = [dict(height=20, width=16, y=-4, x=0, height_in_degrees=4,
+                     width_in_degrees=4),
+                dict(height=10, width=16, y=4, x=0, height_in_degrees=2,
+                     width_in_degrees=4)]
+        filenames = self.write(version='2018b', depths=[0, 10, 20], frames=4, rois=rois,
+                               slow_stack=True, dropped_frames=[5, 6, 7, 8])
+        scan = scanreader.read_scan(filenames)
+        self.assertEqual(scan.num_fields, 4) # second depth seems to be the last one
+
+        # Fields (and their time offsets) follow the remapped depths
+        scan.check_integrity(remap=True)
+        self.assertEqual(scan.field_depths, [0, 0, 10, 10, 20, 20])
+        seconds_between_depths = scan._num_lines_between_fields * scan.seconds_per_line
+        field_starts = [np.asarray(offsets)[0, 0] for offsets in scan.field_offsets]
+        self.assertTrue(np.allclose(np.diff(field_starts[::2]), seconds_between_depths))
+        self.assertEqual(scan[5].shape, (10, 16, 1, 4))
+        keys = [field_id for field_id in range(scan.num_fields)]
+        for key, item in zip(keys, scan.read_many(keys)):
+            self.assertTrue(np.array_equal(item, scan[key]))
+
+class ProfileTest(TestCase):
+    """ Test read-path instrumentation. """
+
+    def test_profile(self):
+        scan = scanreader.read_scan(scan_file_5_1_multifiles)
+        with scanreader.profile() as prof:
+            field = scan[1, :, :, 0, :3]
+            scan[:, :10, :, :, [0, 20]]
+        self.assertEqual(len(prof), 2)
+
+        record = prof.records[0]
+        self.assertEqual(record.call, 'getitem')
+        self.assertEqual(record.num_pages, 3)
+        self.assertEqual(record.num_files, 1)
+        self.assertGreaterEqual(record.bytes_read, field.nbytes) # includes gaps read through
+        self.assertGreater(record.stages['read'], 0)
+        self.assertLessEqual(sum(record.stages.values()), record.total_seconds)
+
+        # Pages across files and totals
+        self.assertEqual(prof.records[1].num_pages, scan.num_fields * scan.num_channels * 2)
+        self.assertEqual(prof.records[1].num_files, 2)
+        self.assertEqual(prof.totals()['num_pages'], prof.records[1].num_pages + 3)
+        self.assertEqual(prof.to_dicts()[0]['num_pages'], 3)
+
+        # Nothing is recorded outside the block
+        scan[0, :, :, 0, 0]
+        self.assertEqual(len(prof), 2)
+
+
+class ExplainTest(TestCase):
+    """ Test read plans and read-amplification counters. """
+
+    def test_explain(self):
+        scan = scanreader.read_scan(scan_file_5_1_multifiles)
+        key = (0, slice(10, 20), slice(None), 0, slice(None, 10))
+        plan = scan.explain(key)
+        self.assertEqual(plan.shape, scan[key].shape)
+        self.assertEqual(plan.num_pages, 10)
+        self.assertEqual(sum(plan.files.values()), 10)
+        self.assertEqual(plan.bytes_requested, 10 * scan.image_width * 10 * 2)
+        self.assertEqual(plan.bytes_read, 10 * scan.image_height * scan.image_width * 2)
+        self.assertEqual(plan.amplification, scan.image_height / 10)
+
+        # Page ranges: one page per frame (channel 0 of slice 0)
+        region = plan.field_reads[0].regions[0]
+        filename, start, stop = region.page_ranges[1]
+        page_step = scan.num_channels * scan.num_scanning_depths
+        self.assertEqual((filename, start, stop), (scan.filenames[0], page_step,
+                                                   page_step + 1))
+
+    def test_read_counters(self):
+        from scanreader import cache
+        scan = scanreader.read_scan(scan_file_2016b_multiroi_hard, join_contiguous=True)
+        with scanreader.profile() as prof:
+            field = scan[0]
+            scan[0, :, :5, 0, 0]
+        with scanreader.profile() as prof1:
+            scan[1]
+        counters = scan.read_counters
+        self.assertEqual(list(counters.num_reads[:2]), [2, 1])
+        self.assertEqual(counters.bytes_returned[0], field.nbytes + scan.field_heights[0] *
+                         5 * 2)
+        self.assertEqual(counters.bytes_read[0], prof.totals()['bytes_read'])
+        self.assertEqual(counters.bytes_read[1], prof1.totals()['bytes_read'])
+        self.assertEqual(counters.num_pages[1], prof1.totals()['num_pages'])
+        self.assertTrue(np.all(counters.amplification[:2] >= 1))
+
+        # Bytes read from disk (not planned): pages in a cache are not read
+        counters.reset()
+        self.assertEqual(counters.bytes_read.sum(), 0)
+        scan.page_cache = cache.PageCache(2 ** 28)
+        scan[1] # subfields of the joined field share pages (read once)
+        num_subfields = len(scan.explain(1).field_reads[0].regions)
+        self.assertEqual(counters.bytes_read[1], prof1.totals()['bytes_read'] // num_subfields)
+        scan[1]
+        self.assertEqual(counters.num_reads[1], 2)
+        self.assertEqual(counters.bytes_read[1], prof1.totals()['bytes_read'] // num_subfields)
+
+        # Pages shared by the keys of read_many are read (and counted) once
+        scan = scanreader.read_scan(scan_file_5_1_multifiles)
+        with scanreader.profile() as prof:
+            scan.read_many([(0, slice(None), slice(None), 0, slice(0, 4))] * 3)
+        self.assertEqual(scan.read_counters.num_reads[0], 3)
+        self.assertEqual(scan.read_counters.bytes_read.sum(), prof.totals()['bytes_read'])
+        self.assertEqual(scan.read_counters.num_pages[0], 4)
+
+
+class ViewTest(TestCase):
+    """ Test lazy views. """
+
+    def test_view(self):
+        scan = scanreader.read_scan(scan_file_5_1_multifiles)
+        with scanreader.profile() as prof:
+            view = scan.view[0][..., 10:20]
+            self.assertEqual(view.shape, (scan.image_height, scan.image_width,
+                                          scan.num_channels, 10))
+            self.assertEqual(view.nbytes, view.size * 2)
+        self.assertEqual(len(prof), 0) # nothing read yet
+
+        with scanreader.profile() as prof:
+            data = np.asarray(view)
+        self.assertEqual(len(prof), 1)
+        self.assertTrue(np.array_equal(data, scan[0, :, :, :, 10:20]))
+
+        # Composing slices, lists and integers
+        full = scan[:]
+        view = scan.view[:, ::-1][1, 5:2:-1, [3, 1]][:, :, 0, ::-3]
+        ys = list(range(scan.image_height))[::-1][5:2:-1]
+        expected = full[1][np.ix_(ys, [3, 1])][:, :, 0, ::-3]
+        self.assertEqual(view.shape, expected.shape)
+        self.assertTrue(np.array_equal(view.read(), expected))
+
+        # Iteration and errors
+        self.assertEqual(len(list(scan.view)), scan.num_fields)
+        self.assertRaises(IndexError, lambda: scan.view[0][..., scan.num_frames])
+        self.assertRaises(IndexError, lambda: scan.view[0][0, 0, 0, 0, 0])
+
+    def test_view_multiroi(self):
+        scan = scanreader.read_scan(scan_file_2016b_multiroi_hard)
+        view = scan.view[:, -5:, :3, 0, 0] # fields of different heights
+        self.assertEqual(view.shape, (scan.num_fields, 5, 3))
+        data = view.read()
+        for field_id in range(scan.num_fields):
+            self.assertTrue(np.array_equal(data[field_id], scan[field_id, -5:, :3, 0, 0]))
+        self.assertRaises(FieldDimensionMismatch, lambda: scan.view[:].shape)
+
+
+class ReductionTest(TestCase):
+    """ Test streaming numpy reductions. """
+
+    def test_reductions(self):
+        from scanreader import reductions
+        scan = scanreader.read_scan(scan_file_5_1_multifiles)
+        data = scan[:]
+
+        # Through numpy (one chunk)
+        self.assertTrue(np.allclose(np.mean(scan, axis=-1), np.mean(data, axis=-1)))
+        self.assertEqual(np.max(scan), np.max(data))
+        self.assertTrue(np.allclose(np.std(scan.view[0], axis=(0, -1)),
+                                    np.std(data[0], axis=(0, -1))))
+
+        # Chunk by chunk (a few frames at a time)
+        view = scan.view[:, :, :, 1]
+        for name in ['sum', 'mean', 'max', 'min', 'std', 'var']:
+            for axis in [-1, (0, 3), 1, None]:
+                result = reductions.reduce(view, name, axis=axis, chunk_size=7)
+                expected = getattr(np, name)(data[:, :, :, 1], axis=axis)
+                self.assertEqual(np.shape(result), np.shape(expected))
+                self.assertEqual(np.asarray(result).dtype, np.asarray(expected).dtype)
+                self.assertTrue(np.allclose(result, expected))
+        result = reductions.reduce(view, 'percentile', q=[5, 95], axis=(1, 2), chunk_size=7)
+        self.assertTrue(np.allclose(result, np.percentile(data[:, :, :, 1], [5, 95],
+                                                          axis=(1, 2))))
+
+        # Other numpy functions read the scan
+        self.assertTrue(np.array_equal(scan, data))
+
+
+class ConcurrencyTest(TestCase):
+    """ Test reading from the same scan in several threads at once. """
+
+    def test_concurrent_reads(self):
+        from concurrent.futures import ThreadPoolExecutor
+        expected = scanreader.read_scan(scan_file_5_1_multifiles)[:]
+        scan = scanreader.read_scan(scan_file_5_1_multifiles) # files not indexed yet
+
+        rng = np.random.RandomState(0)
+        keys = []
+        for _ in range(300):
+            field, channel = rng.randint(scan.num_fields), rng.randint(scan.num_channels)
+            frames = sorted(rng.choice(expected.shape[-1], size=rng.randint(1, 10),
+                                       replace=False).tolist())
+            keys.append((field, slice(rng.randint(10), None), slice(None), channel, frames))
+
+        with ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(lambda key: scan[key], keys))
+        for key, result in zip(keys, results):
+            self.assertTrue(np.array_equal(result, expected[key[:4]][..., key[4]]))
+
+        # Read counters count every read
+        num_reads = np.bincount([key[0] for key in keys], minlength=scan.num_fields)
+        self.assertEqual(scan.read_counters.num_reads.tolist(), num_reads.tolist())
+
+    def test_open_once(self):
+        from concurrent.futures import ThreadPoolExecutor
+        scan = scanreader.read_scan(scan_file_5_1_multifiles)
+        del scan.tiff_files # opened again by the first reader
+        with ThreadPoolExecutor(8) as executor:
+            tiff_files = list(executor.map(lambda _: scan.tiff_files, range(8)))
+        self.assertTrue(all(files is tiff_files[0] for files in tiff_files))
+
+
+class SparseReadTest(TestCase):
+    """ Test that nearby pages are read with a single request. """
+
+    def test_coalesced_reads(self):
+        scan = scanreader.read_scan(scan_file_5_1_multifiles)
+        expected = scan[0, :, :, 0, :]
+        page_bytes = scan.image_height * scan.image_width * 2
+
+        # Every other frame: one request (per file) reading through the gaps
+        with scanreader.profile() as prof:
+            frames = scan[0, :, :, 0, ::2]
+        self.assertTrue(np.array_equal(frames, expected[..., ::2]))
+        self.assertEqual(prof.records[0].num_reads, prof.records[0].num_files)
+        self.assertGreater(prof.records[0].bytes_read, frames.nbytes)
+
+        # No gaps allowed: one request per page, only page data read
+        scan.max_read_gap = -1
+        with scanreader.profile() as prof:
+            frames = scan[0, :, :, 0, ::2]
+        self.assertTrue(np.array_equal(frames, expected[..., ::2]))
+        self.assertEqual(prof.records[0].num_reads, frames.shape[-1])
+        self.assertEqual(prof.records[0].bytes_read, frames.shape[-1] * page_bytes)
+
+    def test_unordered_reads(self):
+        scan = scanreader.read_scan(scan_file_5_1_multifiles)
+        expected = scan[0, :, :, 0, :]
+
+        # Shuffled and repeated frames: each page read once, in file order
+        frame_list = [5, 3, 0, 4, 3, 0, 5]
+        with scanreader.profile() as prof:
+            frames = scan[0, :, :, 0, frame_list]
+        self.assertTrue(np.array_equal(frames, expected[..., frame_list]))
+        self.assertEqual(prof.records[0].num_pages, 4)
+        self.assertEqual(prof.records[0].num_reads, 1)
+        self.assertEqual(scan.explain((0, slice(None), slice(None), 0,
+                                       frame_list)).num_pages, 4)
+
+        # Reversed frames (across files)
+        with scanreader.profile() as prof:
+            frames = scan[0, :, :, 0, ::-1]
+        self.assertTrue(np.array_equal(frames, expected[..., ::-1]))
+        self.assertEqual(prof.records[0].num_reads, prof.records[0].num_files)
+
+
+class WindowsTest(TestCase):
+    """ Test reading windows of frames. """
+
+    def test_read_windows(self):
+        scan = scanreader.read_scan(scan_file_5_1_multifiles)
+        expected = scan[1, :, :, 1, :]
+
+        starts = [12, 0, 10, 3, 12] # unordered, overlapping and repeated
+        windows = scan.read_windows(1, 1, starts, 5, num_workers=3)
+        self.assertEqual(windows.shape, (5, scan.image_height, scan.image_width, 5))
+        for window, start in zip(windows, starts):
+            self.assertTrue(np.array_equal(window, expected[..., start: start + 5]))
+
+        # Overlapping windows are read once
+        with scanreader.profile() as prof:
+            scan.read_windows(1, 1, starts, 5, num_workers=1)
+        self.assertEqual(sum(record.num_pages for record in prof.records), 15)
+
+        # Windows across files, into a preallocated array
+        last_start = expected.shape[-1] - 5
+        out = np.zeros((2, scan.image_height, scan.image_width, 5), dtype=scan.dtype)
+        scan.read_windows(-2, 1, [last_start, last_start // 2], 5, out=out)
+        self.assertTrue(np.array_equal(out[0], expected[..., last_start:]))
+
+        self.assertEqual(scanreader.windows.merge_windows(np.array(starts), 5),
+                         [(0, 8), (10, 17)])
+        self.assertRaises(IndexError, lambda: scan.read_windows(1, 1, [last_start + 1], 5))
+        self.assertRaises(ValueError, lambda: scan.read_windows(1, 1, [0], 5, out=out))
+
+
+class ReadManyTest(TestCase):
+    """ Test reading many keys at once. """
+
+    def test_read_many(self):
+        scan = scanreader.read_scan(scan_file_5_1_multifiles)
+        keys = [0, (1, slice(None), slice(None), 0, [3, 1, 3]), (2, 10, slice(5, 20), 1, 4),
+                (slice(None), slice(None), slice(None), 0, slice(0, 4)),
+                (0, slice(None), slice(None), 0, slice(5, 0))]
+        items = scan.read_many(keys, num_workers=2)
+        self.assertEqual(len(items), len(keys))
+        for key, item in zip(keys, items):
+            self.assertTrue(np.array_equal(item, scan[key]))
+
+        # Keys can come from a generator
+        items = scan.read_many(key for key in keys[:2])
+        self.assertEqual(len(items), 2)
+        self.assertTrue(np.array_equal(items[1], scan[keys[1]]))
+
+        # Pages shared by several keys are read once
+        keys = [(0, slice(None), slice(None), 0, [0, 1]),
+                (0, slice(None), slice(None), 0, [1, 2])]
+        with scanreader.profile() as prof:
+            scan.read_many(keys)
+        totals = prof.totals()
+        self.assertEqual(totals['num_pages'], 3)
+        self.assertEqual(totals['cache_hits'], 0)
+
+    def test_read_many_multiroi(self):
+        scan = scanreader.read_scan(scan_file_2016b_multiroi)
+        keys = [(field, slice(None), slice(None), 0, [0, 2]) for field in
+                range(scan.num_fields)]
+        for key, item in zip(keys, scan.read_many(keys)):
+            self.assertTrue(np.array_equal(item, scan[key]))
+
+        # Rows and columns in any order, raster corrected
+        scan = scanreader.read_scan(scan_file_2016b_multiroi_hard, raster_correction=0.01)
+        keys = [(0, [9, 1, 5], slice(None, None, -3), slice(None), 1),
+                (slice(None), -1, [3, 0, 4], 0, [2, 0]), (1, 0, 0, 0, 0)]
+        for key, item in zip(keys, scan.read_many(keys)):
+            self.assertTrue(np.array_equal(item, scan[key]))
+
+
+class AsyncTest(TestCase):
+    """ Test asyncio reads (many clients reading concurrently). """
+
+    def test_many_clients(self):
+        import asyncio
+        scan = scanreader.read_scan(scan_file_5_1_multifiles)
+        expected = scan[:]
+        rng = np.random.RandomState(0)
+
+        async def client(num_requests):
+            keys = []
+            for _ in range(num_requests):
+                field, frame = rng.randint(scan.num_fields), rng.randint(expected.shape[-1])
+                keys.append((field, slice(None), slice(None), 0, slice(frame, frame + 2)))
+            results = [await scan.aread(key) for key in keys]
+            return keys, results
+
+        async def chunked_client():
+            chunks = [chunk async for chunk in scan.aiter_chunks((1, slice(None),
+                                                                  slice(None), 1), 4)]
+            return np.concatenate(chunks, axis=-1)
+
+        async def main():
+            return await asyncio.gather(chunked_client(), *[client(5) for _ in range(50)])
+
+        with scanreader.profile() as prof:
+            chunked, *clients = asyncio.run(main())
+        self.assertTrue(np.array_equal(chunked, expected[1, :, :, 1]))
+        for keys, results in clients:
+            for key, result in zip(keys, results):
+                self.assertTrue(np.array_equal(result, expected[key]))
+
+        # Concurrent requests are batched: fewer read calls than requests
+        num_batches = sum(record.call == 'read_many' for record in prof.records)
+        self.assertLess(num_batches, 50 * 5)
+
+    def test_errors_and_cancellation(self):
+        import asyncio
+        scan = scanreader.read_scan(scan_file_5_1_multifiles)
+
+        async def main():
+            # Invalid keys only fail their own request
+            results = await asyncio.gather(scan.aread((0, 0, 0, 0, 1000)), scan.aread(1),
+                                           scan.aread((0, 0.5)), return_exceptions=True)
+            self.assertIsInstance(results[0], IndexError)
+            self.assertTrue(np.array_equal(results[1], scan[1]))
+            self.assertIsInstance(results[2], TypeError)
+
+            # Identical concurrent requests get (independent) equal arrays
+            first, second = await asyncio.gather(scan.aread(0), scan.aread(0))
+            self.assertTrue(np.array_equal(first, second))
+            self.assertIsNot(first, second)
+
+            # Cancelled requests do not affect the rest
+            cancelled = asyncio.ensure_future(scan.aread(2))
+            other = asyncio.ensure_future(scan.aread((2, 0)))
+            await asyncio.sleep(0)
+            cancelled.cancel()
+            self.assertTrue(np.array_equal(await other, scan[2, 0]))
+            self.assertTrue(cancelled.cancelled())
+
+            # Stopping iteration early
+            async for chunk in scan.aiter_chunks(0, chunk_size=2):
+                break
+            self.assertEqual(chunk.shape[-1], 2)
+
+        asyncio.run(main())
+
+
+class ServerTest(TestCase):
+    """ Test serving scans to clients over a Unix socket. """
+
+    def setUp(self):
+        import tempfile
+        import threading
+        from scanreader import server
+        self.tmp_dir = tempfile.mkdtemp()
+        self.socket_path = path.join(self.tmp_dir, 'scanreader.sock')
+        self.server = server.ScanServer(self.socket_path, cache_bytes=2 ** 26)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        import shutil
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_remote_scan(self):
+        scan = scanreader.read_scan(scan_file_5_1_multifiles)
+        with scanreader.read_remote_scan(self.socket_path, scan_file_5_1_multifiles) as remote:
+            self.assertEqual(remote.shape, scan.shape)
+            self.assertEqual(remote.num_frames, scan.num_frames)
+            self.assertEqual(remote.dtype, scan.dtype)
+            self.assertEqual(len(remote), len(scan))
+            for key in [0, (1, slice(5, 20), slice(None), 1, [4, 2, 2]), (2, 10, 10, 0, 3),
+                        (slice(None), slice(None), slice(None), 0, slice(0, 10)),
+                        (0, slice(None), slice(None), 0, slice(10, 0))]:
+                self.assertTrue(np.array_equal(remote[key], scan[key]))
+            self.assertTrue(np.array_equal(np.max(remote.view[0], axis=-1),
+                                           scan[0].max(axis=-1)))
+
+            # Errors are raised in the client
+            self.assertRaises(IndexError, lambda: remote[0, :, :, 0, 1000])
+            self.assertRaises(TypeError, lambda: remote[0.5])
+            self.assertRaises(AttributeError, lambda: remote.not_an_attribute)
+
+            # Other clients share the scan and its page cache
+            with scanreader.read_remote_scan(self.socket_path,
+                                             scan_file_5_1_multifiles) as other_remote:
+                hits = remote.stats()['hits']
+                self.assertTrue(np.array_equal(other_remote[1], scan[1]))
+                stats = other_remote.stats()
+                self.assertEqual(stats['num_scans'], 1)
+                self.assertGreater(stats['hits'], hits)
+
+    def test_socket(self):
+        import os
+        import stat
+        from scanreader import server
+        self.assertEqual(stat.S_IMODE(os.stat(self.socket_path).st_mode), 0o600)
+        umask = os.umask(0o022)
+        os.umask(umask)
+        self.assertNotEqual(umask, 0o177) # restored after creating the socket
+
+        # A second server does not take the socket of a running one
+        self.assertRaises(OSError, lambda: server.ScanServer(self.socket_path))
+        with scanreader.read_remote_scan(self.socket_path, scan_file_5_1) as remote:
+            self.assertEqual(remote.num_frames, scanreader.read_scan(scan_file_5_1).num_frames)
+
+        # Files that are not sockets are not removed
+        other_path = path.join(self.tmp_dir, 'not_a_socket')
+        open(other_path, 'w').close()
+        self.assertRaises(OSError, lambda: server.ScanServer(other_path))
+        self.assertTrue(path.exists(other_path))
+
+
+class FieldCacheTest(TestCase):
+    """ Test reading fields through a disk cache of field blocks. """
+
+    def setUp(self):
+        import tempfile
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.cache_dir)
+
+    def test_field_cache(self):
+        from os import listdir
+        from scanreader import cache
+        for filename in [scan_file_5_1_multifiles, scan_file_2016b_multiroi_hard]:
+            scan = scanreader.read_scan(filename)
+            cached_scan = scanreader.read_scan(filename)
+            cached_scan.field_cache = cache.FieldCache(self.cache_dir, block_bytes=2 ** 20)
+            keys = [0, (1, slice(5, 20), slice(None), 0, [9, 2, 2, 5]),
+                    (slice(None), 3, 4, 0, slice(None, None, 7)),
+                    (0, slice(None), slice(None), 0, slice(10, 0))]
+            for key in keys: # first read (from the tiff files), then from the cache
+                self.assertTrue(np.array_equal(cached_scan[key], scan[key]))
+                self.assertTrue(np.array_equal(cached_scan[key], scan[key]))
+            self.assertTrue(np.array_equal(cached_scan.read_many(keys[:2])[1], scan[keys[1]]))
+
+            # A new cache on the same directory (e.g., another process) reads no pages
+            other_scan = scanreader.read_scan(filename)
+            other_scan.field_cache = cache.FieldCache(self.cache_dir, block_bytes=2 ** 20)
+            with scanreader.profile() as prof:
+                field = other_scan[keys[1]]
+            self.assertTrue(np.array_equal(field, scan[keys[1]]))
+            self.assertEqual(prof.totals()['num_pages'], 0)
+            self.assertGreater(prof.totals()['cache_hits'], 0)
+            self.assertEqual(other_scan.field_cache.misses, 0)
+
+        # Raster-corrected fields are stored apart
+        corrected_scan = scanreader.read_scan(scan_file_2016b_multiroi_hard,
+                                              raster_correction=0.01)
+        corrected_scan.field_cache = cache.FieldCache(self.cache_dir, block_bytes=2 ** 20)
+        self.assertTrue(np.array_equal(corrected_scan[0], scanreader.read_scan(
+            scan_file_2016b_multiroi_hard, raster_correction=0.01)[0]))
+
+        # Least recently used blocks are deleted past max_bytes, counting blocks stored by
+        # other caches on the directory (e.g., other processes)
+        field_cache = cache.FieldCache(self.cache_dir, max_bytes=2 ** 14, block_bytes=2 ** 13)
+        other_cache = cache.FieldCache(self.cache_dir, max_bytes=2 ** 14, block_bytes=2 ** 13)
+        scan.field_cache = field_cache
+        other_scan = scanreader.read_scan(scan_file_2016b_multiroi_hard)
+        other_scan.field_cache = other_cache
+        expected = scanreader.read_scan(scan_file_2016b_multiroi_hard)
+        for field_id in range(scan.num_fields):
+            self.assertTrue(np.array_equal(scan[field_id], expected[field_id]))
+            self.assertTrue(np.array_equal(other_scan[field_id], expected[field_id]))
+        self.assertLessEqual(field_cache.nbytes, 2 ** 14)
+        self.assertGreater(field_cache.misses, len(field_cache))
+        self.assertEqual(len(field_cache), len(listdir(self.cache_dir)))
+        other_cache.clear() # blocks listed by field_cache are gone
+        self.assertTrue(np.array_equal(scan[0], expected[0]))
+        field_cache.clear()
+        self.assertEqual(listdir(self.cache_dir), [])
+
+
+class SharedPageCacheTest(TestCase):
+    """ Test the page cache shared by processes. """
+
+    def setUp(self):
+        from os import getpid
+        from scanreader import cache
+        self.name = 'scanreader_test_{}'.format(getpid())
+        self.page_cache = cache.SharedPageCache(self.name, max_bytes=2 ** 20,
+                                                slot_bytes=2 ** 14) # 64 pages
+
+    def tearDown(self):
+        from scanreader import cache
+        cache.default_page_cache = None
+        self.page_cache.unlink()
+        self.page_cache.close()
+
+    def test_shared_page_cache(self):
+        import subprocess
+        import sys
+        from scanreader import cache
+        scan = scanreader.read_scan(scan_file_5_1_multifiles)
+
+        # Pages read by another process are not read again
+        code = ('import scanreader; from scanreader import cache; '
+                'cache.default_page_cache = cache.SharedPageCache({!r}); '
+                'scanreader.read_scan({!r})[0]').format(self.name, scan_file_5_1_multifiles)
+        subprocess.check_call([sys.executable, '-c', code], stdout=subprocess.DEVNULL,
+                              cwd=path.dirname(path.abspath(__file__)))
+        self.assertGreater(len(self.page_cache), 0)
+        cache.default_page_cache = self.page_cache
+        cached_scan = scanreader.read_scan(scan_file_5_1_multifiles)
+        self.assertIs(cached_scan.page_cache, self.page_cache)
+        with scanreader.profile() as prof:
+            field = cached_scan[0]
+        self.assertTrue(np.array_equal(field, scan[0]))
+        self.assertEqual(prof.totals()['num_pages'], 0)
+        self.assertEqual(prof.totals()['cache_hits'], len(self.page_cache))
+        self.assertEqual(self.page_cache.hits, len(self.page_cache))
+
+        # Pages are evicted once the slab is full
+        for key in [slice(None), (1, slice(None), slice(None), 1, slice(None, None, 3))]:
+            self.assertTrue(np.array_equal(cached_scan[key], scan[key]))
+            self.assertTrue(np.array_equal(cached_scan[key], scan[key]))
+        self.assertEqual(len(self.page_cache), self.page_cache.num_slots)
+        self.assertGreater(self.page_cache.misses, self.page_cache.num_slots)
+        self.page_cache.clear()
+        self.assertEqual(len(self.page_cache), 0)
+
+        # Pages larger than a slot are not cached
+        self.page_cache.put(('file', ), [0], [np.zeros(2 ** 14, dtype=np.int16)])
+        self.assertEqual(self.page_cache.get(('file', ), [0]), [None])
+
+    def test_lookups_during_writes(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        # Lookups (without locks) never return a page being overwritten
+        def write():
+            for i in range(2000):
+                page_id = i % 200 # more pages than slots: slots are reused
+                self.page_cache.put(('file', ), [page_id], [np.full((64, 64), page_id,
+                                                                    dtype=np.int16)])
+        def read():
+            num_hits = 0
+            for i in range(2000):
+                page, = self.page_cache.get(('file', ), [i % 200])
+                if page is not None:
+                    self.assertTrue(np.all(page == i % 200))
+                    num_hits += 1
+            return num_hits
+        with ThreadPoolExecutor(3) as executor:
+            futures = [executor.submit(write), executor.submit(read), executor.submit(read)]
+            num_hits = [future.result() for future in futures[1:]]
+        self.assertGreater(sum(num_hits), 0)
+        self.assertLessEqual(len(self.page_cache), self.page_cache.num_slots)